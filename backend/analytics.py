@@ -0,0 +1,268 @@
+"""
+Аналитика расходов MyCarExpenses
+Сводка считается по помесячным агрегатам (expense_monthly); по сырым
+расходам досчитываются только неполные месяцы на краях периода
+
+Все отчёты строятся из одного набора строк (car_id, месяц, категория, сумма,
+количество), который собирается за один проход и сворачивается в Python.
+Вместо запросов к БД этот набор можно получить из колоночного кэша
+пользователя (columnar.py, параметр columns).
+Суммы считаются в целых копейках и переводятся в рубли только в ответе.
+"""
+
+import columnar
+from units import month_of_day, month_label, month_first_day, month_last_day
+
+
+def _rollup_where(user_id, car_id=None, category=None, after_month=None, before_month=None):
+    """Условие для выборки из expense_monthly (m) с проверкой владельца (c)"""
+    where = "c.user_id = ? AND c.deleted_at IS NULL"
+    params = [user_id]
+
+    if car_id:
+        where += " AND m.car_id = ?"
+        params.append(car_id)
+    if category:
+        where += " AND m.category = ?"
+        params.append(category)
+    if after_month is not None:
+        where += " AND m.month > ?"
+        params.append(after_month)
+    if before_month is not None:
+        where += " AND m.month < ?"
+        params.append(before_month)
+
+    return where, params
+
+
+def _raw_where(user_id, car_id=None, category=None, start_day=None, end_day=None):
+    """Условие для выборки из expenses (e) с проверкой владельца (c)"""
+    where = "c.user_id = ? AND c.deleted_at IS NULL"
+    params = [user_id]
+
+    if car_id:
+        where += " AND e.car_id = ?"
+        params.append(car_id)
+    if category:
+        where += " AND e.category = ?"
+        params.append(category)
+    if start_day is not None:
+        where += " AND e.day >= ?"
+        params.append(start_day)
+    if end_day is not None:
+        where += " AND e.day <= ?"
+        params.append(end_day)
+
+    return where, params
+
+
+def _edge_ranges(start_day, end_day):
+    """Периоды, которые нужно досчитать по сырым расходам, и границы полных месяцев
+
+    Возвращает (список (месяц, первый день, последний день), months): полные
+    месяцы берутся из агрегатов при months[0] < month < months[1]; months
+    равно None, если период укладывается в один месяц и агрегаты не нужны.
+    """
+    start_month = month_of_day(start_day) if start_day is not None else None
+    end_month = month_of_day(end_day) if end_day is not None else None
+
+    if start_month is not None and start_month == end_month:
+        return [(start_month, start_day, end_day)], None
+
+    ranges = []
+    if start_month is not None:
+        ranges.append((start_month, start_day, month_last_day(start_month)))
+    if end_month is not None:
+        ranges.append((end_month, month_first_day(end_month), end_day))
+
+    return ranges, (start_month, end_month)
+
+
+def _raw_groups(conn, month, where, params):
+    # Период лежит внутри одного месяца - группировать по месяцу не нужно
+    return conn.execute(f"""
+        SELECT e.car_id, ?, e.category, SUM(e.amount_cents), COUNT(*)
+        FROM expenses e
+        JOIN cars c ON e.car_id = c.car_id
+        WHERE {where}
+        GROUP BY e.car_id, e.category
+    """, [month] + params).fetchall()
+
+
+def collect_groups(conn, user_id, car_id=None, start_day=None, end_day=None, category=None):
+    """Строки (car_id, номер месяца, категория, сумма в копейках, количество) за период
+
+    start_day и end_day - номера дней (units.to_day), включительно.
+    """
+    if start_day is not None and end_day is not None and start_day > end_day:
+        return []
+
+    groups = []
+    ranges, months = _edge_ranges(start_day, end_day)
+
+    # Полные месяцы - из агрегатов (там уже одна строка на car_id, месяц и категорию)
+    if months:
+        where, params = _rollup_where(user_id, car_id, category, *months)
+        groups.extend(conn.execute(f"""
+            SELECT m.car_id, m.month, m.category, m.total_cents, m.expense_count
+            FROM expense_monthly m
+            JOIN cars c ON m.car_id = c.car_id
+            WHERE {where}
+        """, params).fetchall())
+
+    # Неполные месяцы на краях периода - из самих расходов
+    for month, range_start, range_end in ranges:
+        where, params = _raw_where(user_id, car_id, category, range_start, range_end)
+        groups.extend(_raw_groups(conn, month, where, params))
+
+    return groups
+
+
+def _new_stats():
+    return {'total': 0, 'count': 0, 'by_category': {}}
+
+
+def _add(stats, category, amount, count):
+    stats['total'] += amount
+    stats['count'] += count
+    total, n = stats['by_category'].get(category, (0, 0))
+    stats['by_category'][category] = (total + amount, n + count)
+
+
+class Aggregate:
+    """Итоги, разрезы по категориям, месяцам и автомобилям за один проход"""
+
+    def __init__(self):
+        self.totals = _new_stats()
+        self.by_month = {}
+        self.by_car = {}
+
+    def add(self, car_id, month, category, amount, count):
+        if not count:
+            return
+
+        _add(self.totals, category, amount, count)
+        _add(self.by_month.setdefault(month, _new_stats()), category, amount, count)
+        _add(self.by_car.setdefault(car_id, _new_stats()), category, amount, count)
+
+
+def aggregate(conn, user_id, car_id=None, start_day=None, end_day=None, category=None, columns=None):
+    """Собрать все разрезы аналитики за период (по колонкам columns, если они переданы)"""
+    result = Aggregate()
+    if columns is not None:
+        grouped = columnar.aggregate(columns, car_id, start_day, end_day, category)
+        if grouped is not None:
+            result.totals, result.by_month, result.by_car = grouped
+        return result
+
+    for row in collect_groups(conn, user_id, car_id, start_day, end_day, category):
+        result.add(*row)
+    return result
+
+
+def _money(cents):
+    # Пустая сумма остаётся целым 0, как и до перехода на копейки
+    return cents / 100 if cents else 0
+
+
+def _average(total, count):
+    # Среднее округляется до копеек
+    return round(total / count / 100, 2) if count else 0
+
+
+def period_months(by_month, start_day=None, end_day=None):
+    """Календарные месяцы периода (номера месяцев)
+
+    От месяца start_day до месяца end_day; открытая граница - первый или
+    последний месяц с расходами. По ним считается average_per_month.
+    """
+    first = month_of_day(start_day) if start_day is not None else min(by_month, default=None)
+    last = month_of_day(end_day) if end_day is not None else max(by_month, default=None)
+    if first is None or last is None or first > last:
+        return range(0)
+    return range(first, last + 1)
+
+
+def _categories(stats):
+    return {category: _money(total) for category, (total, _) in stats['by_category'].items()}
+
+
+def summary(conn, user_id, car_id=None, start_day=None, end_day=None, columns=None):
+    """Сводка расходов пользователя: общая сумма, количество и суммы по категориям"""
+    result = aggregate(conn, user_id, car_id, start_day, end_day, columns=columns)
+    totals = result.totals
+    return {
+        'total_amount': _money(totals['total']),
+        'total_count': totals['count'],
+        'average_amount': _average(totals['total'], totals['count']),
+        'average_per_month': _average(totals['total'], len(period_months(result.by_month, start_day, end_day))),
+        'by_category': _categories(totals)
+    }
+
+
+def timeseries(conn, user_id, car_id=None, start_day=None, end_day=None, category=None,
+               window=None, columns=None):
+    """Помесячный ряд расходов по календарным месяцам периода (period_months);
+    месяцы без расходов заполняются нулями
+
+    window - число месяцев скользящего среднего (rolling_average у каждого месяца;
+    в начале ряда среднее по имеющимся месяцам).
+    """
+    result = aggregate(conn, user_id, car_id, start_day, end_day, category, columns)
+
+    months = period_months(result.by_month, start_day, end_day)
+
+    series = []
+    for month in months:
+        stats = result.by_month.get(month, _new_stats())
+        series.append({
+            'month': month_label(month),
+            'total_amount': _money(stats['total']),
+            'total_count': stats['count'],
+            'by_category': _categories(stats)
+        })
+
+    if window:
+        totals = [result.by_month.get(month, _new_stats())['total'] for month in months]
+        running = 0
+        for index, item in enumerate(series):
+            running += totals[index]
+            if index >= window:
+                running -= totals[index - window]
+            item['rolling_average'] = _average(running, min(index + 1, window))
+
+    totals = result.totals
+    return {
+        'total_amount': _money(totals['total']),
+        'total_count': totals['count'],
+        'average_per_month': _average(totals['total'], len(series)),
+        'months': series
+    }
+
+
+def by_car(conn, user_id, start_day=None, end_day=None, category=None, columns=None):
+    """Расходы в разрезе автомобилей пользователя (включая машины без расходов)"""
+    result = aggregate(conn, user_id, None, start_day, end_day, category, columns)
+
+    cars = conn.execute("""
+        SELECT car_id, make, model, year, license_plate
+        FROM cars WHERE user_id = ? AND deleted_at IS NULL
+        ORDER BY car_id
+    """, (user_id,)).fetchall()
+
+    items = []
+    for car_id, make, model, year, license_plate in cars:
+        stats = result.by_car.get(car_id, _new_stats())
+        items.append({
+            'car_id': car_id,
+            'make': make,
+            'model': model,
+            'year': year,
+            'license_plate': license_plate,
+            'total_amount': _money(stats['total']),
+            'total_count': stats['count'],
+            'average_amount': _average(stats['total'], stats['count']),
+            'by_category': _categories(stats)
+        })
+
+    return items
@@ -3,63 +3,571 @@ MyCarExpenses Backend API
 Простой REST API на Flask для управления расходами на автомобиль
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 import sqlite3
 import jwt
 import datetime
-from functools import wraps
+import json
+import base64
+import csv
+import io
+import hmac
+import math
+import time
+from functools import lru_cache, wraps
+
+from db import ConnectionPool
+from auth_cache import AuthCache
+from response_cache import ResponseCache, make_etag
+from passwords import PasswordHasher, HasherBusy, DEFAULT_METHOD
+from ratelimit import RateLimiter
+from writer import WriteQueue, WriterBusy
+from purge import Purger
+from jobs import Scheduler, enqueue
+from replica import Replica
+from shards import (
+    HashRing, ShardRouter, UserMoved, user_shard, set_user_shard, add_user_stub,
+    allocate_ids, run_for_user, init_shard,
+)
+from units import to_cents, from_cents, to_day, parse_day, from_day, to_currency, parse_month
+from migrations import migrate
+import analytics
+import columnar
+import reports
+import search
+import serialize
+import profiling
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
+app.config['SECRET_KEY'] = DEV_SECRET_KEY = 'your-secret-key-change-in-production'
+app.config['DATABASE'] = 'mycarexpenses.db'
+app.config['DB_POOL_SIZE'] = 8
+app.config['BATCH_MAX_ROWS'] = 10000
+# Групповая фиксация изменений: до WRITE_BATCH_SIZE изменений за WRITE_BATCH_DELAY секунд
+app.config['WRITE_BATCH_SIZE'] = 256
+app.config['WRITE_BATCH_DELAY'] = 0.002
+app.config['WRITE_QUEUE_SIZE'] = 10000
+# Очистка удалённых автомобилей: раз в PURGE_INTERVAL секунд (0 - только purge.py),
+# пачками по PURGE_BATCH_SIZE расходов, затем до PURGE_VACUUM_PAGES страниц incremental_vacuum
+app.config['PURGE_INTERVAL'] = 60
+app.config['PURGE_BATCH_SIZE'] = 500
+app.config['PURGE_VACUUM_PAGES'] = 1000
+# Фоновые задачи (jobs.py): раз в JOB_INTERVAL секунд пересчёт отчётов пользователей с изменёнными
+# данными (0 - поток не запускается, задачи выполняет python jobs.py); задача захватывается на JOB_LEASE секунд
+app.config['JOB_INTERVAL'] = 600
+app.config['JOB_LEASE'] = 300
+# Шардирование по пользователям (shards.py): DATABASE - шард 0 и каталог пользователей,
+# SHARDS - пути к дополнительным шардам 1..N (только добавляются в конец списка);
+# размещение пользователя кэшируется на SHARD_CACHE_TTL секунд
+app.config['SHARDS'] = []
+app.config['SHARD_CACHE_TTL'] = 5
+# Списки и отчёты читаются через отдельный пул только для чтения (DB_READ_POOL_SIZE), а при
+# READ_REPLICA_INTERVAL > 0 - из копии БД (replica.py), обновляемой раз в READ_REPLICA_INTERVAL
+# секунд, пока копия не старше READ_MAX_STALENESS и содержит все изменения пользователя
+app.config['DB_READ_POOL_SIZE'] = 8
+app.config['READ_REPLICA_INTERVAL'] = 0
+app.config['READ_MAX_STALENESS'] = 300
+app.config['AUTH_CACHE_SIZE'] = 10000
+app.config['AUTH_CACHE_TTL'] = 300
+app.config['RESPONSE_CACHE_BYTES'] = 32 * 1024 * 1024
+# Списки длиннее STREAM_MIN_ROWS отдаются потоком по частям и не кэшируются (serialize.py)
+app.config['STREAM_MIN_ROWS'] = 5000
+# Колоночный кэш расходов для аналитики (columnar.py, только если установлен numpy)
+app.config['COLUMN_CACHE'] = True
+app.config['COLUMN_CACHE_BYTES'] = 64 * 1024 * 1024
+app.config['PASSWORD_HASH_METHOD'] = DEFAULT_METHOD
+app.config['PASSWORD_HASH_WORKERS'] = 2
+app.config['PASSWORD_HASH_QUEUE'] = 64
+# Ограничения входа: (размер корзины, токенов в секунду)
+app.config['LOGIN_RATE_PER_IP'] = (20, 0.5)
+app.config['LOGIN_RATE_PER_EMAIL'] = (5, 0.05)
+# Число доверенных прокси перед сервером: адрес клиента для LOGIN_RATE_PER_IP берётся
+# из X-Forwarded-For (0 - адрес соединения; за прокси все клиенты делили бы одну корзину)
+app.config['TRUSTED_PROXIES'] = 0
+# Профилирование: замер SQL и фаз запроса, /metrics, Server-Timing
+app.config['PROFILING'] = False
+app.config['PROFILE_SAMPLE_RATE'] = 0.0   # Доля запросов, выполняемых под cProfile
+app.config['SLOW_REQUEST_MS'] = 500       # Профиль сохраняется для запросов медленнее порога
+app.config['PROFILE_DIR'] = 'profiles'
+# /metrics отдаётся при PROFILING или с заголовком Authorization: Bearer <METRICS_TOKEN>
+app.config['METRICS_TOKEN'] = None
+# Настройки из окружения: MYCAREXPENSES_SECRET_KEY, MYCAREXPENSES_DATABASE, MYCAREXPENSES_DB_POOL_SIZE=16,
+# MYCAREXPENSES_LOGIN_RATE_PER_IP='[20, 0.5]' и т.д. (значения разбираются как JSON)
+app.config.from_prefixed_env('MYCAREXPENSES')
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=app.config['TRUSTED_PROXIES']
+    )
+app.json = profiling.TimedJSONProvider(app)
 CORS(app)  # Разрешаем запросы с фронтенда
 
-# Инициализация базы данных
-def init_db():
-    """Создание таблиц в БД"""
-    conn = sqlite3.connect('mycarexpenses.db')
-    cursor = conn.cursor()
-
-    # Таблица пользователей
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            hashed_password TEXT NOT NULL
+# ============ СОЕДИНЕНИЯ С БД ============
+
+def shard_paths():
+    """Файлы шардов: основная БД (шард 0) и SHARDS"""
+    return [app.config['DATABASE']] + list(app.config['SHARDS'])
+
+def get_pool(shard=0):
+    """Пул соединений шарда (создаётся при первом обращении); шард 0 - основная БД"""
+    pools = app.extensions.setdefault('db_pools', {})
+    pool = pools.get(shard)
+    if pool is None:
+        factory = None
+        if app.config['PROFILING']:
+            factory = profiling.timed_connection_factory(get_metrics())
+        pool = ConnectionPool(shard_paths()[shard], max_size=app.config['DB_POOL_SIZE'], factory=factory)
+        pools[shard] = pool
+    return pool
+
+def get_db():
+    """Соединение с основной БД (пользователи, каталог шардов) для текущего запроса"""
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+def get_user_db(user_id):
+    """Соединение с шардом пользователя для текущего запроса"""
+    shard = get_shard(user_id)
+    if shard == 0:
+        return get_db()
+    conns = g.setdefault('shard_dbs', {})
+    if shard not in conns:
+        conns[shard] = get_pool(shard).acquire()
+    return conns[shard]
+
+@app.teardown_appcontext
+def release_db(exception):
+    """Возврат соединений в пулы по окончании запроса"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+    for shard, conn in g.pop('shard_dbs', {}).items():
+        get_pool(shard).release(conn)
+    read_db = g.pop('read_db', None)
+    if read_db is not None:
+        pool, conn = read_db
+        pool.release(conn)
+
+def get_reader_pool(shard=0):
+    """Пул соединений шарда только для чтения (списки и отчёты)
+
+    Читатели WAL видят последние зафиксированные изменения и не мешают писателю;
+    отдельный пул не даёт долгим отчётам занять соединения остальных запросов.
+    """
+    pools = app.extensions.setdefault('read_pools', {})
+    pool = pools.get(shard)
+    if pool is None:
+        factory = None
+        if app.config['PROFILING']:
+            factory = profiling.timed_connection_factory(get_metrics())
+        pool = ConnectionPool(
+            shard_paths()[shard], max_size=app.config['DB_READ_POOL_SIZE'],
+            pragmas={'query_only': 'ON'}, factory=factory
         )
-    """)
-
-    # Таблица автомобилей
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS cars (
-            car_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            make TEXT NOT NULL,
-            model TEXT NOT NULL,
-            year INTEGER,
-            license_plate TEXT,
-            fuel_type TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        pools[shard] = pool
+    return pool
+
+def get_replica(shard=0):
+    """Копия шарда для отчётов или None, если копии не включены"""
+    if app.config['READ_REPLICA_INTERVAL'] <= 0:
+        return None
+    replicas = app.extensions.setdefault('replicas', {})
+    replica = replicas.get(shard)
+    if replica is None:
+        replica = Replica(
+            shard_paths()[shard],
+            interval=app.config['READ_REPLICA_INTERVAL'],
+            max_staleness=app.config['READ_MAX_STALENESS'],
+            pool_size=app.config['DB_READ_POOL_SIZE']
         )
-    """)
+        replicas[shard] = replica
+        replica.start()
+    return replica
 
-    # Таблица расходов
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS expenses (
-            expense_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            car_id INTEGER NOT NULL,
-            date TEXT NOT NULL,
-            amount REAL NOT NULL,
-            category TEXT NOT NULL,
-            description TEXT,
-            FOREIGN KEY (car_id) REFERENCES cars(car_id)
+def get_read_pool(user_id):
+    """Пул для чтения списков и отчётов пользователя
+
+    Копия БД, если она свежая и уже содержит все изменения пользователя
+    (read-your-writes), иначе читатели основного файла шарда.
+    """
+    shard = get_shard(user_id)
+    replica = get_replica(shard)
+    if replica is not None and replica.covers(user_id, get_data_version(user_id)):
+        return replica.pool
+    return get_reader_pool(shard)
+
+def get_read_db(user_id):
+    """Соединение только для чтения для текущего запроса (см. get_read_pool)"""
+    if 'read_db' not in g:
+        pool = get_read_pool(user_id)
+        g.read_db = (pool, pool.acquire())
+    return g.read_db[1]
+
+def get_writer(shard=0):
+    """Очередь изменений шарда с единственным потоком-писателем"""
+    writers = app.extensions.setdefault('writers', {})
+    writer = writers.get(shard)
+    if writer is None:
+        pool = get_pool(shard)
+        writer = WriteQueue(
+            pool.acquire, pool.release,
+            max_batch=app.config['WRITE_BATCH_SIZE'],
+            max_delay=app.config['WRITE_BATCH_DELAY'],
+            max_pending=app.config['WRITE_QUEUE_SIZE']
         )
-    """)
+        writers[shard] = writer
+        # Очистка, прерванная перезапуском, продолжается с первым изменением процесса
+        get_purger(shard).start()
+        get_scheduler(shard).start()
+    return writer
+
+def get_purger(shard=0):
+    """Фоновая очистка мягко удалённых автомобилей шарда"""
+    purgers = app.extensions.setdefault('purgers', {})
+    purger = purgers.get(shard)
+    if purger is None:
+        purger = Purger(
+            lambda func, *args: write_shard(shard, func, *args),
+            interval=app.config['PURGE_INTERVAL'],
+            batch_size=app.config['PURGE_BATCH_SIZE'],
+            vacuum_pages=app.config['PURGE_VACUUM_PAGES']
+        )
+        purgers[shard] = purger
+    return purger
+
+def get_scheduler(shard=0):
+    """Фоновые задачи шарда (отчёты и аномалии)"""
+    schedulers = app.extensions.setdefault('schedulers', {})
+    scheduler = schedulers.get(shard)
+    if scheduler is None:
+        def read(func, *args):
+            with get_reader_pool(shard).connection() as conn:
+                return func(conn, *args)
+
+        scheduler = Scheduler(
+            lambda func, *args: write_shard(shard, func, *args), read,
+            interval=app.config['JOB_INTERVAL'],
+            lease=app.config['JOB_LEASE']
+        )
+        schedulers[shard] = scheduler
+    return scheduler
+
+def write_shard(shard, func, *args):
+    """Выполнить func(conn, *args) в транзакции писателя шарда и вернуть результат"""
+    with profiling.phase('write'):
+        return get_writer(shard).submit(func, *args)
+
+def write(func, *args):
+    """Изменение в основной БД (пользователи, каталог шардов)"""
+    return write_shard(0, func, *args)
+
+# Сколько раз повторить изменение, если пользователь переехал на другой шард
+MOVE_RETRIES = 3
+
+def write_user(user_id, func, *args):
+    """Изменение данных пользователя в транзакции писателя его шарда
+
+    Если пользователь тем временем перенесён на другой шард (shards.py rebalance),
+    старый шард отклоняет изменение, и оно повторяется на новом - по отметке
+    старого шарда, даже если каталог ещё не переключён.
+    """
+    if not app.config['SHARDS']:
+        return write(func, *args)
+    router = get_router()
+    for _ in range(MOVE_RETRIES):
+        try:
+            return write_shard(router.shard_of(user_id), run_for_user, user_id, func, *args)
+        except UserMoved as e:
+            router.redirect(user_id, e.shard)
+    raise WriterBusy()
+
+@app.errorhandler(WriterBusy)
+def writer_busy(e):
+    return jsonify({'message': 'Сервер перегружен, повторите позже'}), 503, {'Retry-After': '1'}
+
+# ============ ШАРДЫ ============
+
+def get_ring():
+    """Кольцо consistent hashing по всем шардам: шард нового пользователя"""
+    ring = app.extensions.get('shard_ring')
+    if ring is None:
+        ring = HashRing(range(len(shard_paths())))
+        app.extensions['shard_ring'] = ring
+    return ring
+
+def get_router():
+    """Кэш размещения пользователей по шардам"""
+    router = app.extensions.get('shard_router')
+    if router is None:
+        router = ShardRouter(lambda user_id: user_shard(get_db(), user_id), ttl=app.config['SHARD_CACHE_TTL'])
+        app.extensions['shard_router'] = router
+    return router
+
+def get_shard(user_id):
+    """Номер шарда пользователя (0, если шардирование не настроено)"""
+    if not app.config['SHARDS']:
+        return 0
+    return get_router().shard_of(user_id)
+
+def place_user(user_id, username, email):
+    """Разместить нового пользователя на шарде по кольцу; возвращает номер шарда"""
+    if not app.config['SHARDS']:
+        return 0
+    shard = get_ring().shard_for(user_id)
+    if shard == 0:
+        return 0
+    try:
+        # Сначала строка на шарде, потом каталог: каталог никогда не указывает на шард без пользователя
+        write_shard(shard, add_user_stub, user_id, username, email)
+        write(set_user_shard, user_id, shard)
+    except sqlite3.Error:
+        # Пользователь остаётся на шарде 0, rebalance перенесёт его позже
+        return 0
+    get_router().invalidate(user_id)
+    return shard
+
+def component_stats(shard=0):
+    """Статистика уже созданных пулов, писателя, очистки, задач и копии шарда
+
+    Ничего не создаёт: служебные маршруты не открывают БД и не запускают фоновые потоки.
+    """
+    result = {}
+    for name, key in (('db_pool', 'db_pools'), ('read_pool', 'read_pools'), ('writer', 'writers'),
+                      ('purge', 'purgers'), ('jobs', 'schedulers'), ('replica', 'replicas')):
+        component = app.extensions.get(key, {}).get(shard)
+        if component is not None:
+            result[name] = component.stats()
+    return result
+
+def shard_stats():
+    """Статистика дополнительных шардов: {номер: component_stats(номер)}"""
+    return {shard: component_stats(shard) for shard in range(1, len(shard_paths()))}
+
+# ============ ПРОФИЛИРОВАНИЕ ============
+
+def get_metrics():
+    """Счётчики запросов и SQL для /metrics"""
+    metrics = app.extensions.get('metrics')
+    if metrics is None:
+        metrics = profiling.Metrics()
+        app.extensions['metrics'] = metrics
+    return metrics
+
+@app.before_request
+def start_profiling():
+    if app.config['PROFILING']:
+        g.profile = profiling.start_request(app.config['PROFILE_SAMPLE_RATE'])
+
+@app.after_request
+def finish_profiling(response):
+    """Заголовок Server-Timing, метрики запроса и сохранение профиля медленного запроса"""
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+
+    profiling.finish_request(profile)
+    endpoint = request.endpoint or 'unknown'
+    response.headers['Server-Timing'] = profile.server_timing()
+    get_metrics().observe_request(endpoint, request.method, response.status_code, profile)
+
+    if profile.profiler is not None and profile.total * 1000 >= app.config['SLOW_REQUEST_MS']:
+        profiling.dump_profile(profile, app.config['PROFILE_DIR'], endpoint)
+    return response
+
+@app.teardown_request
+def cleanup_profiling(exception):
+    # after_request не вызывался (ошибка при формировании ответа)
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiling.finish_request(profile)
+
+# ============ КЭШ АВТОРИЗАЦИИ ============
+
+def get_auth_cache():
+    """Кэш проверенных токенов и автомобилей пользователей"""
+    cache = app.extensions.get('auth_cache')
+    if cache is None:
+        cache = AuthCache(max_size=app.config['AUTH_CACHE_SIZE'], ttl=app.config['AUTH_CACHE_TTL'])
+        app.extensions['auth_cache'] = cache
+    return cache
+
+def get_user_car_ids(user_id):
+    """Множество car_id пользователя (из кэша для текущей версии данных или из БД)"""
+    return get_auth_cache().get_car_ids(
+        user_id, get_data_version(user_id), lambda: load_car_ids(get_user_db(user_id), user_id)
+    )
+
+def load_car_ids(conn, user_id):
+    """(data_version, car_id не удалённых автомобилей) одним запросом - одним снимком БД"""
+    rows = conn.execute("""
+        SELECT u.data_version, c.car_id
+        FROM users u
+        LEFT JOIN cars c ON c.user_id = u.user_id AND c.deleted_at IS NULL
+        WHERE u.user_id = ?
+    """, (user_id,)).fetchall()
+    version = rows[0][0] if rows else 0
+    return version, [row[1] for row in rows if row[1] is not None]
+
+def user_owns_car(user_id, car_id):
+    """Проверка принадлежности автомобиля пользователю без запроса к БД
+
+    Изменения выполняются с повторной проверкой в транзакции писателя (check_car).
+    """
+    try:
+        car_id = int(car_id)
+    except (TypeError, ValueError):
+        return False
+    return car_id in get_user_car_ids(user_id)
+
+class NotOwned(LookupError):
+    """Автомобиль или расход не принадлежит пользователю (или уже удалён)"""
+
+def check_car(conn, user_id, car_id):
+    """Проверка принадлежности автомобиля в транзакции писателя; иначе NotOwned"""
+    row = conn.execute(
+        "SELECT 1 FROM cars WHERE car_id = ? AND user_id = ? AND deleted_at IS NULL",
+        (car_id, user_id)
+    ).fetchone()
+    if row is None:
+        raise NotOwned(car_id)
+
+# ============ КЭШ ОТВЕТОВ ============
+
+def get_response_cache():
+    """Кэш сериализованных ответов GET-запросов"""
+    cache = app.extensions.get('response_cache')
+    if cache is None:
+        cache = ResponseCache(max_bytes=app.config['RESPONSE_CACHE_BYTES'])
+        app.extensions['response_cache'] = cache
+    return cache
+
+def get_data_version(user_id):
+    """Версия данных пользователя, увеличивается триггерами при любом изменении
+
+    Читается из основного файла шарда один раз за запрос.
+    """
+    versions = g.setdefault('data_versions', {})
+    if user_id not in versions:
+        row = get_user_db(user_id).execute(
+            "SELECT data_version FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        versions[user_id] = row[0] if row else 0
+    return versions[user_id]
+
+def cached_response(f):
+    """Кэширование ответа и условный GET (ETag / If-None-Match)
+
+    Применяется после token_required: первым аргументом приходит current_user_id.
+    """
+    @wraps(f)
+    def decorated(current_user_id, *args, **kwargs):
+        query_args = tuple(sorted(request.args.items(multi=True)))
+        version = get_data_version(current_user_id)
+        etag = make_etag(current_user_id, request.endpoint, query_args, version)
+        cache = get_response_cache()
+
+        # У клиента уже актуальная версия
+        if request.if_none_match.contains(etag):
+            cache.count_not_modified()
+            response = Response(status=304)
+        else:
+            key = (current_user_id, request.endpoint, query_args)
+            cached = cache.get(key, etag)
+            if cached is not None:
+                body, mimetype = cached
+                response = Response(body, mimetype=mimetype)
+            else:
+                response = app.make_response(f(current_user_id, *args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                # Потоковый ответ не собирается в памяти, поэтому и не кэшируется
+                if not response.is_streamed:
+                    cache.put(key, etag, response.get_data(), response.mimetype)
+
+        response.set_etag(etag)
+        # Браузер хранит ответ, но перед использованием сверяет ETag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
 
-    conn.commit()
-    conn.close()
+    return decorated
+
+# ============ КОЛОНОЧНЫЙ КЭШ ============
+
+def get_column_cache():
+    """Колоночный кэш аналитики или None (выключен или не установлен numpy)"""
+    if not app.config['COLUMN_CACHE'] or not columnar.available():
+        return None
+    cache = app.extensions.get('column_cache')
+    if cache is None:
+        cache = columnar.ColumnCache(max_bytes=app.config['COLUMN_CACHE_BYTES'])
+        app.extensions['column_cache'] = cache
+    return cache
+
+def get_columns(user_id):
+    """Расходы пользователя по столбцам для аналитики или None, если кэш не используется"""
+    cache = get_column_cache()
+    if cache is None:
+        return None
+    return cache.get(
+        user_id, get_data_version(user_id),
+        lambda: columnar.load(get_read_db(user_id), user_id)
+    )
+
+def write_expenses(user_id, ids, func, *args):
+    """write_user для изменения расходов с обновлением колоночного кэша
+
+    ids(result) - expense_id расходов, изменённых func.
+    """
+    cache = get_column_cache()
+    if cache is None:
+        return write_user(user_id, func, *args)
+    result, change = write_user(user_id, columnar.track, user_id, ids, func, *args)
+    cache.apply(user_id, *change)
+    return result
+
+# ============ СЕРИАЛИЗАЦИЯ ============
+
+STREAM_BATCH_SIZE = 1000
+
+def json_body(body):
+    """Ответ из готового JSON (байты или части для потоковой отдачи)"""
+    return Response(body, mimetype=serialize.MIMETYPE)
+
+def records_response(records, rows, offset=0):
+    """Массив JSON-объектов из строк БД (serialize.Records)"""
+    with profiling.phase('json'):
+        return json_body(records.array(rows, offset))
+
+def page_response(records, rows, offset, next_cursor):
+    """Страница {'items': [...], 'next_cursor': ...} из строк БД"""
+    with profiling.phase('json'):
+        return json_body(serialize.page(records, rows, offset, next_cursor))
+
+def stream_response(records, cursor, offset=0):
+    """Массив JSON-объектов из курсора
+
+    До STREAM_MIN_ROWS строк ответ собирается целиком, длинный список
+    отдаётся по частям, пока читается курсор (соединение запроса остаётся
+    занятым до конца отдачи).
+    """
+    first = cursor.fetchmany(app.config['STREAM_MIN_ROWS'])
+    if len(first) < app.config['STREAM_MIN_ROWS']:
+        return records_response(records, first, offset)
+    return json_body(stream_with_context(records.stream(first, cursor, offset, STREAM_BATCH_SIZE)))
+
+# Инициализация базы данных
+def init_db():
+    """Создание таблиц и обновление схемы БД до последней версии"""
+    if not app.config['SHARDS']:
+        with get_pool().connection() as conn:
+            migrate(conn)
+        return
+    # Миграции и диапазоны идентификаторов каждого шарда
+    for shard in range(len(shard_paths())):
+        with get_pool(shard).connection() as conn:
+            init_shard(conn, shard)
 
 # Декоратор для проверки токена
 def token_required(f):
@@ -70,14 +578,22 @@ def token_required(f):
         if not token:
             return jsonify({'message': 'Токен отсутствует'}), 401
 
-        try:
-            # Убираем "Bearer " если есть
-            if token.startswith('Bearer '):
-                token = token[7:]
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user_id = data['user_id']
-        except:
-            return jsonify({'message': 'Неверный токен'}), 401
+        # Убираем "Bearer " если есть
+        if token.startswith('Bearer '):
+            token = token[7:]
+
+        # Уже проверенный токен не декодируем повторно
+        cache = get_auth_cache()
+        current_user_id = cache.get_user_id(token)
+
+        if current_user_id is None:
+            try:
+                with profiling.phase('auth'):
+                    data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+                current_user_id = data['user_id']
+            except:
+                return jsonify({'message': 'Неверный токен'}), 401
+            cache.put_token(token, current_user_id, data.get('exp'))
 
         return f(current_user_id, *args, **kwargs)
 
@@ -85,6 +601,36 @@ def token_required(f):
 
 # ============ АУТЕНТИФИКАЦИЯ ============
 
+def get_hasher():
+    """Хеширование паролей в пуле процессов"""
+    hasher = app.extensions.get('password_hasher')
+    if hasher is None:
+        hasher = PasswordHasher(
+            method=app.config['PASSWORD_HASH_METHOD'],
+            workers=app.config['PASSWORD_HASH_WORKERS'],
+            max_pending=app.config['PASSWORD_HASH_QUEUE']
+        )
+        app.extensions['password_hasher'] = hasher
+    return hasher
+
+def get_limiter(name):
+    """Ограничитель частоты по имени настройки (LOGIN_RATE_PER_IP, LOGIN_RATE_PER_EMAIL)"""
+    limiters = app.extensions.setdefault('rate_limiters', {})
+    if name not in limiters:
+        capacity, rate = app.config[name]
+        limiters[name] = RateLimiter(capacity, rate)
+    return limiters[name]
+
+def check_rate_limit(*checks):
+    """Проверка ограничений (имя, ключ); ответ 429 или None"""
+    for name, key in checks:
+        allowed, retry_after = get_limiter(name).acquire(key)
+        if not allowed:
+            response = jsonify({'message': 'Слишком много попыток, повторите позже'})
+            response.headers['Retry-After'] = str(math.ceil(retry_after))
+            return response, 429
+    return None
+
 @app.route('/api/register', methods=['POST'])
 def register():
     """Регистрация нового пользователя"""
@@ -97,24 +643,35 @@ def register():
     if not username or not email or not password:
         return jsonify({'message': 'Все поля обязательны'}), 400
 
-    conn = sqlite3.connect('mycarexpenses.db')
-    cursor = conn.cursor()
+    limited = check_rate_limit(('LOGIN_RATE_PER_IP', request.remote_addr))
+    if limited:
+        return limited
 
     try:
-        hashed_password = generate_password_hash(password)
-        cursor.execute(
-            "INSERT INTO users (username, email, hashed_password) VALUES (?, ?, ?)",
-            (username, email, hashed_password)
-        )
-        conn.commit()
+        with profiling.phase('hash'):
+            hashed_password = get_hasher().hash(password)
+    except HasherBusy:
+        return jsonify({'message': 'Сервер перегружен, повторите позже'}), 503
+
+    try:
+        user_id = write(insert_user, username, email, hashed_password)
+        place_user(user_id, username, email)
 
         return jsonify({'message': 'Пользователь зарегистрирован'}), 201
 
     except sqlite3.IntegrityError:
         return jsonify({'message': 'Пользователь уже существует'}), 409
 
-    finally:
-        conn.close()
+def insert_user(conn, username, email, hashed_password):
+    """Вставка пользователя в основную БД; возвращает user_id"""
+    cursor = conn.execute(
+        "INSERT INTO users (username, email, hashed_password) VALUES (?, ?, ?)",
+        (username, email, hashed_password)
+    )
+    return cursor.lastrowid
+
+def update_password_hash(conn, user_id, hashed_password):
+    conn.execute("UPDATE users SET hashed_password = ? WHERE user_id = ?", (hashed_password, user_id))
 
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -126,15 +683,34 @@ def login():
     if not email or not password:
         return jsonify({'message': 'Email и пароль обязательны'}), 400
 
-    conn = sqlite3.connect('mycarexpenses.db')
+    # Подбор паролей не должен загружать процессор хешированием
+    limited = check_rate_limit(
+        ('LOGIN_RATE_PER_IP', request.remote_addr),
+        ('LOGIN_RATE_PER_EMAIL', email.lower())
+    )
+    if limited:
+        return limited
+
+    conn = get_db()
     cursor = conn.cursor()
 
     cursor.execute("SELECT user_id, username, hashed_password FROM users WHERE email = ?", (email,))
     user = cursor.fetchone()
-    conn.close()
 
-    if not user or not check_password_hash(user[2], password):
-        return jsonify({'message': 'Неверный email или пароль'}), 401
+    hasher = get_hasher()
+    try:
+        with profiling.phase('hash'):
+            valid = user is not None and hasher.verify(user[2], password)
+        if not valid:
+            return jsonify({'message': 'Неверный email или пароль'}), 401
+
+        # Параметры хеширования изменились - пересчитываем хеш, пока пароль известен
+        if hasher.needs_rehash(user[2]):
+            with profiling.phase('hash'):
+                hashed_password = hasher.hash(password)
+            write(update_password_hash, user[0], hashed_password)
+    except HasherBusy:
+        return jsonify({'message': 'Сервер перегружен, повторите позже'}), 503
 
     # Генерация JWT токена
     token = jwt.encode({
@@ -154,31 +730,30 @@ def login():
 
 # ============ АВТОМОБИЛИ ============
 
+CAR_FIELDS = ('car_id', 'make', 'model', 'year', 'license_plate', 'fuel_type')
+CAR_RECORDS = serialize.Records(CAR_FIELDS)
+
 @app.route('/api/cars', methods=['GET'])
 @token_required
+@cached_response
 def get_cars(current_user_id):
     """Получить все автомобили пользователя"""
-    conn = sqlite3.connect('mycarexpenses.db')
+    return records_response(CAR_RECORDS, car_rows(get_read_db(current_user_id), current_user_id))
+
+def car_rows(conn, current_user_id):
+    """Автомобили пользователя строками БД (поля CAR_FIELDS)"""
     cursor = conn.cursor()
 
     cursor.execute("""
         SELECT car_id, make, model, year, license_plate, fuel_type
-        FROM cars WHERE user_id = ?
+        FROM cars WHERE user_id = ? AND deleted_at IS NULL
     """, (current_user_id,))
 
-    cars = []
-    for row in cursor.fetchall():
-        cars.append({
-            'car_id': row[0],
-            'make': row[1],
-            'model': row[2],
-            'year': row[3],
-            'license_plate': row[4],
-            'fuel_type': row[5]
-        })
+    return cursor.fetchall()
 
-    conn.close()
-    return jsonify(cars), 200
+def fetch_cars(conn, current_user_id):
+    """Автомобили пользователя в виде списка словарей"""
+    return [dict(zip(CAR_FIELDS, row)) for row in car_rows(conn, current_user_id)]
 
 @app.route('/api/cars', methods=['POST'])
 @token_required
@@ -195,95 +770,397 @@ def add_car(current_user_id):
     if not make or not model:
         return jsonify({'message': 'Марка и модель обязательны'}), 400
 
-    conn = sqlite3.connect('mycarexpenses.db')
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        INSERT INTO cars (user_id, make, model, year, license_plate, fuel_type)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (current_user_id, make, model, year, license_plate, fuel_type))
-
-    car_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    car_id = write_user(current_user_id, insert_car, current_user_id, make, model, year, license_plate, fuel_type)
+    get_auth_cache().invalidate_cars(current_user_id)
 
     return jsonify({'car_id': car_id, 'message': 'Автомобиль добавлен'}), 201
 
+def soft_delete_car(conn, user_id, car_id, deleted_at):
+    """Пометить автомобиль удалённым; строки удалит фоновая очистка (purge.py)"""
+    cursor = conn.execute(
+        "UPDATE cars SET deleted_at = ? WHERE car_id = ? AND user_id = ? AND deleted_at IS NULL",
+        (deleted_at, car_id, user_id)
+    )
+    if cursor.rowcount == 0:
+        raise NotOwned(car_id)
+
+def insert_car(conn, current_user_id, make, model, year, license_plate, fuel_type):
+    """Вставка автомобиля без фиксации транзакции; возвращает car_id"""
+    cursor = conn.execute("""
+        INSERT INTO cars (car_id, user_id, make, model, year, license_plate, fuel_type)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (allocate_ids(conn, 'cars'), current_user_id, make, model, year, license_plate, fuel_type))
+    return cursor.lastrowid
+
 @app.route('/api/cars/<int:car_id>', methods=['DELETE'])
 @token_required
 def delete_car(current_user_id, car_id):
-    """Удалить автомобиль"""
-    conn = sqlite3.connect('mycarexpenses.db')
-    cursor = conn.cursor()
+    """Удалить автомобиль
 
+    Автомобиль и его расходы сразу пропадают из выборок, сами строки
+    удаляются в фоне небольшими пачками.
+    """
     # Проверка принадлежности автомобиля пользователю
-    cursor.execute("SELECT user_id FROM cars WHERE car_id = ?", (car_id,))
-    result = cursor.fetchone()
-
-    if not result or result[0] != current_user_id:
-        conn.close()
+    if not user_owns_car(current_user_id, car_id):
         return jsonify({'message': 'Автомобиль не найден'}), 404
 
-    cursor.execute("DELETE FROM cars WHERE car_id = ?", (car_id,))
-    conn.commit()
-    conn.close()
+    try:
+        write_user(current_user_id, soft_delete_car, current_user_id, car_id, int(time.time()))
+    except NotOwned:
+        return jsonify({'message': 'Автомобиль не найден'}), 404
+    get_auth_cache().invalidate_cars(current_user_id)
+    get_purger(get_shard(current_user_id)).wake()
 
     return jsonify({'message': 'Автомобиль удален'}), 200
 
 # ============ РАСХОДЫ ============
 
+# Поля расхода в ответе по умолчанию
+EXPENSE_FIELDS = ('expense_id', 'car_id', 'date', 'amount', 'category', 'description')
+# Все поля, доступные через fields=: колонка в БД и преобразование в формат API
+# (суммы хранятся в копейках, даты - номерами дней, см. units.py)
+EXPENSE_COLUMNS = {
+    'expense_id': ('expense_id', None),
+    'car_id': ('car_id', None),
+    'date': ('day', from_day),
+    'amount': ('amount_cents', from_cents),
+    'currency': ('currency', None),
+    'category': ('category', None),
+    'description': ('description', None),
+}
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(*key):
+    """Непрозрачный курсор страницы по ключу сортировки последней записи"""
+    raw = json.dumps(list(key)).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _cursor_key(value):
+    raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+    return json.loads(raw)
+
+def decode_cursor(value):
+    """Разбор курсора (day, expense_id), ValueError если курсор испорчен"""
+    try:
+        day, expense_id = _cursor_key(value)
+        # Курсоры, выданные до перехода на номера дней, содержат дату строкой
+        if isinstance(day, str):
+            day = to_day(day)
+    except Exception:
+        raise ValueError('Неверный курсор')
+    if not isinstance(day, int) or not isinstance(expense_id, int):
+        raise ValueError('Неверный курсор')
+    return day, expense_id
+
+def decode_search_cursor(value):
+    """Разбор курсора поиска (score, day, expense_id)"""
+    try:
+        key = tuple(_cursor_key(value))
+    except Exception:
+        raise ValueError('Неверный курсор')
+    if len(key) != 3 or not all(isinstance(v, int) for v in key):
+        raise ValueError('Неверный курсор')
+    return key
+
+def parse_fields(value):
+    """Список запрошенных полей, ValueError при неизвестном поле"""
+    if not value:
+        return list(EXPENSE_FIELDS)
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in EXPENSE_COLUMNS]
+    if unknown or not fields:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown)}")
+    return fields
+
+def parse_period(args):
+    """start_date и end_date из параметров запроса в номера дней (ValueError при неверной дате)"""
+    return parse_day(args.get('start_date')), parse_day(args.get('end_date'))
+
+def expense_rows(rows, fields, offset=0):
+    """Строки БД (начиная с колонки offset) в словари формата API"""
+    converters = [(index, EXPENSE_COLUMNS[f][1]) for index, f in enumerate(fields)]
+    result = []
+    for row in rows:
+        values = list(row[offset:])
+        for index, convert in converters:
+            if convert is not None and values[index] is not None:
+                values[index] = convert(values[index])
+        result.append(dict(zip(fields, values)))
+    return result
+
+@lru_cache(maxsize=128)
+def expense_records(fields):
+    """Кодировщик строк расходов в JSON для кортежа полей fields (без словаря на строку)"""
+    return serialize.Records(fields, [EXPENSE_COLUMNS[f][1] for f in fields])
+
+def expense_filters(current_user_id, car_id=None, start_day=None, end_day=None, category=None):
+    """Условие WHERE и параметры для выборки расходов пользователя
+
+    Таблицы в запросе должны называться e (expenses) и c (cars).
+    """
+    where = "c.user_id = ? AND c.deleted_at IS NULL"
+    params = [current_user_id]
+
+    if car_id:
+        where += " AND e.car_id = ?"
+        params.append(car_id)
+    if start_day is not None:
+        where += " AND e.day >= ?"
+        params.append(start_day)
+    if end_day is not None:
+        where += " AND e.day <= ?"
+        params.append(end_day)
+    if category:
+        where += " AND e.category = ?"
+        params.append(category)
+
+    return where, params
+
 @app.route('/api/expenses', methods=['GET'])
 @token_required
+@cached_response
 def get_expenses(current_user_id):
-    """Получить все расходы пользователя"""
+    """Получить расходы пользователя
+
+    Без limit/cursor возвращается весь список (как раньше).
+    С limit возвращается страница {'items': [...], 'next_cursor': ...},
+    следующая страница запрашивается с cursor=<next_cursor>.
+    """
     car_id = request.args.get('car_id')
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
     category = request.args.get('category')
+    cursor_value = request.args.get('cursor')
+    limit = request.args.get('limit')
 
-    conn = sqlite3.connect('mycarexpenses.db')
+    try:
+        start_day, end_day = parse_period(request.args)
+        fields = parse_fields(request.args.get('fields'))
+        after = decode_cursor(cursor_value) if cursor_value else None
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    paged = limit is not None or cursor_value is not None
+    if paged:
+        try:
+            limit = int(limit) if limit is not None else 50
+        except ValueError:
+            return jsonify({'message': 'limit должен быть числом'}), 400
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            return jsonify({'message': f'limit должен быть от 1 до {MAX_PAGE_SIZE}'}), 400
+
+    filters = (car_id, start_day, end_day, category)
+    records = expense_records(tuple(fields))
+    cursor = expense_cursor(
+        get_read_db(current_user_id), current_user_id, filters, fields,
+        limit if paged else None, after
+    )
+
+    if not paged:
+        return stream_response(records, cursor, offset=2)
+
+    rows, next_cursor = split_page(cursor.fetchall(), limit)
+    return page_response(records, rows, 2, next_cursor)
+
+def fetch_expenses(conn, current_user_id, filters, fields=EXPENSE_FIELDS, limit=None, after=None):
+    """Расходы пользователя, новые первыми
+
+    filters - (car_id, start_day, end_day, category). Если задан limit,
+    возвращается одна страница и курсор следующей (или None).
+    """
+    cursor = expense_cursor(conn, current_user_id, filters, fields, limit, after)
+    rows, next_cursor = split_page(cursor.fetchall(), limit)
+    return expense_rows(rows, fields, offset=2), next_cursor
+
+def split_page(rows, limit):
+    """Строки страницы и курсор следующей (или None); rows - до limit + 1 строк expense_cursor"""
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][0], rows[-1][1])
+    return rows, next_cursor
+
+def expense_cursor(conn, current_user_id, filters, fields=EXPENSE_FIELDS, limit=None, after=None):
+    """Курсор выборки расходов: day, expense_id и колонки полей fields
+
+    С limit выбирается на одну строку больше (см. split_page).
+    """
     cursor = conn.cursor()
 
+    # day и expense_id нужны всегда - по ним строится курсор
+    columns = ', '.join(f'e.{EXPENSE_COLUMNS[f][0]}' for f in fields)
+
     # Базовый запрос с проверкой прав доступа
-    query = """
-        SELECT e.expense_id, e.car_id, e.date, e.amount, e.category, e.description
+    where, params = expense_filters(current_user_id, *filters)
+    query = f"""
+        SELECT e.day, e.expense_id, {columns}
         FROM expenses e
         JOIN cars c ON e.car_id = c.car_id
-        WHERE c.user_id = ?
+        WHERE {where}
     """
-    params = [current_user_id]
 
-    # Добавляем фильтры
-    if car_id:
-        query += " AND e.car_id = ?"
-        params.append(car_id)
-    if start_date:
-        query += " AND e.date >= ?"
-        params.append(start_date)
-    if end_date:
-        query += " AND e.date <= ?"
-        params.append(end_date)
-    if category:
-        query += " AND e.category = ?"
-        params.append(category)
+    # Продолжение после последней записи предыдущей страницы
+    if after:
+        query += " AND (e.day < ? OR (e.day = ? AND e.expense_id < ?))"
+        params.extend([after[0], after[0], after[1]])
+
+    query += " ORDER BY e.day DESC, e.expense_id DESC"
 
-    query += " ORDER BY e.date DESC"
+    if limit is not None:
+        # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+        query += " LIMIT ?"
+        params.append(limit + 1)
 
     cursor.execute(query, params)
+    return cursor
+
+SEARCH_PAGE_SIZE = 20
+
+@app.route('/api/expenses/search', methods=['GET'])
+@token_required
+@cached_response
+def search_expenses(current_user_id):
+    """Полнотекстовый поиск по описанию расхода, марке и модели автомобиля
+
+    q - слова через пробел (ищутся все, с учетом окончаний). Фильтры - как у
+    GET /api/expenses. Ответ - страница {'items': [...], 'next_cursor': ...},
+    самые релевантные и новые первыми.
+    """
+    cursor_value = request.args.get('cursor')
+
+    try:
+        terms = search.query_terms(request.args.get('q', ''))
+        start_day, end_day = parse_period(request.args)
+        fields = parse_fields(request.args.get('fields'))
+        after = decode_search_cursor(cursor_value) if cursor_value else None
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        limit = int(request.args.get('limit', SEARCH_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'message': 'limit должен быть числом'}), 400
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return jsonify({'message': f'limit должен быть от 1 до {MAX_PAGE_SIZE}'}), 400
+
+    filters = (request.args.get('car_id'), start_day, end_day, request.args.get('category'))
+    rows, next_cursor = fetch_search(get_read_db(current_user_id), current_user_id, terms, filters, fields, limit, after)
+
+    return page_response(expense_records(tuple(fields)), rows, 3, next_cursor)
+
+def fetch_search(conn, current_user_id, terms, filters, fields=EXPENSE_FIELDS, limit=SEARCH_PAGE_SIZE, after=None):
+    """Страница результатов поиска строками БД (поля с колонки 3) и курсор следующей (или None)
+
+    FTS5 отбирает расходы пользователя по основам слов, релевантность считает
+    SQL (search.score_sql). Порядок - (score, day, expense_id) по убыванию,
+    курсор - ключ последней записи страницы; условие курсора и LIMIT - в запросе.
+    """
+    columns = ', '.join(f'e.{EXPENSE_COLUMNS[f][0]}' for f in fields)
+    where, params = expense_filters(current_user_id, *filters)
+    score, score_params = search.score_sql(current_user_id, terms)
+    query = f"""
+        SELECT * FROM (
+            SELECT {score} AS score, e.day AS day, e.expense_id AS expense_id, {columns}
+            FROM expense_search s
+            JOIN expenses e ON e.expense_id = s.rowid
+            JOIN cars c ON e.car_id = c.car_id
+            WHERE expense_search MATCH ? AND {where}
+        )
+    """
+    params = score_params + [search.match_expression(current_user_id, terms)] + params
+
+    # Продолжение после последней записи предыдущей страницы
+    if after:
+        query += " WHERE (score, day, expense_id) < (?, ?, ?)"
+        params.extend(after)
 
-    expenses = []
-    for row in cursor.fetchall():
-        expenses.append({
-            'expense_id': row[0],
-            'car_id': row[1],
-            'date': row[2],
-            'amount': row[3],
-            'category': row[4],
-            'description': row[5]
-        })
+    # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+    query += " ORDER BY score DESC, day DESC, expense_id DESC LIMIT ?"
+    params.append(limit + 1)
 
-    conn.close()
-    return jsonify(expenses), 200
+    rows = conn.execute(query, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*rows[-1][:3])
+    return rows, next_cursor
+
+EXPORT_BATCH_SIZE = 1000
+
+@app.route('/api/expenses/export', methods=['GET'])
+@token_required
+def export_expenses(current_user_id):
+    """Выгрузка расходов пользователя в NDJSON или CSV
+
+    Строки читаются из курсора пачками и сразу отдаются клиенту,
+    поэтому память не зависит от количества расходов.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'message': 'Формат должен быть ndjson или csv'}), 400
+
+    try:
+        start_day, end_day = parse_period(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    where, params = expense_filters(
+        current_user_id,
+        request.args.get('car_id'),
+        start_day,
+        end_day,
+        request.args.get('category')
+    )
+    columns = ', '.join(f'e.{EXPENSE_COLUMNS[f][0]}' for f in EXPENSE_FIELDS)
+    query = f"""
+        SELECT {columns}
+        FROM expenses e
+        JOIN cars c ON e.car_id = c.car_id
+        WHERE {where}
+        ORDER BY e.day DESC, e.expense_id DESC
+    """
+
+    pool = get_read_pool(current_user_id)
+    records = expense_records(EXPENSE_FIELDS)
+
+    def generate():
+        # Своё соединение из пула: генератор работает уже после выхода из обработчика
+        with pool.connection() as conn:
+            cursor = conn.execute(query, params)
+
+            if export_format == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                # BOM, чтобы Excel правильно открыл кириллицу
+                buffer.write('\ufeff')
+                writer.writerow(EXPENSE_FIELDS)
+
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+
+                if export_format == 'csv':
+                    items = expense_rows(rows, EXPENSE_FIELDS)
+                    writer.writerows(item.values() for item in items)
+                    chunk = buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                    yield chunk.encode('utf-8')
+                else:
+                    yield records.lines(rows)
+
+            if export_format == 'csv' and buffer.tell():
+                yield buffer.getvalue().encode('utf-8')
+
+    if export_format == 'csv':
+        mimetype = 'text/csv; charset=utf-8'
+        filename = 'my_car_expenses.csv'
+    else:
+        mimetype = 'application/x-ndjson'
+        filename = 'my_car_expenses.ndjson'
+
+    return Response(generate(), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}'
+    })
 
 @app.route('/api/expenses', methods=['POST'])
 @token_required
@@ -300,27 +1177,169 @@ def add_expense(current_user_id):
     if not car_id or not date or not amount or not category:
         return jsonify({'message': 'Обязательные поля: car_id, date, amount, category'}), 400
 
-    conn = sqlite3.connect('mycarexpenses.db')
-    cursor = conn.cursor()
+    try:
+        day = to_day(date)
+        amount_cents = to_cents(amount)
+        currency = to_currency(data.get('currency'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
     # Проверка принадлежности автомобиля пользователю
-    cursor.execute("SELECT user_id FROM cars WHERE car_id = ?", (car_id,))
-    result = cursor.fetchone()
+    if not user_owns_car(current_user_id, car_id):
+        return jsonify({'message': 'Автомобиль не найден'}), 404
 
-    if not result or result[0] != current_user_id:
-        conn.close()
+    try:
+        expense_id = write_expenses(
+            current_user_id, lambda expense_id: (expense_id,),
+            insert_expense, current_user_id, car_id, day, amount_cents, currency, category, description
+        )
+    except NotOwned:
         return jsonify({'message': 'Автомобиль не найден'}), 404
 
-    cursor.execute("""
-        INSERT INTO expenses (car_id, date, amount, category, description)
-        VALUES (?, ?, ?, ?, ?)
-    """, (car_id, date, amount, category, description))
+    return jsonify({'expense_id': expense_id, 'message': 'Расход добавлен'}), 201
 
-    expense_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+def insert_expense(conn, user_id, car_id, day, amount_cents, currency, category, description):
+    """Вставка расхода без фиксации транзакции; возвращает expense_id
 
-    return jsonify({'expense_id': expense_id, 'message': 'Расход добавлен'}), 201
+    Автомобиль, удалённый после проверки в обработчике, - NotOwned.
+    """
+    check_car(conn, user_id, car_id)
+    cursor = conn.execute("""
+        INSERT INTO expenses (expense_id, car_id, day, amount_cents, currency, category, description)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (allocate_ids(conn, 'expenses'), car_id, day, amount_cents, currency, category, description))
+    return cursor.lastrowid
+
+def read_batch_rows():
+    """Строки пакетного импорта из JSON-массива или CSV
+
+    CSV принимается как файл (multipart, поле file) или как тело запроса
+    с Content-Type text/csv; первая строка - заголовок с именами полей.
+    """
+    if 'file' in request.files:
+        text = request.files['file'].read().decode('utf-8-sig')
+        return list(csv.DictReader(io.StringIO(text)))
+
+    if request.mimetype == 'text/csv':
+        text = request.get_data().decode('utf-8-sig')
+        return list(csv.DictReader(io.StringIO(text)))
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('expenses')
+    if not isinstance(data, list):
+        raise ValueError('Ожидается массив расходов или CSV-файл')
+    return data
+
+def validate_batch_row(row):
+    """Проверка и приведение типов одной строки импорта"""
+    if not isinstance(row, dict):
+        raise ValueError('Строка должна быть объектом')
+
+    car_id = row.get('car_id')
+    date = row.get('date')
+    amount = row.get('amount')
+    category = row.get('category')
+    description = row.get('description') or ''
+
+    if not car_id or not date or not amount or not category:
+        raise ValueError('Обязательные поля: car_id, date, amount, category')
+
+    try:
+        car_id = int(car_id)
+        amount_cents = to_cents(amount)
+    except (TypeError, ValueError):
+        raise ValueError('car_id и amount должны быть числами')
+
+    return car_id, to_day(date), amount_cents, to_currency(row.get('currency')), category, description
+
+def insert_expense_rows(conn, user_id, rows):
+    """Вставка расходов одним executemany; возвращает expense_id по строкам
+
+    Выполняется в транзакции писателя: других писателей нет, и AUTOINCREMENT
+    выдаёт идентификаторы подряд - по последнему восстанавливаем все.
+    На шарде идентификаторы подряд выдаёт его диапазон (allocate_ids).
+    Строки автомобилей, удалённых после проверки в обработчике, пропускаются
+    (expense_id None).
+    """
+    _, owned_cars = load_car_ids(conn, user_id)
+    owned_cars = set(owned_cars)
+    kept = [row for row in rows if row[0] in owned_cars]
+    if not kept:
+        return [None] * len(rows)
+
+    first_id = allocate_ids(conn, 'expenses', len(kept))
+    if first_id is not None:
+        conn.executemany("""
+            INSERT INTO expenses (expense_id, car_id, day, amount_cents, currency, category, description)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, ((first_id + offset, *row) for offset, row in enumerate(kept)))
+    else:
+        cursor = conn.executemany("""
+            INSERT INTO expenses (car_id, day, amount_cents, currency, category, description)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, kept)
+        last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+        first_id = last_id - len(kept) + 1
+
+    ids = iter(range(first_id, first_id + len(kept)))
+    return [next(ids) if row[0] in owned_cars else None for row in rows]
+
+@app.route('/api/expenses/batch', methods=['POST'])
+@token_required
+def add_expenses_batch(current_user_id):
+    """Пакетное добавление расходов одной транзакцией
+
+    Возвращает результат по каждой строке: expense_id или текст ошибки.
+    Строки с ошибками пропускаются, остальные добавляются.
+    """
+    try:
+        rows = read_batch_rows()
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'message': str(e)}), 400
+
+    max_rows = app.config['BATCH_MAX_ROWS']
+    if not rows:
+        return jsonify({'message': 'Нет данных для импорта'}), 400
+    if len(rows) > max_rows:
+        return jsonify({'message': f'Не более {max_rows} расходов за один запрос'}), 400
+
+    # Принадлежность автомобилей проверяется один раз для всех строк
+    owned_cars = get_user_car_ids(current_user_id)
+
+    results = []
+    valid = []
+    for index, row in enumerate(rows):
+        try:
+            values = validate_batch_row(row)
+        except ValueError as e:
+            results.append({'index': index, 'status': 'error', 'message': str(e)})
+            continue
+
+        if values[0] not in owned_cars:
+            results.append({'index': index, 'status': 'error', 'message': 'Автомобиль не найден'})
+            continue
+
+        results.append({'index': index, 'status': 'ok'})
+        valid.append((index, values))
+
+    if valid:
+        expense_ids = write_expenses(
+            current_user_id, lambda ids: [i for i in ids if i is not None],
+            insert_expense_rows, current_user_id, [values for _, values in valid]
+        )
+        for expense_id, (index, _) in zip(expense_ids, valid):
+            if expense_id is None:
+                results[index] = {'index': index, 'status': 'error', 'message': 'Автомобиль не найден'}
+            else:
+                results[index]['expense_id'] = expense_id
+
+    inserted = sum(1 for result in results if result['status'] == 'ok')
+    return jsonify({
+        'inserted': inserted,
+        'failed': len(rows) - inserted,
+        'results': results
+    }), 201 if inserted else 400
 
 @app.route('/api/expenses/<int:expense_id>', methods=['PUT'])
 @token_required
@@ -328,147 +1347,376 @@ def update_expense(current_user_id, expense_id):
     """Обновить расход"""
     data = request.json
 
-    conn = sqlite3.connect('mycarexpenses.db')
-    cursor = conn.cursor()
-
-    # Проверка прав доступа
-    cursor.execute("""
-        SELECT e.expense_id FROM expenses e
-        JOIN cars c ON e.car_id = c.car_id
-        WHERE e.expense_id = ? AND c.user_id = ?
-    """, (expense_id, current_user_id))
+    # Проверка прав доступа: автомобиль расхода ищем по первичному ключу,
+    # принадлежность автомобиля проверяем в памяти
+    car_id = expense_car_id(get_user_db(current_user_id), expense_id)
 
-    if not cursor.fetchone():
-        conn.close()
+    if car_id is None or not user_owns_car(current_user_id, car_id):
         return jsonify({'message': 'Расход не найден'}), 404
 
-    # Обновление полей
-    updates = []
-    params = []
-
-    if 'date' in data:
-        updates.append("date = ?")
-        params.append(data['date'])
-    if 'amount' in data:
-        updates.append("amount = ?")
-        params.append(data['amount'])
-    if 'category' in data:
-        updates.append("category = ?")
-        params.append(data['category'])
-    if 'description' in data:
-        updates.append("description = ?")
-        params.append(data['description'])
-
+    try:
+        updates = expense_updates(data)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     if not updates:
-        conn.close()
         return jsonify({'message': 'Нет данных для обновления'}), 400
 
-    params.append(expense_id)
-    query = f"UPDATE expenses SET {', '.join(updates)} WHERE expense_id = ?"
-
-    cursor.execute(query, params)
-    conn.commit()
-    conn.close()
+    try:
+        write_expenses(
+            current_user_id, lambda _: (expense_id,), update_expense_row, current_user_id, expense_id, updates
+        )
+    except NotOwned:
+        return jsonify({'message': 'Расход не найден'}), 404
 
     return jsonify({'message': 'Расход обновлен'}), 200
 
+def expense_car_id(conn, expense_id):
+    """car_id расхода или None, если расхода нет"""
+    row = conn.execute("SELECT car_id FROM expenses WHERE expense_id = ?", (expense_id,)).fetchone()
+    return row[0] if row else None
+
+# Изменяемые поля расхода: поле API -> (колонка, преобразование)
+EXPENSE_UPDATES = {
+    'date': ('day', to_day),
+    'amount': ('amount_cents', to_cents),
+    'currency': ('currency', to_currency),
+    'category': ('category', None),
+    'description': ('description', None),
+}
+
+def expense_updates(data):
+    """Изменяемые поля расхода из тела запроса: список (колонка, значение)
+
+    ValueError, если дата, сумма или валюта в неверном формате.
+    """
+    updates = []
+    for field, (column, convert) in EXPENSE_UPDATES.items():
+        if field in data:
+            value = data[field]
+            updates.append((column, convert(value) if convert else value))
+    return updates
+
+# Расход не удалённого автомобиля пользователя (проверка в транзакции писателя)
+OWNED_EXPENSE = """
+    expense_id = ? AND car_id IN (SELECT car_id FROM cars WHERE user_id = ? AND deleted_at IS NULL)
+"""
+
+def delete_expense_row(conn, user_id, expense_id):
+    cursor = conn.execute("DELETE FROM expenses WHERE" + OWNED_EXPENSE, (expense_id, user_id))
+    if cursor.rowcount == 0:
+        raise NotOwned(expense_id)
+
+def update_expense_row(conn, user_id, expense_id, updates):
+    """Обновление полей расхода без фиксации транзакции; NotOwned, если расход не пользователя"""
+    assignments = ', '.join(f"{field} = ?" for field, _ in updates)
+    params = [value for _, value in updates] + [expense_id, user_id]
+    cursor = conn.execute(f"UPDATE expenses SET {assignments} WHERE" + OWNED_EXPENSE, params)
+    if cursor.rowcount == 0:
+        raise NotOwned(expense_id)
+
 @app.route('/api/expenses/<int:expense_id>', methods=['DELETE'])
 @token_required
 def delete_expense(current_user_id, expense_id):
     """Удалить расход"""
-    conn = sqlite3.connect('mycarexpenses.db')
-    cursor = conn.cursor()
-
-    # Проверка прав доступа
-    cursor.execute("""
-        SELECT e.expense_id FROM expenses e
-        JOIN cars c ON e.car_id = c.car_id
-        WHERE e.expense_id = ? AND c.user_id = ?
-    """, (expense_id, current_user_id))
+    # Проверка прав доступа: автомобиль расхода ищем по первичному ключу,
+    # принадлежность автомобиля проверяем в памяти
+    car_id = expense_car_id(get_user_db(current_user_id), expense_id)
 
-    if not cursor.fetchone():
-        conn.close()
+    if car_id is None or not user_owns_car(current_user_id, car_id):
         return jsonify({'message': 'Расход не найден'}), 404
 
-    cursor.execute("DELETE FROM expenses WHERE expense_id = ?", (expense_id,))
-    conn.commit()
-    conn.close()
+    try:
+        write_expenses(current_user_id, lambda _: (expense_id,), delete_expense_row, current_user_id, expense_id)
+    except NotOwned:
+        return jsonify({'message': 'Расход не найден'}), 404
 
     return jsonify({'message': 'Расход удален'}), 200
 
 # ============ АНАЛИТИКА ============
 
+MAX_ROLLING_WINDOW = 120
+
 @app.route('/api/analytics/summary', methods=['GET'])
 @token_required
+@cached_response
 def get_summary(current_user_id):
     """Получить сводную статистику"""
     car_id = request.args.get('car_id')
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
+    try:
+        start_day, end_day = parse_period(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    conn = sqlite3.connect('mycarexpenses.db')
-    cursor = conn.cursor()
+    conn = get_read_db(current_user_id)
 
-    # Общая сумма расходов
-    query = """
-        SELECT SUM(e.amount), COUNT(e.expense_id)
-        FROM expenses e
-        JOIN cars c ON e.car_id = c.car_id
-        WHERE c.user_id = ?
+    # Полные месяцы берутся из помесячных агрегатов, края периода - из расходов;
+    # при колоночном кэше группы считаются по нему
+    result = analytics.summary(
+        conn, current_user_id, car_id, start_day, end_day, columns=get_columns(current_user_id)
+    )
+
+    return jsonify(result), 200
+
+@app.route('/api/analytics/timeseries', methods=['GET'])
+@token_required
+@cached_response
+def get_timeseries(current_user_id):
+    """Помесячный ряд расходов для графиков
+
+    window - число месяцев скользящего среднего (rolling_average).
     """
-    params = [current_user_id]
+    try:
+        start_day, end_day = parse_period(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    if car_id:
-        query += " AND e.car_id = ?"
-        params.append(car_id)
-    if start_date:
-        query += " AND e.date >= ?"
-        params.append(start_date)
-    if end_date:
-        query += " AND e.date <= ?"
-        params.append(end_date)
+    window = request.args.get('window')
+    if window is not None:
+        try:
+            window = int(window)
+        except ValueError:
+            return jsonify({'message': 'window должен быть числом'}), 400
+        if window < 1 or window > MAX_ROLLING_WINDOW:
+            return jsonify({'message': f'window должен быть от 1 до {MAX_ROLLING_WINDOW}'}), 400
+
+    conn = get_read_db(current_user_id)
+
+    result = analytics.timeseries(
+        conn, current_user_id,
+        car_id=request.args.get('car_id'),
+        start_day=start_day,
+        end_day=end_day,
+        category=request.args.get('category'),
+        window=window,
+        columns=get_columns(current_user_id)
+    )
+
+    return jsonify(result), 200
+
+@app.route('/api/analytics/by-car', methods=['GET'])
+@token_required
+@cached_response
+def get_by_car(current_user_id):
+    """Расходы в разрезе автомобилей"""
+    try:
+        start_day, end_day = parse_period(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    cursor.execute(query, params)
-    total, count = cursor.fetchone()
+    conn = get_read_db(current_user_id)
 
-    # Расходы по категориям
-    query_cat = """
-        SELECT e.category, SUM(e.amount)
-        FROM expenses e
-        JOIN cars c ON e.car_id = c.car_id
-        WHERE c.user_id = ?
+    result = analytics.by_car(
+        conn, current_user_id,
+        start_day=start_day,
+        end_day=end_day,
+        category=request.args.get('category'),
+        columns=get_columns(current_user_id)
+    )
+
+    return jsonify(result), 200
+
+# ============ ДАШБОРД ============
+
+DASHBOARD_PAGE_SIZE = 50
+
+@app.route('/api/dashboard', methods=['GET'])
+@token_required
+@cached_response
+def get_dashboard(current_user_id):
+    """Данные главной страницы одним запросом
+
+    Автомобили, первая страница последних расходов и сводка за период
+    (start_date / end_date) читаются в одной транзакции, поэтому согласованы
+    между собой. Период относится только к сводке: расходы берутся без фильтров,
+    и next_cursor продолжает GET /api/expenses без фильтров.
     """
-    params_cat = [current_user_id]
+    try:
+        start_day, end_day = parse_period(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    if car_id:
-        query_cat += " AND e.car_id = ?"
-        params_cat.append(car_id)
-    if start_date:
-        query_cat += " AND e.date >= ?"
-        params_cat.append(start_date)
-    if end_date:
-        query_cat += " AND e.date <= ?"
-        params_cat.append(end_date)
+    try:
+        limit = int(request.args.get('limit', DASHBOARD_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'message': 'limit должен быть числом'}), 400
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return jsonify({'message': f'limit должен быть от 1 до {MAX_PAGE_SIZE}'}), 400
+
+    return jsonify(fetch_dashboard(get_read_db(current_user_id), current_user_id, start_day, end_day, limit)), 200
+
+def fetch_dashboard(conn, current_user_id, start_day, end_day, limit=DASHBOARD_PAGE_SIZE):
+    """Автомобили, первая страница расходов и сводка, прочитанные из одного снимка БД"""
+    conn.execute("BEGIN")
+    try:
+        cars = fetch_cars(conn, current_user_id)
+        expenses, next_cursor = fetch_expenses(conn, current_user_id, (None, None, None, None), limit=limit)
+        summary = analytics.summary(conn, current_user_id, None, start_day, end_day)
+    finally:
+        conn.rollback()
+
+    return {
+        'cars': cars,
+        'expenses': {
+            'items': expenses,
+            'next_cursor': next_cursor
+        },
+        'summary': summary
+    }
+
+# ============ ОТЧЁТЫ ============
+
+ANOMALIES_PAGE_SIZE = 50
+
+def report_status(conn, current_user_id):
+    """Состояние отчётов пользователя: когда построены и соответствуют ли текущим данным"""
+    state, pending = reports.status(conn, current_user_id)
+    return {
+        'computed_at': datetime.datetime.fromtimestamp(state[1], datetime.timezone.utc).isoformat() if state else None,
+        'up_to_date': state is not None and state[0] == get_data_version(current_user_id),
+        'pending': pending
+    }
+
+def json_items(status, items):
+    """Ответ {"status": ..., "items": [...]} из готовых JSON отчётов без повторного разбора"""
+    body = '{"status": %s, "items": [%s]}' % (json.dumps(status), ', '.join(items))
+    return Response(body, mimetype='application/json')
+
+@app.route('/api/reports/monthly', methods=['GET'])
+@token_required
+def get_monthly_reports(current_user_id):
+    """Готовые помесячные отчёты за период (start_month / end_month, YYYY-MM)"""
+    try:
+        start_month = parse_month(request.args.get('start_month'))
+        end_month = parse_month(request.args.get('end_month'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    query_cat += " GROUP BY e.category"
+    conn = get_user_db(current_user_id)
+    items = reports.fetch_reports(conn, current_user_id, start_month, end_month)
+    return json_items(report_status(conn, current_user_id), items)
 
-    cursor.execute(query_cat, params_cat)
-    categories = {}
-    for row in cursor.fetchall():
-        categories[row[0]] = row[1]
+@app.route('/api/reports/monthly/<month>', methods=['GET'])
+@token_required
+def get_monthly_report(current_user_id, month):
+    """Готовый отчёт за месяц YYYY-MM"""
+    try:
+        month = parse_month(month)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    conn.close()
+    report = reports.fetch_report(get_user_db(current_user_id), current_user_id, month)
+    if report is None:
+        return jsonify({'message': 'Отчёт не найден'}), 404
+    return Response(report, mimetype='application/json')
 
+@app.route('/api/reports/anomalies', methods=['GET'])
+@token_required
+def get_anomalies(current_user_id):
+    """Последние аномалии расходов (сначала новые)"""
+    try:
+        limit = int(request.args.get('limit', ANOMALIES_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'message': 'limit должен быть числом'}), 400
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return jsonify({'message': f'limit должен быть от 1 до {MAX_PAGE_SIZE}'}), 400
+
+    conn = get_user_db(current_user_id)
     return jsonify({
-        'total_amount': total or 0,
-        'total_count': count or 0,
-        'by_category': categories
+        'status': report_status(conn, current_user_id),
+        'items': reports.fetch_anomalies(conn, current_user_id, limit)
     }), 200
 
+@app.route('/api/reports/refresh', methods=['POST'])
+@token_required
+def refresh_reports(current_user_id):
+    """Поставить пересчёт отчётов пользователя в очередь"""
+    write_user(current_user_id, enqueue, 'reports', current_user_id, int(time.time()))
+    get_scheduler(get_shard(current_user_id)).wake()
+    return jsonify({'message': 'Пересчёт отчётов запланирован'}), 202
+
+# ============ СЛУЖЕБНОЕ ============
+
+def service_stats():
+    """Статистика пулов, кэшей, писателей и фоновых задач для /api/health и /metrics"""
+    result = component_stats()
+    for name, key in (('auth_cache', 'auth_cache'), ('response_cache', 'response_cache'),
+                      ('column_cache', 'column_cache'), ('shard_router', 'shard_router')):
+        component = app.extensions.get(key)
+        if component is not None:
+            result[name] = component.stats()
+    return result
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Состояние сервиса, статистика пула соединений и кэшей"""
+    result = {
+        'status': 'ok',
+        **service_stats(),
+        'json': serialize.backend(),
+        'rate_limits': {
+            name: limiter.stats()
+            for name, limiter in app.extensions.get('rate_limiters', {}).items()
+        }
+    }
+    if app.config['SHARDS']:
+        result['shards'] = shard_stats()
+    return jsonify(result), 200
+
+def metrics_allowed():
+    """Доступ к /metrics: токен METRICS_TOKEN, если задан, иначе только при PROFILING"""
+    token = app.config['METRICS_TOKEN']
+    if token:
+        header = request.headers.get('Authorization', '')
+        return header.startswith('Bearer ') and hmac.compare_digest(header[7:], token)
+    return app.config['PROFILING']
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    if not metrics_allowed():
+        return jsonify({'message': 'Метрики недоступны'}), 404
+    gauges = service_stats()
+    if app.config['SHARDS']:
+        for shard, stats in shard_stats().items():
+            for name, values in stats.items():
+                gauges[f'shard{shard}_{name}'] = values
+    body = get_metrics().render(gauges)
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
 # ============ ЗАПУСК ============
 
+def close_databases():
+    """Остановить фоновые задачи, очистку, писателей и копии и закрыть пулы всех шардов"""
+    # Задачи и очистка пишут через писателя, поэтому останавливаются первыми
+    for scheduler in app.extensions.pop('schedulers', {}).values():
+        scheduler.close()
+    for purger in app.extensions.pop('purgers', {}).values():
+        purger.close()
+    for replica in app.extensions.pop('replicas', {}).values():
+        replica.close()
+    for pool in app.extensions.pop('read_pools', {}).values():
+        pool.close_all()
+    for writer in app.extensions.pop('writers', {}).values():
+        writer.close()
+    for pool in app.extensions.pop('db_pools', {}).values():
+        pool.close_all()
+    app.extensions.pop('shard_ring', None)
+    app.extensions.pop('shard_router', None)
+
+def release_resources():
+    """Закрыть соединения пула и пул процессов хеширования
+
+    Вызывается перед fork рабочих процессов и при их остановке (serve.py).
+    """
+    close_databases()
+    hasher = app.extensions.pop('password_hasher', None)
+    if hasher is not None:
+        hasher.shutdown()
+
+# Сервер разработки; для работы под нагрузкой - serve.py
 if __name__ == '__main__':
     init_db()
     print("База данных инициализирована")
     print("Сервер запущен на http://localhost:5000")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Отладчик и перезагрузка: MYCAREXPENSES_DEBUG=true
+    app.run(host='0.0.0.0', port=5000)
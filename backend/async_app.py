@@ -0,0 +1,505 @@
+"""
+MyCarExpenses Backend API - асинхронный вариант (Quart, ASGI)
+Те же маршруты и форматы ответов, что в app.py, для регистрации, входа,
+автомобилей, расходов, сводки и дашборда. Обработчики не занимают поток на
+время запроса к БД: чтения идут через пул потоков-читателей, изменения - через
+одну задачу-писателя (async_db.py). SQL-запросы общие с app.py.
+
+Запуск:
+    MYCAREXPENSES_SECRET_KEY=... hypercorn async_app:app --bind 0.0.0.0:5000
+    python async_app.py
+"""
+
+import asyncio
+import datetime
+import math
+import os
+import sqlite3
+import time
+from functools import wraps
+
+import jwt
+from quart import Quart, request, jsonify, g
+from quart_cors import cors
+from hypercorn.middleware import ProxyFixMiddleware
+
+import analytics
+from app import (
+    app as sync_app,
+    fetch_cars, fetch_expenses, fetch_dashboard, parse_fields, parse_period, decode_cursor,
+    insert_user, update_password_hash, insert_car, soft_delete_car,
+    insert_expense, expense_car_id, expense_updates, update_expense_row, delete_expense_row,
+    load_car_ids, NotOwned,
+    MAX_PAGE_SIZE, DASHBOARD_PAGE_SIZE, DEV_SECRET_KEY,
+)
+from async_db import AsyncDatabase
+from purge import purge_batch, incremental_vacuum
+from units import to_cents, to_day, to_currency
+from auth_cache import AuthCache
+from passwords import PasswordHasher, HasherBusy
+from ratelimit import RateLimiter
+
+app = Quart(__name__)
+app = cors(app, allow_origin='*')  # Разрешаем запросы с фронтенда
+
+# Настройки общие с app.py (включая заданные через MYCAREXPENSES_*)
+for key in (
+    'SECRET_KEY', 'DATABASE', 'AUTH_CACHE_SIZE', 'AUTH_CACHE_TTL',
+    'PASSWORD_HASH_METHOD', 'PASSWORD_HASH_WORKERS', 'PASSWORD_HASH_QUEUE',
+    'LOGIN_RATE_PER_IP', 'LOGIN_RATE_PER_EMAIL', 'TRUSTED_PROXIES',
+    'PURGE_INTERVAL', 'PURGE_BATCH_SIZE', 'PURGE_VACUUM_PAGES',
+):
+    app.config[key] = sync_app.config[key]
+app.config['DB_READERS'] = sync_app.config.get('DB_READERS', 8)
+app.config['DB_WRITE_QUEUE'] = sync_app.config.get('DB_WRITE_QUEUE', 1000)
+if app.config['TRUSTED_PROXIES']:
+    # Адрес клиента из X-Forwarded-For, как ProxyFix в app.py
+    app.asgi_app = ProxyFixMiddleware(app.asgi_app, trusted_hops=app.config['TRUSTED_PROXIES'])
+
+# ============ РЕСУРСЫ ============
+
+@app.before_serving
+async def startup():
+    # Как serve.py: с ключом по умолчанию любой может подписать токен
+    if app.config['SECRET_KEY'] == DEV_SECRET_KEY:
+        raise RuntimeError('Задайте MYCAREXPENSES_SECRET_KEY: ключ по умолчанию допустим только для разработки')
+    # Шарды (SHARDS, shards.py) поддерживает только app.py
+    if sync_app.config['SHARDS']:
+        raise RuntimeError('Асинхронный вариант работает с одной БД; для SHARDS используйте app.py')
+    db = AsyncDatabase(
+        app.config['DATABASE'],
+        readers=app.config['DB_READERS'],
+        max_pending=app.config['DB_WRITE_QUEUE']
+    )
+    await db.start()
+    app.extensions['db'] = db
+    app.extensions['auth_cache'] = AuthCache(
+        max_size=app.config['AUTH_CACHE_SIZE'], ttl=app.config['AUTH_CACHE_TTL']
+    )
+    app.extensions['password_hasher'] = PasswordHasher(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_QUEUE']
+    )
+    app.extensions['rate_limiters'] = {
+        name: RateLimiter(*app.config[name])
+        for name in ('LOGIN_RATE_PER_IP', 'LOGIN_RATE_PER_EMAIL')
+    }
+    app.extensions['purge_wakeup'] = asyncio.Event()
+    if app.config['PURGE_INTERVAL'] > 0:
+        app.extensions['purge_task'] = asyncio.create_task(purge_deleted_cars())
+
+@app.after_serving
+async def shutdown():
+    task = app.extensions.pop('purge_task', None)
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    await app.extensions.pop('db').close()
+    app.extensions.pop('password_hasher').shutdown()
+
+def get_db():
+    return app.extensions['db']
+
+async def purge_deleted_cars():
+    """Фоновая очистка мягко удалённых автомобилей (как purge.Purger в app.py)"""
+    wakeup = app.extensions['purge_wakeup']
+    while True:
+        try:
+            await asyncio.wait_for(wakeup.wait(), app.config['PURGE_INTERVAL'])
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+        try:
+            purged = 0
+            while (result := await get_db().write(purge_batch, app.config['PURGE_BATCH_SIZE'])) is not None:
+                purged += result[1]
+                await asyncio.sleep(0.01)
+            if purged and app.config['PURGE_VACUUM_PAGES']:
+                await get_db().write(incremental_vacuum, app.config['PURGE_VACUUM_PAGES'])
+        except sqlite3.Error:
+            # Повторим при следующем запуске
+            pass
+
+def read_data_version(conn, user_id):
+    row = conn.execute("SELECT data_version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+async def get_data_version(user_id):
+    """Версия данных пользователя, читается один раз за запрос (как get_data_version в app.py)"""
+    versions = g.setdefault('data_versions', {})
+    if user_id not in versions:
+        versions[user_id] = await get_db().read(read_data_version, user_id)
+    return versions[user_id]
+
+async def get_user_car_ids(user_id):
+    """Множество car_id пользователя (из кэша для текущей версии данных или из БД)
+
+    Тот же путь, что get_user_car_ids в app.py; при промахе AuthCache.get_car_ids
+    загружает автомобили в потоке-читателе.
+    """
+    cache = app.extensions['auth_cache']
+    version = await get_data_version(user_id)
+    car_ids = cache.cached_car_ids(user_id, version)
+    if car_ids is None:
+        car_ids = await get_db().read(
+            lambda conn: cache.get_car_ids(user_id, version, lambda: load_car_ids(conn, user_id))
+        )
+    return car_ids
+
+async def user_owns_car(user_id, car_id):
+    try:
+        car_id = int(car_id)
+    except (TypeError, ValueError):
+        return False
+    return car_id in await get_user_car_ids(user_id)
+
+async def hash_call(method, *args):
+    """Вызов PasswordHasher без блокировки цикла событий"""
+    hasher = app.extensions['password_hasher']
+    return await asyncio.get_running_loop().run_in_executor(None, getattr(hasher, method), *args)
+
+def check_rate_limit(*checks):
+    """Проверка ограничений (имя, ключ); ответ 429 или None"""
+    for name, key in checks:
+        allowed, retry_after = app.extensions['rate_limiters'][name].acquire(key)
+        if not allowed:
+            return (
+                {'message': 'Слишком много попыток, повторите позже'},
+                429,
+                {'Retry-After': str(math.ceil(retry_after))}
+            )
+    return None
+
+# Декоратор для проверки токена
+def token_required(f):
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        token = request.headers.get('Authorization')
+
+        if not token:
+            return jsonify({'message': 'Токен отсутствует'}), 401
+
+        if token.startswith('Bearer '):
+            token = token[7:]
+
+        cache = app.extensions['auth_cache']
+        current_user_id = cache.get_user_id(token)
+
+        if current_user_id is None:
+            try:
+                data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+                current_user_id = data['user_id']
+            except Exception:
+                return jsonify({'message': 'Неверный токен'}), 401
+            cache.put_token(token, current_user_id, data.get('exp'))
+
+        return await f(current_user_id, *args, **kwargs)
+
+    return decorated
+
+# ============ АУТЕНТИФИКАЦИЯ ============
+
+@app.route('/api/register', methods=['POST'])
+async def register():
+    """Регистрация нового пользователя"""
+    data = await request.get_json()
+
+    username = data.get('username')
+    email = data.get('email')
+    password = data.get('password')
+
+    if not username or not email or not password:
+        return jsonify({'message': 'Все поля обязательны'}), 400
+
+    limited = check_rate_limit(('LOGIN_RATE_PER_IP', request.remote_addr))
+    if limited:
+        return limited
+
+    try:
+        hashed_password = await hash_call('hash', password)
+    except HasherBusy:
+        return jsonify({'message': 'Сервер перегружен, повторите позже'}), 503
+
+    try:
+        await get_db().write(insert_user, username, email, hashed_password)
+    except sqlite3.IntegrityError:
+        return jsonify({'message': 'Пользователь уже существует'}), 409
+
+    return jsonify({'message': 'Пользователь зарегистрирован'}), 201
+
+@app.route('/api/login', methods=['POST'])
+async def login():
+    """Вход пользователя"""
+    data = await request.get_json()
+    email = data.get('email')
+    password = data.get('password')
+
+    if not email or not password:
+        return jsonify({'message': 'Email и пароль обязательны'}), 400
+
+    limited = check_rate_limit(
+        ('LOGIN_RATE_PER_IP', request.remote_addr),
+        ('LOGIN_RATE_PER_EMAIL', email.lower())
+    )
+    if limited:
+        return limited
+
+    db = get_db()
+    user = await db.read(
+        lambda conn: conn.execute(
+            "SELECT user_id, username, hashed_password FROM users WHERE email = ?", (email,)
+        ).fetchone()
+    )
+
+    try:
+        if not user or not await hash_call('verify', user[2], password):
+            return jsonify({'message': 'Неверный email или пароль'}), 401
+
+        # Параметры хеширования изменились - пересчитываем хеш, пока пароль известен
+        if app.extensions['password_hasher'].needs_rehash(user[2]):
+            hashed_password = await hash_call('hash', password)
+            await db.write(update_password_hash, user[0], hashed_password)
+    except HasherBusy:
+        return jsonify({'message': 'Сервер перегружен, повторите позже'}), 503
+
+    token = jwt.encode({
+        'user_id': user[0],
+        'username': user[1],
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=7)
+    }, app.config['SECRET_KEY'], algorithm="HS256")
+
+    return jsonify({
+        'token': token,
+        'user': {
+            'user_id': user[0],
+            'username': user[1],
+            'email': email
+        }
+    }), 200
+
+# ============ АВТОМОБИЛИ ============
+
+@app.route('/api/cars', methods=['GET'])
+@token_required
+async def get_cars(current_user_id):
+    """Получить все автомобили пользователя"""
+    return jsonify(await get_db().read(fetch_cars, current_user_id)), 200
+
+@app.route('/api/cars', methods=['POST'])
+@token_required
+async def add_car(current_user_id):
+    """Добавить новый автомобиль"""
+    data = await request.get_json()
+
+    make = data.get('make')
+    model = data.get('model')
+
+    if not make or not model:
+        return jsonify({'message': 'Марка и модель обязательны'}), 400
+
+    car_id = await get_db().write(
+        insert_car, current_user_id, make, model,
+        data.get('year'), data.get('license_plate'), data.get('fuel_type')
+    )
+    app.extensions['auth_cache'].invalidate_cars(current_user_id)
+
+    return jsonify({'car_id': car_id, 'message': 'Автомобиль добавлен'}), 201
+
+@app.route('/api/cars/<int:car_id>', methods=['DELETE'])
+@token_required
+async def delete_car(current_user_id, car_id):
+    """Удалить автомобиль"""
+    if not await user_owns_car(current_user_id, car_id):
+        return jsonify({'message': 'Автомобиль не найден'}), 404
+
+    try:
+        await get_db().write(soft_delete_car, current_user_id, car_id, int(time.time()))
+    except NotOwned:
+        return jsonify({'message': 'Автомобиль не найден'}), 404
+    app.extensions['auth_cache'].invalidate_cars(current_user_id)
+    app.extensions['purge_wakeup'].set()
+
+    return jsonify({'message': 'Автомобиль удален'}), 200
+
+# ============ РАСХОДЫ ============
+
+@app.route('/api/expenses', methods=['GET'])
+@token_required
+async def get_expenses(current_user_id):
+    """Получить расходы пользователя (весь список или страница по limit/cursor)"""
+    cursor_value = request.args.get('cursor')
+    limit = request.args.get('limit')
+
+    try:
+        start_day, end_day = parse_period(request.args)
+        fields = parse_fields(request.args.get('fields'))
+        after = decode_cursor(cursor_value) if cursor_value else None
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    paged = limit is not None or cursor_value is not None
+    if paged:
+        try:
+            limit = int(limit) if limit is not None else 50
+        except ValueError:
+            return jsonify({'message': 'limit должен быть числом'}), 400
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            return jsonify({'message': f'limit должен быть от 1 до {MAX_PAGE_SIZE}'}), 400
+
+    filters = (
+        request.args.get('car_id'),
+        start_day,
+        end_day,
+        request.args.get('category')
+    )
+    expenses, next_cursor = await get_db().read(
+        fetch_expenses, current_user_id, filters, fields, limit if paged else None, after
+    )
+
+    if not paged:
+        return jsonify(expenses), 200
+
+    return jsonify({
+        'items': expenses,
+        'next_cursor': next_cursor
+    }), 200
+
+@app.route('/api/expenses', methods=['POST'])
+@token_required
+async def add_expense(current_user_id):
+    """Добавить новый расход"""
+    data = await request.get_json()
+
+    car_id = data.get('car_id')
+    date = data.get('date')
+    amount = data.get('amount')
+    category = data.get('category')
+    description = data.get('description', '')
+
+    if not car_id or not date or not amount or not category:
+        return jsonify({'message': 'Обязательные поля: car_id, date, amount, category'}), 400
+
+    try:
+        day = to_day(date)
+        amount_cents = to_cents(amount)
+        currency = to_currency(data.get('currency'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    if not await user_owns_car(current_user_id, car_id):
+        return jsonify({'message': 'Автомобиль не найден'}), 404
+
+    try:
+        expense_id = await get_db().write(
+            insert_expense, current_user_id, car_id, day, amount_cents, currency, category, description
+        )
+    except NotOwned:
+        return jsonify({'message': 'Автомобиль не найден'}), 404
+
+    return jsonify({'expense_id': expense_id, 'message': 'Расход добавлен'}), 201
+
+@app.route('/api/expenses/<int:expense_id>', methods=['PUT'])
+@token_required
+async def update_expense(current_user_id, expense_id):
+    """Обновить расход"""
+    data = await request.get_json()
+
+    db = get_db()
+    car_id = await db.read(expense_car_id, expense_id)
+
+    if car_id is None or not await user_owns_car(current_user_id, car_id):
+        return jsonify({'message': 'Расход не найден'}), 404
+
+    try:
+        updates = expense_updates(data)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if not updates:
+        return jsonify({'message': 'Нет данных для обновления'}), 400
+
+    try:
+        await db.write(update_expense_row, current_user_id, expense_id, updates)
+    except NotOwned:
+        return jsonify({'message': 'Расход не найден'}), 404
+
+    return jsonify({'message': 'Расход обновлен'}), 200
+
+@app.route('/api/expenses/<int:expense_id>', methods=['DELETE'])
+@token_required
+async def delete_expense(current_user_id, expense_id):
+    """Удалить расход"""
+    db = get_db()
+    car_id = await db.read(expense_car_id, expense_id)
+
+    if car_id is None or not await user_owns_car(current_user_id, car_id):
+        return jsonify({'message': 'Расход не найден'}), 404
+
+    try:
+        await db.write(delete_expense_row, current_user_id, expense_id)
+    except NotOwned:
+        return jsonify({'message': 'Расход не найден'}), 404
+
+    return jsonify({'message': 'Расход удален'}), 200
+
+# ============ АНАЛИТИКА ============
+
+@app.route('/api/analytics/summary', methods=['GET'])
+@token_required
+async def get_summary(current_user_id):
+    """Получить сводную статистику"""
+    try:
+        start_day, end_day = parse_period(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    result = await get_db().read(
+        analytics.summary, current_user_id,
+        request.args.get('car_id'),
+        start_day,
+        end_day
+    )
+    return jsonify(result), 200
+
+@app.route('/api/dashboard', methods=['GET'])
+@token_required
+async def get_dashboard(current_user_id):
+    """Данные главной страницы одним запросом"""
+    try:
+        start_day, end_day = parse_period(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        limit = int(request.args.get('limit', DASHBOARD_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'message': 'limit должен быть числом'}), 400
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return jsonify({'message': f'limit должен быть от 1 до {MAX_PAGE_SIZE}'}), 400
+
+    result = await get_db().read(
+        fetch_dashboard, current_user_id, start_day, end_day, limit
+    )
+    return jsonify(result), 200
+
+# ============ СЛУЖЕБНОЕ ============
+
+@app.route('/api/health', methods=['GET'])
+async def health():
+    """Состояние сервиса"""
+    return jsonify({
+        'status': 'ok',
+        'db': get_db().stats(),
+        'auth_cache': app.extensions['auth_cache'].stats()
+    }), 200
+
+# ============ ЗАПУСК ============
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [os.environ.get('MYCAREXPENSES_BIND', '0.0.0.0:5000')]
+    print(f"Асинхронный сервер запущен на http://{config.bind[0]}")
+    asyncio.run(serve(app, config))
@@ -0,0 +1,116 @@
+"""
+Асинхронный доступ к SQLite для MyCarExpenses (async_app.py)
+sqlite3 блокирует поток, поэтому запросы выполняются в потоках: чтения - в пуле
+потоков со своими соединениями, все изменения - одной задачей-писателем через
+очередь, так что писатели не конкурируют за блокировку БД
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from db import ConnectionPool
+from migrations import migrate
+
+
+class AsyncDatabase:
+    """Читатели в пуле потоков и один писатель с очередью
+
+    read(func, *args) и write(func, *args) выполняют func(conn, *args) в потоке
+    и возвращают результат. write оборачивает func в транзакцию BEGIN IMMEDIATE
+    и фиксирует её; при исключении транзакция откатывается, исключение
+    передаётся вызывающему. Очередь записи ограничена max_pending: при
+    переполнении write ждёт освобождения места.
+    """
+
+    def __init__(self, database, readers=8, max_pending=1000):
+        self.database = database
+        self.readers = readers
+        self.max_pending = max_pending
+        # Соединения читателей не могут ничего изменить
+        self._read_pool = ConnectionPool(database, max_size=readers, pragmas={'query_only': 'ON'})
+        self._write_pool = ConnectionPool(database, max_size=1)
+        self._read_executor = ThreadPoolExecutor(readers, thread_name_prefix='sqlite-read')
+        self._write_executor = ThreadPoolExecutor(1, thread_name_prefix='sqlite-write')
+        self._writer_conn = None
+        self._queue = None
+        self._writer_task = None
+        self._stats = {'reads': 0, 'writes': 0, 'write_errors': 0}
+
+    async def start(self):
+        """Обновить схему и запустить задачу-писателя"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._write_executor, self._open_writer)
+        self._queue = asyncio.Queue(self.max_pending)
+        self._writer_task = asyncio.create_task(self._writer())
+
+    def _open_writer(self):
+        self._writer_conn = self._write_pool.acquire()
+        migrate(self._writer_conn)
+
+    async def read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        self._stats['reads'] += 1
+        return await loop.run_in_executor(self._read_executor, self._read, func, args)
+
+    def _read(self, func, args):
+        with self._read_pool.connection() as conn:
+            return func(conn, *args)
+
+    async def write(self, func, *args):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((func, args, future))
+        return await future
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                break
+            func, args, future = job
+            try:
+                result = await loop.run_in_executor(self._write_executor, self._write, func, args)
+            except Exception as e:
+                self._stats['write_errors'] += 1
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self._stats['writes'] += 1
+                if not future.done():
+                    future.set_result(result)
+
+    def _write(self, func, args):
+        conn = self._writer_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, *args)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return result
+
+    async def close(self):
+        """Дописать очередь, остановить писателя и закрыть соединения"""
+        if self._writer_task is not None:
+            await self._queue.put(None)
+            await self._writer_task
+            self._writer_task = None
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._write_executor, self._close_writer)
+        self._read_executor.shutdown(wait=True)
+        self._write_executor.shutdown(wait=True)
+        self._read_pool.close_all()
+
+    def _close_writer(self):
+        if self._writer_conn is not None:
+            self._write_pool.release(self._writer_conn)
+            self._writer_conn = None
+        self._write_pool.close_all()
+
+    def stats(self):
+        result = dict(self._stats)
+        result['pending_writes'] = self._queue.qsize() if self._queue is not None else 0
+        result['readers'] = self._read_pool.stats()
+        return result
@@ -0,0 +1,123 @@
+"""
+Кэш проверенных JWT и контекста пользователя для MyCarExpenses
+Повторные запросы с тем же токеном не декодируют и не проверяют подпись заново,
+а принадлежность автомобиля проверяется по множеству car_id в памяти
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class AuthCache:
+    """LRU-кэш с ограниченным временем жизни записей
+
+    tokens: токен -> (user_id, срок действия записи)
+    cars:   user_id -> ((data_version, множество car_id), срок действия записи)
+
+    Запись о токене живёт не дольше ttl и не дольше срока действия самого токена.
+    Множество автомобилей привязано к версии данных пользователя (users.data_version,
+    её увеличивают триггеры на cars): если версия в БД изменилась - в том числе
+    в другом процессе - запись устарела и загружается заново.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._tokens = OrderedDict()
+        self._cars = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'token_hits': 0,
+            'token_misses': 0,
+            'cars_hits': 0,
+            'cars_misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def _get(self, store, key, stat):
+        with self._lock:
+            entry = store.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                store.move_to_end(key)
+                self._stats[stat + '_hits'] += 1
+                return entry[0]
+            if entry is not None:
+                del store[key]
+            self._stats[stat + '_misses'] += 1
+            return None
+
+    def _put(self, store, key, value, ttl, keep=None):
+        """keep(текущее значение) -> True, если текущую запись заменять не нужно"""
+        with self._lock:
+            entry = store.get(key)
+            if keep is not None and entry is not None and keep(entry[0]):
+                return
+            store[key] = (value, time.monotonic() + ttl)
+            store.move_to_end(key)
+            while len(store) > self.max_size:
+                store.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get_user_id(self, token):
+        """user_id для уже проверенного токена или None"""
+        return self._get(self._tokens, token, 'token')
+
+    def put_token(self, token, user_id, expires_at=None):
+        """Запомнить проверенный токен; expires_at - поле exp токена (unix time)"""
+        ttl = self.ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if ttl > 0:
+            self._put(self._tokens, token, user_id, ttl)
+
+    def get_car_ids(self, user_id, version, loader):
+        """Множество car_id пользователя для версии данных version
+
+        При промахе loader() возвращает (data_version, car_ids), прочитанные
+        одним снимком БД.
+        """
+        car_ids = self.cached_car_ids(user_id, version)
+        if car_ids is None:
+            car_ids = self.put_car_ids(user_id, *loader())
+        return car_ids
+
+    def cached_car_ids(self, user_id, version):
+        """Множество car_id из кэша или None, если его нет или оно старше version"""
+        entry = self._get(self._cars, user_id, 'cars')
+        if entry is None or entry[0] < version:
+            return None
+        return entry[1]
+
+    def put_car_ids(self, user_id, version, car_ids):
+        """Запомнить множество car_id версии version
+
+        Более новую запись не заменяет: загрузка, начатая до изменения
+        автомобилей, не вернёт в кэш старое множество.
+        """
+        car_ids = frozenset(car_ids)
+        self._put(self._cars, user_id, (version, car_ids), self.ttl,
+                  keep=lambda current: current[0] > version)
+        return car_ids
+
+    def invalidate_cars(self, user_id):
+        """Сбросить множество автомобилей пользователя"""
+        with self._lock:
+            if self._cars.pop(user_id, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._cars.clear()
+
+    def stats(self):
+        """Счётчики попаданий и промахов"""
+        with self._lock:
+            result = dict(self._stats)
+            result['tokens'] = len(self._tokens)
+            result['users'] = len(self._cars)
+        result['max_size'] = self.max_size
+        result['ttl'] = self.ttl
+        return result
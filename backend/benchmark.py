@@ -0,0 +1,547 @@
+"""
+Нагрузочный бенчмарк API MyCarExpenses
+Строит БД нескольких размеров (seed_data.py --generate), прогоняет все основные
+маршруты и сохраняет p50/p95/p99 и пропускную способность в JSON
+
+Примеры:
+    python benchmark.py --sizes 100,1000 --requests 300
+    python benchmark.py --sizes 1000 --transport wsgi --threads 4
+    python benchmark.py --sizes 1000 --transport server --workers 1,2,4 --threads 16
+    python benchmark.py --sizes 1000 --transport server,async --threads 64 --scenarios dashboard,get_cars
+    python benchmark.py --sizes 1000 --compare bench_results/baseline.json --threshold 20
+    python benchmark.py --sizes 100 --scenarios get_expenses --serialization
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import secrets
+import signal
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import make_server
+
+import app as app_module
+import serialize
+from seed_data import generate_load_data, DEFAULT_CATEGORY_WEIGHTS
+
+app = app_module.app
+
+CATEGORIES = list(DEFAULT_CATEGORY_WEIGHTS)
+LOAD_PASSWORD = "load123"
+
+
+# ========================================
+# ТРАНСПОРТ
+# ========================================
+
+class TestClientTransport:
+    """Запросы через Flask test client (без сети)"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers or {})
+        return response.status_code, response.get_data()
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    """Запросы по HTTP к серверу на 127.0.0.1:port"""
+
+    port = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+
+class WsgiTransport(HttpTransport):
+    """Локальный WSGI-сервер werkzeug в отдельном потоке этого процесса"""
+
+    def __init__(self):
+        # Журнал каждого запроса заметно искажает замеры
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class ServerTransport(HttpTransport):
+    """Сервер в отдельном процессе с заданным числом рабочих процессов
+
+    kind='server' - serve.py (gunicorn, синхронный app.py),
+    kind='async' - hypercorn с async_app.py.
+    """
+
+    def __init__(self, database, kind, workers, threads, use_cache):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+
+        unlimited = json.dumps([10 ** 9, 10 ** 9])
+        environment = dict(
+            os.environ,
+            MYCAREXPENSES_DATABASE=os.path.abspath(database),
+            MYCAREXPENSES_SECRET_KEY=secrets.token_hex(32),
+            MYCAREXPENSES_LOGIN_RATE_PER_IP=unlimited,
+            MYCAREXPENSES_LOGIN_RATE_PER_EMAIL=unlimited,
+            MYCAREXPENSES_RESPONSE_CACHE_BYTES=str(32 * 1024 * 1024 if use_cache else 0),
+        )
+        if kind == 'async':
+            command = [
+                sys.executable, '-m', 'hypercorn', 'async_app:app',
+                '--bind', f'127.0.0.1:{self.port}',
+                '--workers', str(workers),
+            ]
+        else:
+            command = [
+                sys.executable, os.path.join(BACKEND_DIR, 'serve.py'),
+                '--bind', f'127.0.0.1:{self.port}',
+                '--workers', str(workers),
+                '--threads', str(threads),
+            ]
+        self.process = subprocess.Popen(command, cwd=BACKEND_DIR, env=environment, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if self.request('GET', '/api/health')[0] == 200:
+                    break
+            except OSError:
+                pass
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.close()
+                raise RuntimeError(f"Не удалось запустить сервер ({kind})")
+            time.sleep(0.1)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            self.process.wait(timeout=60)
+
+
+# ========================================
+# ПОДГОТОВКА
+# ========================================
+
+def build_database(directory, users, cars_per_user, expenses_per_car, seed):
+    """Файл БД нужного размера; уже построенный файл используется повторно"""
+    path = os.path.join(directory, f"bench_u{users}_c{cars_per_user}_e{expenses_per_car}_s{seed}.db")
+    if not os.path.exists(path):
+        generate_load_data(
+            path, users, cars_per_user, expenses_per_car,
+            datetime.date(2015, 1, 1), datetime.date(2024, 12, 31),
+            DEFAULT_CATEGORY_WEIGHTS, seed, 100000, True
+        )
+    return path
+
+
+def configure_app(database, use_cache):
+    """Переключить приложение на другую БД и сбросить пулы и кэши"""
+    app_module.close_databases()
+    for name in ('auth_cache', 'response_cache', 'rate_limiters'):
+        app.extensions.pop(name, None)
+
+    app.config['DATABASE'] = database
+    app.config['RESPONSE_CACHE_BYTES'] = 32 * 1024 * 1024 if use_cache else 0
+    # Бенчмарк логинится сотнями пользователей с одного адреса
+    app.config['LOGIN_RATE_PER_IP'] = (10 ** 9, 10 ** 9)
+    app.config['LOGIN_RATE_PER_EMAIL'] = (10 ** 9, 10 ** 9)
+    app_module.init_db()
+
+
+def load_fixtures(database, sample_users, rng):
+    """Случайные пользователи, их автомобили и расходы для запросов"""
+    conn = sqlite3.connect(database)
+    user_ids = [row[0] for row in conn.execute(
+        "SELECT user_id FROM users WHERE email LIKE '%@load.test'"
+    )]
+    fixtures = []
+    for user_id in rng.sample(user_ids, min(sample_users, len(user_ids))):
+        cars = [row[0] for row in conn.execute("SELECT car_id FROM cars WHERE user_id = ?", (user_id,))]
+        expenses = [row[0] for row in conn.execute(f"""
+            SELECT expense_id FROM expenses
+            WHERE car_id IN ({','.join('?' * len(cars))}) LIMIT 200
+        """, cars)] if cars else []
+        fixtures.append({
+            'email': f"user{user_id}@load.test",
+            'cars': cars,
+            'expenses': expenses
+        })
+    conn.close()
+    return [f for f in fixtures if f['cars'] and f['expenses']]
+
+
+def login_all(transport, fixtures):
+    for fixture in fixtures:
+        status, body = transport.request('POST', '/api/login', {
+            'email': fixture['email'], 'password': LOAD_PASSWORD
+        })
+        if status != 200:
+            raise RuntimeError(f"Не удалось войти как {fixture['email']}: {status}")
+        fixture['headers'] = {'Authorization': 'Bearer ' + json.loads(body)['token']}
+
+
+# ========================================
+# СЦЕНАРИИ
+# ========================================
+
+def random_range(rng):
+    year = rng.randint(2015, 2024)
+    month = rng.randint(1, 12)
+    return f"{year}-{month:02d}-{rng.randint(1, 28):02d}", f"{year + 1}-{month:02d}-{rng.randint(1, 28):02d}"
+
+
+def scenario_login(f, rng):
+    return 'POST', '/api/login', {'email': f['email'], 'password': LOAD_PASSWORD}, None
+
+
+def scenario_get_cars(f, rng):
+    return 'GET', '/api/cars', None, f['headers']
+
+
+def scenario_get_expenses(f, rng):
+    return 'GET', '/api/expenses', None, f['headers']
+
+
+def scenario_get_expenses_filtered(f, rng):
+    start, end = random_range(rng)
+    category = rng.choice(CATEGORIES)
+    return 'GET', f"/api/expenses?start_date={start}&end_date={end}&category={category}", None, f['headers']
+
+
+def scenario_get_expenses_page(f, rng):
+    return 'GET', '/api/expenses?limit=50', None, f['headers']
+
+
+def scenario_add_expense(f, rng):
+    return 'POST', '/api/expenses', {
+        'car_id': rng.choice(f['cars']),
+        'date': f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        'amount': round(rng.uniform(10, 100), 2),
+        'category': rng.choice(CATEGORIES),
+        'description': 'benchmark'
+    }, f['headers']
+
+
+def scenario_update_expense(f, rng):
+    return 'PUT', f"/api/expenses/{rng.choice(f['expenses'])}", {
+        'amount': round(rng.uniform(10, 100), 2)
+    }, f['headers']
+
+
+def scenario_get_summary(f, rng):
+    return 'GET', '/api/analytics/summary', None, f['headers']
+
+
+def scenario_get_summary_range(f, rng):
+    start, end = random_range(rng)
+    return 'GET', f"/api/analytics/summary?start_date={start}&end_date={end}", None, f['headers']
+
+
+def scenario_dashboard(f, rng):
+    return 'GET', '/api/dashboard?start_date=2024-12-01&end_date=2024-12-31', None, f['headers']
+
+
+SCENARIOS = {
+    'login': scenario_login,
+    'get_cars': scenario_get_cars,
+    'get_expenses': scenario_get_expenses,
+    'get_expenses_filtered': scenario_get_expenses_filtered,
+    'get_expenses_page': scenario_get_expenses_page,
+    'add_expense': scenario_add_expense,
+    'update_expense': scenario_update_expense,
+    'get_summary': scenario_get_summary,
+    'get_summary_range': scenario_get_summary_range,
+    'dashboard': scenario_dashboard,
+}
+
+# Вход дорогой (хеширование пароля) - для него меньше запросов
+SCENARIO_REQUEST_SHARE = {'login': 0.1}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(transport, name, fixtures, requests, threads, seed):
+    """Выполнить сценарий и вернуть статистику задержек"""
+    make_request = SCENARIOS[name]
+    per_thread = max(1, requests // threads)
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        latencies = []
+        errors = 0
+        for _ in range(per_thread):
+            method, path, body, headers = make_request(rng.choice(fixtures), rng)
+            started = time.perf_counter()
+            status, _ = transport.request(method, path, body, headers)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors += 1
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(worker, range(threads)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(l for part, _ in results for l in part)
+    errors = sum(e for _, e in results)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+    }
+
+
+# ========================================
+# СЕРИАЛИЗАЦИЯ
+# ========================================
+
+SERIALIZE_ROWS = 10000
+
+
+def bench_serialization(database, repeat=20):
+    """Медианное время кодирования SERIALIZE_ROWS строк расходов в JSON, мс
+
+    dicts_json - словари и json.dumps (как jsonify без orjson), dicts_backend -
+    словари и serialize.dumps (orjson, если установлен), records - serialize.Records
+    прямо из строк БД.
+    """
+    fields = app_module.EXPENSE_FIELDS
+    columns = ', '.join(app_module.EXPENSE_COLUMNS[f][0] for f in fields)
+    conn = sqlite3.connect(database)
+    try:
+        rows = conn.execute(f"SELECT {columns} FROM expenses LIMIT ?", (SERIALIZE_ROWS,)).fetchall()
+    finally:
+        conn.close()
+
+    records = app_module.expense_records(fields)
+    methods = {
+        'dicts_json': lambda: json.dumps(
+            app_module.expense_rows(rows, fields), sort_keys=True, separators=(',', ':')
+        ).encode('utf-8'),
+        'dicts_backend': lambda: serialize.dumps(app_module.expense_rows(rows, fields)),
+        'records': lambda: records.array(rows),
+    }
+
+    result = {'rows': len(rows), 'backend': serialize.backend()}
+    for name, method in methods.items():
+        method()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            method()
+            timings.append(time.perf_counter() - started)
+        result[f'{name}_ms'] = round(statistics.median(timings) * 1000, 2)
+    result['speedup'] = round(result['dicts_json_ms'] / result['records_ms'], 2) if result['records_ms'] else None
+    return result
+
+
+# ========================================
+# СРАВНЕНИЕ
+# ========================================
+
+def compare(current, baseline, threshold):
+    """Сравнить p95 с предыдущим прогоном; вернуть список регрессий"""
+    regressions = []
+    for key in ('transport', 'threads', 'response_cache', 'requests_per_scenario'):
+        old, new = baseline.get('meta', {}).get(key), current['meta'][key]
+        if old != new:
+            print(f"Внимание: {key} отличается от сравниваемого прогона ({old} -> {new})")
+    print()
+    print(f"{'размер':<24} {'сценарий':<24} {'p95 было':>10} {'p95 стало':>10} {'изм.':>8}")
+    for size, scenarios in current['results'].items():
+        for name, stats in scenarios.items():
+            old = baseline.get('results', {}).get(size, {}).get(name)
+            if not old or not old['p95_ms']:
+                continue
+            change = (stats['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100
+            mark = ''
+            if change > threshold:
+                mark = ' <-- РЕГРЕССИЯ'
+                regressions.append((size, name, change))
+            print(f"{size:<24} {name:<24} {old['p95_ms']:>10.2f} {stats['p95_ms']:>10.2f} {change:>+7.1f}%{mark}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк API MyCarExpenses")
+    parser.add_argument("--sizes", default="100,1000",
+                        help="размеры БД - число пользователей через запятую")
+    parser.add_argument("--cars-per-user", type=int, default=2)
+    parser.add_argument("--expenses-per-car", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=500, help="запросов на сценарий")
+    parser.add_argument("--threads", type=int, default=1, help="параллельных клиентов")
+    parser.add_argument("--users-sample", type=int, default=50, help="сколько пользователей участвуют в запросах")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--transport", default="testclient",
+                        help="testclient, wsgi, server (serve.py) или async (async_app.py); "
+                             "несколько через запятую - для сравнения")
+    parser.add_argument("--workers", default="1",
+                        help="для server и async: числа рабочих процессов через запятую")
+    parser.add_argument("--no-cache", action="store_true", help="отключить кэш ответов")
+    parser.add_argument("--db-dir", default="bench_data", help="каталог для файлов БД")
+    parser.add_argument("--output", default=None, help="файл результатов (JSON)")
+    parser.add_argument("--compare", default=None, help="JSON предыдущего прогона")
+    parser.add_argument("--threshold", type=float, default=20.0,
+                        help="рост p95 в процентах, который считается регрессией")
+    parser.add_argument("--serialization", action="store_true",
+                        help=f"замерить кодирование {SERIALIZE_ROWS} строк расходов в JSON")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.makedirs(args.db_dir, exist_ok=True)
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    transports = [t for t in args.transport.split(',') if t]
+    unknown = set(transports) - {'testclient', 'wsgi', 'server', 'async'}
+    if unknown:
+        parser.error(f"неизвестный транспорт: {', '.join(sorted(unknown))}")
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'transport': args.transport,
+            'threads': args.threads,
+            'workers': args.workers if {'server', 'async'} & set(transports) else None,
+            'requests_per_scenario': args.requests,
+            'response_cache': not args.no_cache,
+        },
+        'results': {}
+    }
+    if args.serialization:
+        report['serialization'] = {}
+
+    for users in (int(s) for s in args.sizes.split(',')):
+        label = f"{users}u_{args.cars_per_user}c_{args.expenses_per_car}e"
+        print(f"=== {label} ===")
+        database = build_database(args.db_dir, users, args.cars_per_user, args.expenses_per_car, args.seed)
+        configure_app(database, not args.no_cache)
+
+        rng = random.Random(args.seed)
+        fixtures = load_fixtures(database, args.users_sample, rng)
+
+        if args.serialization:
+            stats = bench_serialization(database)
+            report['serialization'][label] = stats
+            print(f"  JSON {stats['rows']} строк: словари + json {stats['dicts_json_ms']:.2f} мс, "
+                  f"словари + {stats['backend']} {stats['dicts_backend_ms']:.2f} мс, "
+                  f"Records {stats['records_ms']:.2f} мс (x{stats['speedup']})")
+
+        # Для отдельного сервера один прогон на каждое число рабочих процессов
+        runs = []
+        for kind in transports:
+            if kind in ('server', 'async'):
+                runs.extend((kind, int(w)) for w in args.workers.split(','))
+            else:
+                runs.append((kind, None))
+
+        for kind, workers in runs:
+            run_label = label
+            if len(transports) > 1:
+                run_label += f"_{kind}"
+            if kind in ('server', 'async'):
+                run_label += f"_w{workers}"
+                print(f"--- {kind}, рабочих процессов: {workers} ---")
+                transport = ServerTransport(database, kind, workers, args.threads, not args.no_cache)
+            elif kind == 'wsgi':
+                transport = WsgiTransport()
+            else:
+                transport = TestClientTransport()
+            try:
+                login_all(transport, fixtures)
+                results = {}
+                for name in scenarios:
+                    count = max(args.threads, int(args.requests * SCENARIO_REQUEST_SHARE.get(name, 1)))
+                    stats = run_scenario(transport, name, fixtures, count, args.threads, args.seed)
+                    results[name] = stats
+                    print(f"  {name:<24} p50 {stats['p50_ms']:>8.2f} мс  p95 {stats['p95_ms']:>8.2f} мс  "
+                          f"p99 {stats['p99_ms']:>8.2f} мс  {stats['throughput_rps']:>8.1f} req/s"
+                          + (f"  ошибок: {stats['errors']}" if stats['errors'] else ""))
+                report['results'][run_label] = results
+            finally:
+                transport.close()
+
+    output = args.output or os.path.join(
+        'bench_results', datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.json'
+    )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print()
+    print(f"Результаты сохранены в {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print()
+            print(f"Найдено регрессий: {len(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
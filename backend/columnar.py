@@ -0,0 +1,270 @@
+"""
+Колоночный кэш расходов для аналитики MyCarExpenses
+Расходы пользователя хранятся в памяти массивами NumPy (car_id, день, сумма
+в копейках, код категории); итоги сводки, помесячного ряда и разреза по
+автомобилям считаются векторными операциями вместо запросов к БД.
+
+Кэш загружается при первом отчёте пользователя и обновляется изменениями,
+которые писатель собирает в той же транзакции (track): запись применяется,
+только если версия данных (users.data_version) до изменения совпадает с
+версией кэша, иначе кэш пользователя загружается заново. Без NumPy кэш
+не используется и аналитика считается запросами к БД (analytics.py).
+"""
+
+import threading
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Номер месяца (units.month_of_day) для января 1970 года
+EPOCH_MONTH = 1970 * 12
+
+
+def available():
+    return np is not None
+
+
+def _version(conn, user_id):
+    row = conn.execute("SELECT data_version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def _fetch(conn, where, params):
+    return conn.execute(f"""
+        SELECT e.expense_id, e.car_id, e.day, e.amount_cents, e.category
+        FROM expenses e
+        JOIN cars c ON e.car_id = c.car_id
+        WHERE {where} AND c.deleted_at IS NULL
+    """, params).fetchall()
+
+
+def track(conn, user_id, ids, func, *args):
+    """Выполнить func(conn, *args) в транзакции писателя и собрать изменение для кэша
+
+    ids(result) - expense_id изменённых расходов. Возвращает
+    (result, (версия до, версия после, ids, строки расходов после)).
+    """
+    before = _version(conn, user_id)
+    result = func(conn, *args)
+    changed = list(ids(result))
+    rows = []
+    # Не больше 500 параметров на запрос
+    for start in range(0, len(changed), 500):
+        chunk = changed[start:start + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        rows.extend(_fetch(conn, f"e.expense_id IN ({placeholders})", chunk))
+    return result, (before, _version(conn, user_id), changed, rows)
+
+
+class Columns:
+    """Расходы одного пользователя по столбцам на версию данных version
+
+    categories - названия категорий по коду, codes - код по названию;
+    новая версия продолжает коды прежней.
+    """
+
+    __slots__ = ('version', 'expense_id', 'car_id', 'day', 'amount', 'category', 'categories', 'codes')
+
+    def __init__(self, version, rows, categories=None, codes=None):
+        self.version = version
+        self.categories = categories if categories is not None else []
+        self.codes = codes if codes is not None else {}
+
+        expense_ids, car_ids, days, amounts, names = zip(*rows) if rows else ((),) * 5
+        self.expense_id = np.array(expense_ids, dtype=np.int64)
+        self.car_id = np.array(car_ids, dtype=np.int64)
+        self.day = np.array(days, dtype=np.int32)
+        self.amount = np.array(amounts, dtype=np.int64)
+        self.category = np.array([self._code(name) for name in names], dtype=np.int32)
+
+    def _code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.categories)
+            self.categories.append(name)
+        return code
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ('expense_id', 'car_id', 'day', 'amount', 'category'))
+
+    def __len__(self):
+        return len(self.expense_id)
+
+    def updated(self, version, ids, rows):
+        """Новая версия: расходы ids заменены строками rows (удалённых среди rows нет)"""
+        added = Columns(version, rows, list(self.categories), dict(self.codes))
+        keep = ~np.isin(self.expense_id, np.array(ids, dtype=np.int64))
+        for name in ('expense_id', 'car_id', 'day', 'amount', 'category'):
+            setattr(added, name, np.concatenate([getattr(self, name)[keep], getattr(added, name)]))
+        return added
+
+
+def load(conn, user_id):
+    """Загрузить расходы пользователя одним снимком вместе с его версией данных"""
+    conn.execute("BEGIN")
+    try:
+        version = _version(conn, user_id)
+        rows = _fetch(conn, "c.user_id = ?", (user_id,))
+    finally:
+        conn.rollback()
+    return Columns(version, rows)
+
+
+def _months(days):
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) + EPOCH_MONTH
+
+
+def _mask(columns, car_id=None, start_day=None, end_day=None, category=None):
+    """Маска расходов по фильтрам или None, если под фильтры ничего не попадает"""
+    mask = np.ones(len(columns), dtype=bool)
+    if car_id:
+        try:
+            mask &= columns.car_id == int(car_id)
+        except ValueError:
+            return None
+    if category:
+        code = columns.codes.get(category)
+        if code is None:
+            return None
+        mask &= columns.category == code
+    if start_day is not None:
+        mask &= columns.day >= start_day
+    if end_day is not None:
+        mask &= columns.day <= end_day
+    return mask if mask.any() else None
+
+
+def _grouped(keys, codes, amounts, categories):
+    """{ключ: {'total', 'count', 'by_category'}} - суммы по группам (ключ, категория)"""
+    order = np.lexsort((codes, keys))
+    keys, codes, amounts = keys[order], codes[order], amounts[order]
+
+    # Начала групп в отсортированных массивах
+    boundary = np.empty(len(keys), dtype=bool)
+    boundary[0] = True
+    boundary[1:] = (keys[1:] != keys[:-1]) | (codes[1:] != codes[:-1])
+    starts = np.flatnonzero(boundary)
+    totals = np.add.reduceat(amounts, starts)
+    counts = np.diff(np.append(starts, len(keys)))
+
+    result = {}
+    for key, code, total, count in zip(
+        keys[starts].tolist(), codes[starts].tolist(), totals.tolist(), counts.tolist()
+    ):
+        stats = result.get(key)
+        if stats is None:
+            stats = result[key] = {'total': 0, 'count': 0, 'by_category': {}}
+        stats['total'] += total
+        stats['count'] += count
+        stats['by_category'][categories[code]] = (total, count)
+    return result
+
+
+def aggregate(columns, car_id=None, start_day=None, end_day=None, category=None):
+    """Итоги, разрезы по месяцам и автомобилям в формате analytics.Aggregate
+
+    Возвращает (totals, by_month, by_car) или None, если расходов за период нет.
+    """
+    mask = _mask(columns, car_id, start_day, end_day, category)
+    if mask is None:
+        return None
+
+    codes = columns.category[mask]
+    amounts = columns.amount[mask]
+    categories = columns.categories
+    totals = _grouped(np.zeros(len(codes), dtype=np.int64), codes, amounts, categories)[0]
+    by_month = _grouped(_months(columns.day[mask]), codes, amounts, categories)
+    by_car = _grouped(columns.car_id[mask], codes, amounts, categories)
+    return totals, by_month, by_car
+
+
+class ColumnCache:
+    """LRU-кэш колонок пользователей с ограничением по памяти"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'updates': 0,
+            'stale': 0,
+            'evictions': 0,
+        }
+
+    def get(self, user_id, version, load):
+        """Колонки пользователя на версию version; load() загружает их из БД"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(user_id)
+                self._stats['hits'] += 1
+                return entry
+            self._stats['misses'] += 1
+
+        entry = load()
+        self._put(user_id, entry)
+        return entry
+
+    def apply(self, user_id, before, after, ids, rows):
+        """Применить изменение из track; кэш другой версии удаляется"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry.version >= after:
+                return
+            if entry.version != before:
+                # Кэш пропустил изменение (другой процесс, очистка, перенос шарда)
+                self._pop(user_id)
+                self._stats['stale'] += 1
+                return
+
+        self._put(user_id, entry.updated(after, ids, rows))
+        with self._lock:
+            self._stats['updates'] += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._pop(user_id)
+
+    def _pop(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._size -= entry.nbytes
+
+    def _put(self, user_id, entry):
+        if entry.nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.get(user_id)
+            # Запись, загруженная параллельно по более старому снимку, не затирает новую
+            if old is not None and old.version > entry.version:
+                return
+            self._pop(user_id)
+            self._entries[user_id] = entry
+            self._size += entry.nbytes
+
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.nbytes
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result['entries'] = len(self._entries)
+            result['bytes'] = self._size
+        result['max_bytes'] = self.max_bytes
+        return result
+
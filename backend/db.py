@@ -0,0 +1,137 @@
+"""
+Пул соединений с SQLite для MyCarExpenses
+Соединения переиспользуются между запросами вместо sqlite3.connect на каждый вызов
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Настройки соединения по умолчанию
+DEFAULT_PRAGMAS = {
+    # Только для новой БД и до перехода в WAL; существующую переводит purge.py --vacuum
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',       # Читатели не блокируют писателя
+    'synchronous': 'NORMAL',     # В режиме WAL безопасно и без fsync на каждый коммит
+    'mmap_size': 268435456,      # 256 МБ файла БД читаются через mmap
+    'cache_size': -16000,        # ~16 МБ страничного кэша на соединение
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,        # Ждём блокировку до 5 секунд вместо ошибки
+    'foreign_keys': 'ON',        # Расход не может ссылаться на несуществующий автомобиль
+}
+
+
+class ConnectionPool:
+    """Пул соединений с одной базой данных
+
+    Соединение выдаётся потоку на время запроса и возвращается в пул после него,
+    поэтому одно соединение никогда не используется двумя потоками одновременно.
+    Каждое соединение держит кэш подготовленных запросов (cached_statements),
+    так что повторные запросы не разбираются заново.
+    factory - подкласс sqlite3.Connection (например, с замером времени запросов).
+    PRAGMA со значением None в pragmas не выполняется.
+    """
+
+    def __init__(self, database, max_size=8, pragmas=None, cached_statements=256, factory=None):
+        self.database = database
+        self.max_size = max_size
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self.cached_statements = cached_statements
+        self.factory = factory or sqlite3.Connection
+
+        self._idle = []
+        # Поколение пула: после reset() соединения прежних поколений закрываются
+        self._generation = 0
+        self._born = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'released': 0,
+            'discarded': 0,
+            'in_use': 0,
+        }
+
+    def _connect(self):
+        """Открыть новое соединение и применить PRAGMA"""
+        conn = sqlite3.connect(
+            self.database,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=self.factory,
+        )
+        for name, value in self.pragmas.items():
+            if value is not None:
+                conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def acquire(self):
+        """Получить соединение из пула (или открыть новое)"""
+        with self._lock:
+            if self._idle:
+                conn = self._idle.pop()
+                self._stats['reused'] += 1
+                self._stats['in_use'] += 1
+                return conn
+            self._stats['created'] += 1
+            self._stats['in_use'] += 1
+            generation = self._generation
+
+        conn = self._connect()
+        with self._lock:
+            self._born[id(conn)] = generation
+        return conn
+
+    def release(self, conn):
+        """Вернуть соединение в пул"""
+        # Незавершённая транзакция не должна перейти к следующему запросу
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if self._born.get(id(conn)) == self._generation and len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                self._stats['released'] += 1
+                return
+            self._stats['discarded'] += 1
+            self._born.pop(id(conn), None)
+
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула в виде контекстного менеджера"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Закрыть все свободные соединения"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            for conn in idle:
+                self._born.pop(id(conn), None)
+        for conn in idle:
+            conn.close()
+
+    def reset(self):
+        """Переоткрыть соединения (например, после замены файла БД)
+
+        Свободные соединения закрываются сразу, занятые - при возврате в пул.
+        """
+        with self._lock:
+            self._generation += 1
+        self.close_all()
+
+    def stats(self):
+        """Статистика пула"""
+        with self._lock:
+            result = dict(self._stats)
+            result['idle'] = len(self._idle)
+        result['max_size'] = self.max_size
+        return result
@@ -0,0 +1,224 @@
+"""
+Фоновые задачи MyCarExpenses
+Очередь задач - таблица jobs в файле БД (у каждого шарда своя). Раз в interval
+секунд планировщик ставит задачи (пересчёт отчётов пользователей, чьи данные
+изменились, - reports.py) и выполняет их по одной:
+- задача захватывается на lease секунд одним изменением, поэтому несколько
+  процессов не возьмут одну задачу, а задача упавшего процесса вернётся в очередь;
+- при ошибке задача повторяется через retry_delay секунд, после max_attempts
+  попыток остаётся в статусе failed с текстом ошибки.
+
+Запуск отдельным процессом (например, при JOB_INTERVAL = 0 в настройках сервера):
+    python jobs.py [основная БД и шарды] [--interval 600] [--once]
+"""
+
+import argparse
+import sqlite3
+import threading
+import time
+
+import reports
+from migrations import migrate
+from shards import connect
+
+# Вид задачи -> (постановка schedule(conn, kind, now), выполнение run(read, submit, user_id))
+HANDLERS = {
+    'reports': (reports.schedule, reports.run),
+}
+
+
+def enqueue(conn, kind, user_id, run_at):
+    """Поставить задачу, если такой же ожидающей нет; возвращает True, если поставлена"""
+    return conn.execute(
+        "INSERT OR IGNORE INTO jobs (kind, user_id, run_at) VALUES (?, ?, ?)", (kind, user_id, run_at)
+    ).rowcount > 0
+
+
+def claim(conn, now, lease):
+    """Захватить очередную задачу на lease секунд: (job_id, kind, user_id) или None"""
+    return conn.execute("""
+        UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ?
+        WHERE job_id = (
+            SELECT job_id FROM jobs
+            WHERE (status = 'pending' AND run_at <= ?) OR (status = 'running' AND locked_until < ?)
+            ORDER BY run_at
+            LIMIT 1
+        )
+        RETURNING job_id, kind, user_id
+    """, (now + lease, now, now)).fetchone()
+
+
+def finish(conn, job_id):
+    conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+
+def fail(conn, job_id, error, retry_at, max_attempts):
+    """Вернуть задачу в очередь до retry_at или оставить failed после max_attempts попыток"""
+    try:
+        conn.execute("""
+            UPDATE jobs
+            SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                run_at = ?, locked_until = NULL, last_error = ?
+            WHERE job_id = ?
+        """, (max_attempts, retry_at, error, job_id))
+    except sqlite3.IntegrityError:
+        # Такая же задача уже ждёт в очереди - она и будет повтором
+        finish(conn, job_id)
+        return
+
+    # Для пользователя хранится только последняя неудачная задача
+    conn.execute("""
+        DELETE FROM jobs
+        WHERE status = 'failed' AND job_id != ?
+          AND (kind, user_id) = (SELECT kind, user_id FROM jobs WHERE job_id = ?)
+    """, (job_id, job_id))
+
+
+class Scheduler:
+    """Поток, ставящий и выполняющий фоновые задачи шарда
+
+    submit(func, *args) выполняет func(conn, *args) в транзакции писателя
+    (WriteQueue.submit), read(func, *args) - на соединении для чтения.
+    Раз в interval секунд или сразу после wake() поток ставит задачи и
+    выполняет все готовые с паузой pause между ними.
+    interval = 0 - поток не запускается (задачи выполняет python jobs.py).
+    """
+
+    def __init__(self, submit, read, interval=600, lease=300, retry_delay=60, max_attempts=5, pause=0.01):
+        self.submit = submit
+        self.read = read
+        self.interval = interval
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.pause = pause
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'scheduled': 0,
+            'done': 0,
+            'failed': 0,
+            'errors': 0,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and self.interval > 0:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='jobs', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Выполнить задачи, не дожидаясь interval"""
+        self.start()
+        self._wakeup.set()
+
+    def run_once(self):
+        """Поставить задачи и выполнить все готовые; возвращает число выполненных"""
+        now = int(time.time())
+        scheduled = sum(self.submit(schedule, kind, now) for kind, (schedule, _) in HANDLERS.items())
+        with self._lock:
+            self._stats['scheduled'] += scheduled
+
+        done = 0
+        while not self._stopping:
+            job = self.submit(claim, int(time.time()), self.lease)
+            if job is None:
+                break
+            job_id, kind, user_id = job
+            try:
+                HANDLERS[kind][1](self.read, self.submit, user_id)
+            except Exception as e:
+                self.submit(fail, job_id, repr(e), int(time.time()) + self.retry_delay, self.max_attempts)
+                with self._lock:
+                    self._stats['failed'] += 1
+            else:
+                self.submit(finish, job_id)
+                done += 1
+                with self._lock:
+                    self._stats['done'] += 1
+            # Между задачами писатель успевает выполнить изменения из запросов
+            time.sleep(self.pause)
+
+        with self._lock:
+            self._stats['runs'] += 1
+        return done
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                self.run_once()
+            except Exception:
+                # Например, очередь писателя переполнена - захваченная задача вернётся после lease
+                with self._lock:
+                    self._stats['errors'] += 1
+
+    def close(self):
+        """Остановить поток (текущая задача дописывается)"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+        if thread is not None:
+            self._wakeup.set()
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+        result['running'] = self._thread is not None
+        return result
+
+
+def transaction(conn):
+    """submit без писателя (из командной строки): func(conn, *args) в своей транзакции"""
+    def submit(func, *args):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, *args)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return result
+    return submit
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фоновые задачи MyCarExpenses")
+    parser.add_argument("databases", nargs='*',
+                        help="основная БД и дополнительные шарды (по умолчанию из настроек app.py)")
+    parser.add_argument("--interval", type=float, default=600, help="пауза между проходами, с")
+    parser.add_argument("--once", action="store_true", help="один проход и выход")
+    args = parser.parse_args()
+
+    paths = args.databases
+    if not paths:
+        from app import app
+        paths = [app.config['DATABASE']] + list(app.config['SHARDS'])
+
+    schedulers = []
+    for path in paths:
+        conn = connect(path)
+        migrate(conn)
+        schedulers.append((path, Scheduler(
+            transaction(conn), lambda func, *func_args, conn=conn: func(conn, *func_args)
+        )))
+
+    while True:
+        for path, scheduler in schedulers:
+            done = scheduler.run_once()
+            print(f"{path}: выполнено задач {done}")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
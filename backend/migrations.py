@@ -0,0 +1,684 @@
+"""
+Версионные миграции схемы БД MyCarExpenses
+Текущая версия схемы хранится в PRAGMA user_version
+
+Запуск вручную (обновление существующего файла БД на месте):
+    python migrations.py [путь к БД]
+    python migrations.py [путь к БД] --explain
+"""
+
+import sqlite3
+import sys
+
+from units import MONTH_OF_DAY_SQL, DEFAULT_CURRENCY
+
+# Любое изменение расходов увеличивает версию данных владельца автомобиля
+EXPENSE_VERSION_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_version_insert
+    AFTER INSERT ON expenses
+    BEGIN
+        UPDATE users SET data_version = data_version + 1
+        WHERE user_id = (SELECT user_id FROM cars WHERE car_id = NEW.car_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_version_update
+    AFTER UPDATE ON expenses
+    BEGIN
+        UPDATE users SET data_version = data_version + 1
+        WHERE user_id IN (SELECT user_id FROM cars WHERE car_id IN (OLD.car_id, NEW.car_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_version_delete
+    AFTER DELETE ON expenses
+    BEGIN
+        UPDATE users SET data_version = data_version + 1
+        WHERE user_id = (SELECT user_id FROM cars WHERE car_id = OLD.car_id);
+    END
+    """,
+]
+
+# Записи поискового индекса берутся из представления expense_search_source:
+# перед удалением/изменением - старые значения (команда 'delete' FTS5), после - новые
+SEARCH_ROWS = """
+    SELECT expense_id, description, car, owner FROM expense_search_source WHERE {where}
+"""
+
+NEW_MONTH = MONTH_OF_DAY_SQL.format(day='NEW.day')
+OLD_MONTH = MONTH_OF_DAY_SQL.format(day='OLD.day')
+
+
+def _check_expense_values(conn):
+    """Перед переводом в номера дней и копейки все даты и суммы должны распознаваться"""
+    bad = conn.execute("""
+        SELECT expense_id FROM expenses
+        WHERE date(date) IS NULL OR typeof(amount) NOT IN ('integer', 'real')
+        LIMIT 20
+    """).fetchall()
+    if bad:
+        ids = ', '.join(str(row[0]) for row in bad)
+        raise ValueError(
+            f"Расходы с нераспознаваемой датой или суммой (expense_id: {ids}); "
+            f"исправьте их (дата YYYY-MM-DD, сумма - число) и запустите миграцию снова"
+        )
+
+# Список миграций: (версия, описание, SQL-запросы)
+# Новые миграции только добавляются в конец, уже выпущенные не меняются
+MIGRATIONS = [
+    (1, 'Базовые таблицы', [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            hashed_password TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cars (
+            car_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            make TEXT NOT NULL,
+            model TEXT NOT NULL,
+            year INTEGER,
+            license_plate TEXT,
+            fuel_type TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS expenses (
+            expense_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            car_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            FOREIGN KEY (car_id) REFERENCES cars(car_id)
+        )
+        """,
+    ]),
+    (2, 'Индексы для выборок по пользователю, дате и категории', [
+        "CREATE INDEX IF NOT EXISTS idx_cars_user_id ON cars(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_expenses_car_date ON expenses(car_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_expenses_car_category_date ON expenses(car_id, category, date)",
+        "ANALYZE",
+    ]),
+    (3, 'Помесячные агрегаты расходов (car_id, месяц, категория)', [
+        """
+        CREATE TABLE IF NOT EXISTS expense_monthly (
+            car_id INTEGER NOT NULL,
+            year_month TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total_amount REAL NOT NULL DEFAULT 0,
+            expense_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (car_id, year_month, category)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO expense_monthly (car_id, year_month, category, total_amount, expense_count)
+        SELECT car_id, substr(date, 1, 7), category, SUM(amount), COUNT(*)
+        FROM expenses
+        GROUP BY car_id, substr(date, 1, 7), category
+        """,
+        # Агрегаты обновляются триггерами в той же транзакции, что и сами расходы
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_monthly_insert
+        AFTER INSERT ON expenses
+        BEGIN
+            INSERT INTO expense_monthly (car_id, year_month, category, total_amount, expense_count)
+            VALUES (NEW.car_id, substr(NEW.date, 1, 7), NEW.category, NEW.amount, 1)
+            ON CONFLICT (car_id, year_month, category) DO UPDATE SET
+                total_amount = total_amount + excluded.total_amount,
+                expense_count = expense_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_monthly_delete
+        AFTER DELETE ON expenses
+        BEGIN
+            UPDATE expense_monthly
+            SET total_amount = total_amount - OLD.amount,
+                expense_count = expense_count - 1
+            WHERE car_id = OLD.car_id
+              AND year_month = substr(OLD.date, 1, 7)
+              AND category = OLD.category;
+            DELETE FROM expense_monthly
+            WHERE car_id = OLD.car_id
+              AND year_month = substr(OLD.date, 1, 7)
+              AND category = OLD.category
+              AND expense_count <= 0;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_monthly_update
+        AFTER UPDATE OF car_id, date, amount, category ON expenses
+        BEGIN
+            UPDATE expense_monthly
+            SET total_amount = total_amount - OLD.amount,
+                expense_count = expense_count - 1
+            WHERE car_id = OLD.car_id
+              AND year_month = substr(OLD.date, 1, 7)
+              AND category = OLD.category;
+            DELETE FROM expense_monthly
+            WHERE car_id = OLD.car_id
+              AND year_month = substr(OLD.date, 1, 7)
+              AND category = OLD.category
+              AND expense_count <= 0;
+            INSERT INTO expense_monthly (car_id, year_month, category, total_amount, expense_count)
+            VALUES (NEW.car_id, substr(NEW.date, 1, 7), NEW.category, NEW.amount, 1)
+            ON CONFLICT (car_id, year_month, category) DO UPDATE SET
+                total_amount = total_amount + excluded.total_amount,
+                expense_count = expense_count + 1;
+        END
+        """,
+    ]),
+    (4, 'Счётчик версии данных пользователя для ETag', [
+        "ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0",
+        # Любое изменение автомобилей и расходов увеличивает версию их владельца
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_cars_version_insert
+        AFTER INSERT ON cars
+        BEGIN
+            UPDATE users SET data_version = data_version + 1 WHERE user_id = NEW.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_cars_version_update
+        AFTER UPDATE ON cars
+        BEGIN
+            UPDATE users SET data_version = data_version + 1
+            WHERE user_id IN (OLD.user_id, NEW.user_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_cars_version_delete
+        AFTER DELETE ON cars
+        BEGIN
+            UPDATE users SET data_version = data_version + 1 WHERE user_id = OLD.user_id;
+        END
+        """,
+        *EXPENSE_VERSION_TRIGGERS,
+    ]),
+    (5, 'Суммы в копейках, даты номерами дней, валюта расхода', [
+        _check_expense_values,
+        f"""
+        CREATE TABLE expenses_v5 (
+            expense_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            car_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            currency TEXT NOT NULL DEFAULT '{DEFAULT_CURRENCY}',
+            category TEXT NOT NULL,
+            description TEXT,
+            FOREIGN KEY (car_id) REFERENCES cars(car_id)
+        )
+        """,
+        # julianday 2440587.5 - это 1970-01-01
+        """
+        INSERT INTO expenses_v5 (expense_id, car_id, day, amount_cents, category, description)
+        SELECT expense_id, car_id,
+               CAST(julianday(date(date)) - 2440587.5 AS INTEGER),
+               CAST(ROUND(amount * 100) AS INTEGER),
+               category, description
+        FROM expenses
+        """,
+        # Счётчик AUTOINCREMENT переносим, чтобы идентификаторы удалённых расходов не выдавались снова
+        "DELETE FROM sqlite_sequence WHERE name = 'expenses_v5'",
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'expenses_v5', seq FROM sqlite_sequence WHERE name = 'expenses'",
+        # Вместе с таблицей удаляются её индексы и триггеры
+        "DROP TABLE expenses",
+        "ALTER TABLE expenses_v5 RENAME TO expenses",
+        "CREATE INDEX idx_expenses_car_day ON expenses(car_id, day)",
+        "CREATE INDEX idx_expenses_car_category_day ON expenses(car_id, category, day)",
+        "DROP TABLE expense_monthly",
+        """
+        CREATE TABLE expense_monthly (
+            car_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            total_cents INTEGER NOT NULL DEFAULT 0,
+            expense_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (car_id, month, category)
+        ) WITHOUT ROWID
+        """,
+        f"""
+        INSERT INTO expense_monthly (car_id, month, category, total_cents, expense_count)
+        SELECT car_id, {MONTH_OF_DAY_SQL.format(day='day')}, category, SUM(amount_cents), COUNT(*)
+        FROM expenses
+        GROUP BY 1, 2, 3
+        """,
+        f"""
+        CREATE TRIGGER trg_expenses_monthly_insert
+        AFTER INSERT ON expenses
+        BEGIN
+            INSERT INTO expense_monthly (car_id, month, category, total_cents, expense_count)
+            VALUES (NEW.car_id, {NEW_MONTH}, NEW.category, NEW.amount_cents, 1)
+            ON CONFLICT (car_id, month, category) DO UPDATE SET
+                total_cents = total_cents + excluded.total_cents,
+                expense_count = expense_count + 1;
+        END
+        """,
+        f"""
+        CREATE TRIGGER trg_expenses_monthly_delete
+        AFTER DELETE ON expenses
+        BEGIN
+            UPDATE expense_monthly
+            SET total_cents = total_cents - OLD.amount_cents,
+                expense_count = expense_count - 1
+            WHERE car_id = OLD.car_id AND month = {OLD_MONTH} AND category = OLD.category;
+            DELETE FROM expense_monthly
+            WHERE car_id = OLD.car_id AND month = {OLD_MONTH} AND category = OLD.category
+              AND expense_count <= 0;
+        END
+        """,
+        f"""
+        CREATE TRIGGER trg_expenses_monthly_update
+        AFTER UPDATE OF car_id, day, amount_cents, category ON expenses
+        BEGIN
+            UPDATE expense_monthly
+            SET total_cents = total_cents - OLD.amount_cents,
+                expense_count = expense_count - 1
+            WHERE car_id = OLD.car_id AND month = {OLD_MONTH} AND category = OLD.category;
+            DELETE FROM expense_monthly
+            WHERE car_id = OLD.car_id AND month = {OLD_MONTH} AND category = OLD.category
+              AND expense_count <= 0;
+            INSERT INTO expense_monthly (car_id, month, category, total_cents, expense_count)
+            VALUES (NEW.car_id, {NEW_MONTH}, NEW.category, NEW.amount_cents, 1)
+            ON CONFLICT (car_id, month, category) DO UPDATE SET
+                total_cents = total_cents + excluded.total_cents,
+                expense_count = expense_count + 1;
+        END
+        """,
+        *EXPENSE_VERSION_TRIGGERS,
+        "ANALYZE",
+    ]),
+    (6, 'Полнотекстовый поиск по описанию расхода и автомобилю', [
+        # ё заменяется на е, регистр приводит токенизатор; owner - пользователь ('u' || user_id)
+        """
+        CREATE VIEW expense_search_source AS
+        SELECT e.expense_id,
+               e.car_id,
+               replace(replace(e.description, 'ё', 'е'), 'Ё', 'Е') AS description,
+               replace(replace(c.make || ' ' || c.model, 'ё', 'е'), 'Ё', 'Е') AS car,
+               'u' || c.user_id AS owner
+        FROM expenses e
+        JOIN cars c ON c.car_id = e.car_id
+        """,
+        # Текст не дублируется (external content), префиксы из 3 букв индексируются отдельно
+        """
+        CREATE VIRTUAL TABLE expense_search USING fts5(
+            description, car, owner,
+            content='expense_search_source', content_rowid='expense_id',
+            tokenize='unicode61 remove_diacritics 2', detail=column, prefix='3'
+        )
+        """,
+        "INSERT INTO expense_search (expense_search) VALUES ('rebuild')",
+        f"""
+        CREATE TRIGGER trg_expenses_search_insert
+        AFTER INSERT ON expenses
+        BEGIN
+            INSERT INTO expense_search (rowid, description, car, owner)
+            {SEARCH_ROWS.format(where='expense_id = NEW.expense_id')};
+        END
+        """,
+        f"""
+        CREATE TRIGGER trg_expenses_search_delete
+        BEFORE DELETE ON expenses
+        BEGIN
+            INSERT INTO expense_search (expense_search, rowid, description, car, owner)
+            SELECT 'delete', * FROM ({SEARCH_ROWS.format(where='expense_id = OLD.expense_id')});
+        END
+        """,
+        f"""
+        CREATE TRIGGER trg_expenses_search_update_old
+        BEFORE UPDATE OF car_id, description ON expenses
+        BEGIN
+            INSERT INTO expense_search (expense_search, rowid, description, car, owner)
+            SELECT 'delete', * FROM ({SEARCH_ROWS.format(where='expense_id = OLD.expense_id')});
+        END
+        """,
+        f"""
+        CREATE TRIGGER trg_expenses_search_update_new
+        AFTER UPDATE OF car_id, description ON expenses
+        BEGIN
+            INSERT INTO expense_search (rowid, description, car, owner)
+            {SEARCH_ROWS.format(where='expense_id = NEW.expense_id')};
+        END
+        """,
+        # Расходы удалённого автомобиля пропадают из индекса вместе с ним:
+        # без строки cars представление их уже не вернёт
+        f"""
+        CREATE TRIGGER trg_cars_search_delete
+        BEFORE DELETE ON cars
+        BEGIN
+            INSERT INTO expense_search (expense_search, rowid, description, car, owner)
+            SELECT 'delete', * FROM ({SEARCH_ROWS.format(where='car_id = OLD.car_id')});
+        END
+        """,
+        f"""
+        CREATE TRIGGER trg_cars_search_update_old
+        BEFORE UPDATE OF user_id, make, model ON cars
+        BEGIN
+            INSERT INTO expense_search (expense_search, rowid, description, car, owner)
+            SELECT 'delete', * FROM ({SEARCH_ROWS.format(where='car_id = OLD.car_id')});
+        END
+        """,
+        f"""
+        CREATE TRIGGER trg_cars_search_update_new
+        AFTER UPDATE OF user_id, make, model ON cars
+        BEGIN
+            INSERT INTO expense_search (rowid, description, car, owner)
+            {SEARCH_ROWS.format(where='car_id = NEW.car_id')};
+        END
+        """,
+    ]),
+    (7, 'Мягкое удаление автомобилей, каскадное удаление расходов', [
+        # Удалённый автомобиль (deleted_at - время удаления) скрыт сразу, строки удаляет purge.py
+        "ALTER TABLE cars ADD COLUMN deleted_at INTEGER",
+        "DROP INDEX IF EXISTS idx_cars_user_id",
+        "CREATE INDEX idx_cars_user_active ON cars(user_id) WHERE deleted_at IS NULL",
+        "CREATE INDEX idx_cars_deleted ON cars(deleted_at) WHERE deleted_at IS NOT NULL",
+        # Расходы автомобилей, удалённых до этой миграции
+        "DELETE FROM expenses WHERE car_id NOT IN (SELECT car_id FROM cars)",
+        # Расходы удаляются раньше автомобиля, поэтому внешний ключ не нарушается, а их
+        # записи в поисковом индексе снимает trg_expenses_search_delete
+        "DROP TRIGGER IF EXISTS trg_cars_search_delete",
+        """
+        CREATE TRIGGER trg_cars_delete_expenses
+        BEFORE DELETE ON cars
+        BEGIN
+            DELETE FROM expenses WHERE car_id = OLD.car_id;
+        END
+        """,
+    ]),
+    (8, 'Шардирование: диапазоны идентификаторов, размещение и перенос пользователей', [
+        # Следующий car_id / expense_id шарда (shards.py); пусто - идентификаторы выдаёт SQLite
+        """
+        CREATE TABLE id_ranges (
+            table_name TEXT PRIMARY KEY,
+            next_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        # Основная БД: шард пользователя, если это не шард 0
+        """
+        CREATE TABLE user_shards (
+            user_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL
+        )
+        """,
+        # Шард: пользователи, перенесённые на другой шард (изменения здесь отклоняются)
+        """
+        CREATE TABLE moved_users (
+            user_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL,
+            moved_at INTEGER NOT NULL
+        )
+        """,
+    ]),
+    (9, 'Очередь фоновых задач, помесячные отчёты и аномалии', [
+        # Очередь задач (jobs.py): pending - ждёт run_at, running - выполняется до locked_until
+        """
+        CREATE TABLE jobs (
+            job_id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            run_at INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            locked_until INTEGER,
+            last_error TEXT
+        )
+        """,
+        # Одна ожидающая задача каждого вида на пользователя
+        "CREATE UNIQUE INDEX idx_jobs_pending ON jobs(kind, user_id) WHERE status = 'pending'",
+        "CREATE INDEX idx_jobs_status_run_at ON jobs(status, run_at)",
+        # Версия данных пользователя, по которой построены его отчёты (reports.py)
+        """
+        CREATE TABLE report_state (
+            user_id INTEGER PRIMARY KEY,
+            data_version INTEGER NOT NULL,
+            computed_at INTEGER NOT NULL
+        )
+        """,
+        # Готовый отчёт за месяц: JSON ответа API
+        """
+        CREATE TABLE monthly_reports (
+            user_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            total_cents INTEGER NOT NULL,
+            expense_count INTEGER NOT NULL,
+            report TEXT NOT NULL,
+            PRIMARY KEY (user_id, month)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE anomalies (
+            user_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            baseline_cents INTEGER NOT NULL,
+            change_pct REAL NOT NULL,
+            PRIMARY KEY (user_id, month, category)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (10, 'Журнал изменённых расходов пользователей, переносимых на другой шард', [
+        # Шард: пользователи, чьи изменения расходов записываются на время переноса (shards.py)
+        "CREATE TABLE move_tracking (user_id INTEGER PRIMARY KEY)",
+        """
+        CREATE TABLE move_changes (
+            user_id INTEGER NOT NULL,
+            expense_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, expense_id)
+        ) WITHOUT ROWID
+        """,
+        # Пока никто не переносится, условие WHEN - проверка пустой таблицы
+        """
+        CREATE TRIGGER trg_expenses_move_insert
+        AFTER INSERT ON expenses
+        WHEN EXISTS (SELECT 1 FROM move_tracking)
+        BEGIN
+            INSERT OR IGNORE INTO move_changes (user_id, expense_id)
+            SELECT c.user_id, NEW.expense_id FROM cars c
+            WHERE c.car_id = NEW.car_id AND c.user_id IN (SELECT user_id FROM move_tracking);
+        END
+        """,
+        """
+        CREATE TRIGGER trg_expenses_move_update
+        AFTER UPDATE ON expenses
+        WHEN EXISTS (SELECT 1 FROM move_tracking)
+        BEGIN
+            INSERT OR IGNORE INTO move_changes (user_id, expense_id)
+            SELECT c.user_id, NEW.expense_id FROM cars c
+            WHERE c.car_id = NEW.car_id AND c.user_id IN (SELECT user_id FROM move_tracking);
+        END
+        """,
+        """
+        CREATE TRIGGER trg_expenses_move_delete
+        AFTER DELETE ON expenses
+        WHEN EXISTS (SELECT 1 FROM move_tracking)
+        BEGIN
+            INSERT OR IGNORE INTO move_changes (user_id, expense_id)
+            SELECT c.user_id, OLD.expense_id FROM cars c
+            WHERE c.car_id = OLD.car_id AND c.user_id IN (SELECT user_id FROM move_tracking);
+        END
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    """Текущая версия схемы"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Применить все недостающие миграции
+
+    Каждая миграция выполняется в своей транзакции вместе с обновлением
+    user_version, поэтому прерванное обновление можно просто запустить снова.
+    Возвращает список применённых версий.
+    """
+    if conn.in_transaction:
+        conn.commit()
+
+    current = get_version(conn)
+    applied = []
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql in statements:
+                # Шаг миграции - SQL-запрос или функция от соединения (проверки данных)
+                if callable(sql):
+                    sql(conn)
+                else:
+                    conn.execute(sql)
+            # PRAGMA не поддерживает параметры, версия - число из списка выше
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        applied.append(version)
+
+    return applied
+
+
+def rebuild_derived(conn):
+    """Пересчитать производные данные (помесячные агрегаты, поисковый индекс) по таблице expenses
+
+    Нужен после массовой загрузки с отключёнными триггерами.
+    """
+    conn.execute("DELETE FROM expense_monthly")
+    conn.execute(f"""
+        INSERT INTO expense_monthly (car_id, month, category, total_cents, expense_count)
+        SELECT car_id, {MONTH_OF_DAY_SQL.format(day='day')}, category, SUM(amount_cents), COUNT(*)
+        FROM expenses
+        GROUP BY 1, 2, 3
+    """)
+    conn.execute("INSERT INTO expense_search (expense_search) VALUES ('rebuild')")
+    conn.commit()
+
+
+# Запросы, которые выполняются на каждой загрузке дашборда
+HOT_QUERIES = {
+    'get_cars': (
+        """
+        SELECT car_id, make, model, year, license_plate, fuel_type
+        FROM cars WHERE user_id = ? AND deleted_at IS NULL
+        """,
+        (1,),
+    ),
+    # Как expense_cursor в app.py: страница по курсору (day, expense_id)
+    'get_expenses': (
+        """
+        SELECT e.day, e.expense_id, e.expense_id, e.car_id, e.day, e.amount_cents, e.category, e.description
+        FROM expenses e
+        JOIN cars c ON e.car_id = c.car_id
+        WHERE c.user_id = ? AND c.deleted_at IS NULL AND e.day >= ? AND e.day <= ?
+          AND (e.day < ? OR (e.day = ? AND e.expense_id < ?))
+        ORDER BY e.day DESC, e.expense_id DESC
+        LIMIT ?
+        """,
+        (1, 19723, 20088, 20000, 20000, 1000000, 51),
+    ),
+    'get_expenses_by_category': (
+        """
+        SELECT e.day, e.expense_id, e.expense_id, e.car_id, e.day, e.amount_cents, e.category, e.description
+        FROM expenses e
+        JOIN cars c ON e.car_id = c.car_id
+        WHERE c.user_id = ? AND c.deleted_at IS NULL AND e.category = ?
+        ORDER BY e.day DESC, e.expense_id DESC
+        LIMIT ?
+        """,
+        (1, 'Топливо', 51),
+    ),
+    'get_summary': (
+        """
+        SELECT e.category, SUM(e.amount_cents)
+        FROM expenses e
+        JOIN cars c ON e.car_id = c.car_id
+        WHERE c.user_id = ? AND c.deleted_at IS NULL AND e.day >= ?
+        GROUP BY e.category
+        """,
+        (1, 19723),
+    ),
+    'get_summary_monthly': (
+        """
+        SELECT m.category, SUM(m.total_cents), SUM(m.expense_count)
+        FROM expense_monthly m
+        JOIN cars c ON m.car_id = c.car_id
+        WHERE c.user_id = ? AND c.deleted_at IS NULL AND m.month > ? AND m.month < ?
+        GROUP BY m.category
+        """,
+        (1, 24288, 24299),
+    ),
+    'search_expenses': (
+        """
+        SELECT e.day, e.expense_id, e.description, c.make || ' ' || c.model
+        FROM expense_search s
+        JOIN expenses e ON e.expense_id = s.rowid
+        JOIN cars c ON e.car_id = c.car_id
+        WHERE expense_search MATCH ? AND c.user_id = ?
+        """,
+        ('owner : "u1" AND {description car} : ("зап"*)', 1),
+    ),
+}
+
+
+def explain_hot_queries(conn):
+    """EXPLAIN QUERY PLAN для основных запросов
+
+    Возвращает словарь {имя запроса: (строки плана, используются ли индексы)}.
+    Запрос считается плохим, если по одной из таблиц идёт полный SCAN.
+    """
+    report = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        full_scan = any(
+            detail.startswith('SCAN') and 'INDEX' not in detail
+            for detail in plan
+        )
+        report[name] = (plan, not full_scan)
+    return report
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    database = args[0] if args else 'mycarexpenses.db'
+
+    conn = sqlite3.connect(database)
+    before = get_version(conn)
+    applied = migrate(conn)
+
+    print(f"БД: {database}")
+    print(f"Версия схемы: {before} -> {get_version(conn)}")
+    if applied:
+        print(f"Применены миграции: {', '.join(str(v) for v in applied)}")
+    else:
+        print("Схема уже актуальна")
+
+    if '--explain' in sys.argv:
+        ok = True
+        for name, (plan, uses_index) in explain_hot_queries(conn).items():
+            print()
+            print(f"{name}: {'OK' if uses_index else 'ПОЛНЫЙ ПРОСМОТР ТАБЛИЦЫ'}")
+            for detail in plan:
+                print(f"  {detail}")
+            ok = ok and uses_index
+        conn.close()
+        sys.exit(0 if ok else 1)
+
+    conn.close()
@@ -0,0 +1,122 @@
+"""
+Хеширование паролей для MyCarExpenses
+Вычисление хеша (scrypt / pbkdf2) выполняется в отдельном пуле процессов,
+чтобы всплеск входов не занимал процессор потоков, обслуживающих запросы
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+# Метод в формате werkzeug: 'scrypt:N:r:p' или 'pbkdf2:sha256:итерации'
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+
+def expand_method(method):
+    """Метод со всеми параметрами, как его записывает werkzeug в начало хеша
+
+    'scrypt' -> 'scrypt:32768:8:1', 'pbkdf2' -> 'pbkdf2:sha256:600000' и т.п.
+    """
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        if not args:
+            args = ['32768', '8', '1']
+        if len(args) != 3:
+            raise ValueError("'scrypt' takes 3 arguments.")
+        return 'scrypt:%d:%d:%d' % tuple(map(int, args))
+    if name == 'pbkdf2':
+        if len(args) > 2:
+            raise ValueError("'pbkdf2' takes 2 arguments.")
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f"Invalid hash method '{method}'.")
+
+
+class HasherBusy(Exception):
+    """Очередь на хеширование переполнена, хеш не посчитан за timeout или пул процессов упал"""
+
+
+class PasswordHasher:
+    """Хеширование и проверка паролей в ограниченном пуле процессов
+
+    workers=0 - считать прямо в потоке запроса (для отладки и тестов).
+    max_pending ограничивает число задач в очереди; сверх него HasherBusy.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=2, max_pending=64, timeout=10):
+        # Короткая запись метода ('scrypt', 'pbkdf2') раскрывается заранее,
+        # иначе needs_rehash считал бы устаревшим каждый хеш
+        self.method = expand_method(method)
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            executor = self._get_executor()
+            future = executor.submit(func, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._reset_executor(executor)
+            raise HasherBusy()
+        except BaseException:
+            self._slots.release()
+            raise
+        # Слот освобождается, только когда задача завершилась: после таймаута
+        # она продолжает занимать процесс пула
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise HasherBusy()
+        except BrokenProcessPool:
+            # Процесс пула завершился аварийно - следующий вызов создаст новый пул
+            self._reset_executor(executor)
+            raise HasherBusy()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                if multiprocessing.current_process().daemon:
+                    # Демон (рабочий процесс hypercorn) не может запускать дочерние процессы;
+                    # hashlib отпускает GIL на время scrypt/pbkdf2, так что потоки тоже параллельны
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _reset_executor(self, broken):
+        with self._executor_lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def hash(self, password):
+        """Хеш пароля с текущими параметрами"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, hashed_password, password):
+        """Проверка пароля по сохранённому хешу"""
+        return self._run(check_password_hash, hashed_password, password)
+
+    def needs_rehash(self, hashed_password):
+        """Хеш создан с другим методом или стоимостью и его нужно пересчитать"""
+        return hashed_password.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
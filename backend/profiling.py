@@ -0,0 +1,393 @@
+"""
+Профилирование запросов и замер SQL для MyCarExpenses
+Включается настройкой PROFILING: время выполнения каждого запроса к SQLite,
+разбивка времени запроса по фазам (SQL, проверка токена, хеширование пароля,
+сериализация JSON), метрики в формате Prometheus и выборочный cProfile медленных запросов
+"""
+
+import contextvars
+import cProfile
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from serialize import JSONProvider
+
+# Границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Профиль текущего запроса (None, если профилирование выключено)
+_current = contextvars.ContextVar('request_profile', default=None)
+
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """Текст запроса в одну строку - ключ для статистики"""
+    return _SPACES.sub(' ', sql).strip()
+
+
+# ============ ПРОФИЛЬ ЗАПРОСА ============
+
+class RequestProfile:
+    """Время фаз и SQL-запросы одного HTTP-запроса"""
+
+    # Сколько запросов к БД сохраняем для отчёта о медленном запросе
+    MAX_QUERIES = 200
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = None
+        self.phases = {}
+        self.queries = []
+        self.query_count = 0
+        self.profiler = None
+        self._token = None
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_query(self, sql, seconds, rows):
+        self.query_count += 1
+        self.add_phase('db', seconds)
+        if len(self.queries) < self.MAX_QUERIES:
+            self.queries.append([sql, seconds, rows])
+
+    def add_rows(self, seconds, rows):
+        self.add_phase('db', seconds)
+        if self.queries:
+            self.queries[-1][1] += seconds
+            self.queries[-1][2] += rows
+
+    def server_timing(self):
+        """Значение заголовка Server-Timing (длительности в миллисекундах)"""
+        parts = []
+        for name, seconds in self.phases.items():
+            part = f'{name};dur={seconds * 1000:.2f}'
+            if name == 'db':
+                part += f';desc="{self.query_count} queries"'
+            parts.append(part)
+        parts.append(f'total;dur={self.total * 1000:.2f}')
+        return ', '.join(parts)
+
+
+def start_request(sample_rate=0.0):
+    """Начать профиль запроса; с вероятностью sample_rate запрос идёт под cProfile"""
+    profile = RequestProfile()
+    profile._token = _current.set(profile)
+
+    if sample_rate and random.random() < sample_rate:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            profile.profiler = profiler
+        except ValueError:
+            # В этом потоке уже работает другой профилировщик
+            pass
+    return profile
+
+
+def finish_request(profile):
+    """Остановить профиль запроса"""
+    if profile.profiler is not None:
+        profile.profiler.disable()
+    if profile.total is None:
+        profile.total = time.perf_counter() - profile.started
+    if profile._token is not None:
+        _current.reset(profile._token)
+        profile._token = None
+    return profile
+
+
+@contextmanager
+def phase(name):
+    """Засечь время фазы текущего запроса; без профиля ничего не делает"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_phase(name, time.perf_counter() - start)
+
+
+def dump_profile(profile, directory, endpoint):
+    """Сохранить cProfile медленного запроса (.prof) и список его SQL-запросов (.json)
+
+    Файл .prof открывается pstats, snakeviz или flameprof (флеймграф).
+    """
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    base = os.path.join(directory, f'{stamp}-{endpoint}-{profile.total * 1000:.0f}ms')
+
+    profile.profiler.dump_stats(base + '.prof')
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'endpoint': endpoint,
+            'total_ms': round(profile.total * 1000, 3),
+            'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in profile.phases.items()},
+            'queries': [
+                {'sql': sql, 'ms': round(seconds * 1000, 3), 'rows': rows}
+                for sql, seconds, rows in profile.queries
+            ],
+        }, f, ensure_ascii=False, indent=2)
+    return base + '.prof'
+
+
+# ============ МЕТРИКИ ============
+
+class Metrics:
+    """Счётчики и гистограммы для /metrics (текстовый формат Prometheus)
+
+    Статистика SQL ведётся по тексту запроса; различных запросов не больше
+    max_statements, остальные учитываются под меткой "other".
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_statements=200):
+        self.buckets = buckets
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._requests = {}     # (endpoint, method, status) -> [количество, сумма, корзины]
+        self._phases = {}       # (endpoint, phase) -> секунды
+        self._statements = {}   # sql -> [количество, секунды, строки]
+        self._sql_hist = self._new_histogram()
+
+    def _new_histogram(self):
+        return [0, 0.0, [0] * len(self.buckets)]
+
+    def _observe(self, histogram, value):
+        histogram[0] += 1
+        histogram[1] += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram[2][i] += 1
+                break
+
+    def observe_request(self, endpoint, method, status, profile):
+        with self._lock:
+            key = (endpoint, method, str(status))
+            histogram = self._requests.get(key)
+            if histogram is None:
+                histogram = self._requests[key] = self._new_histogram()
+            self._observe(histogram, profile.total)
+
+            for name, seconds in profile.phases.items():
+                key = (endpoint, name)
+                self._phases[key] = self._phases.get(key, 0.0) + seconds
+
+    def observe_sql(self, sql, seconds, rows):
+        """Учесть выполнение запроса; возвращает ключ для add_rows"""
+        with self._lock:
+            entry = self._statements.get(sql)
+            if entry is None:
+                if len(self._statements) >= self.max_statements:
+                    sql = 'other'
+                entry = self._statements.setdefault(sql, [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += rows
+            self._observe(self._sql_hist, seconds)
+        return sql
+
+    def add_rows(self, sql, seconds, rows):
+        """Строки и время, потраченные на выборку результата запроса"""
+        with self._lock:
+            entry = self._statements.get(sql)
+            if entry is not None:
+                entry[1] += seconds
+                entry[2] += rows
+
+    def statements(self, limit=20):
+        """Самые долгие запросы по суммарному времени"""
+        with self._lock:
+            items = sorted(self._statements.items(), key=lambda item: item[1][1], reverse=True)
+        return [
+            {'sql': sql, 'count': count, 'seconds': round(seconds, 6), 'rows': rows}
+            for sql, (count, seconds, rows) in items[:limit]
+        ]
+
+    def render(self, gauges=None):
+        """Текст для /metrics; gauges - {имя: словарь статистики} (пул, кэши)"""
+        lines = []
+        with self._lock:
+            self._render_histograms(
+                lines, 'mycarexpenses_request_duration_seconds', 'Request duration',
+                ('endpoint', 'method', 'status'), self._requests
+            )
+
+            lines.append('# HELP mycarexpenses_request_phase_seconds_total Time spent per request phase')
+            lines.append('# TYPE mycarexpenses_request_phase_seconds_total counter')
+            for (endpoint, name), seconds in sorted(self._phases.items()):
+                lines.append(
+                    f'mycarexpenses_request_phase_seconds_total'
+                    f'{_labels(endpoint=endpoint, phase=name)} {seconds:.6f}'
+                )
+
+            self._render_histograms(
+                lines, 'mycarexpenses_sql_duration_seconds', 'SQL statement duration',
+                (), {(): self._sql_hist}
+            )
+
+            for metric, index, help_text in (
+                ('mycarexpenses_sql_statements_total', 0, 'SQL statements executed'),
+                ('mycarexpenses_sql_seconds_total', 1, 'Time spent in SQL statements'),
+                ('mycarexpenses_sql_rows_total', 2, 'Rows returned or changed by SQL statements'),
+            ):
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} counter')
+                for sql, entry in sorted(self._statements.items()):
+                    value = entry[index]
+                    value = f'{value:.6f}' if isinstance(value, float) else value
+                    lines.append(f'{metric}{_labels(statement=sql)} {value}')
+
+        for name, stats in (gauges or {}).items():
+            metric = f'mycarexpenses_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            for stat, value in sorted(stats.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'{metric}{_labels(stat=stat)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _render_histograms(self, lines, metric, help_text, label_names, histograms):
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        for key, (count, total, buckets) in sorted(histograms.items()):
+            labels = dict(zip(label_names, key))
+            cumulative = 0
+            for bound, value in zip(self.buckets, buckets):
+                cumulative += value
+                lines.append(f'{metric}_bucket{_labels(**labels, le=repr(bound))} {cumulative}')
+            lines.append(f'{metric}_bucket{_labels(**labels, le="+Inf")} {count}')
+            lines.append(f'{metric}_sum{_labels(**labels)} {total:.6f}')
+            lines.append(f'{metric}_count{_labels(**labels)} {count}')
+
+    def clear(self):
+        with self._lock:
+            self._requests.clear()
+            self._phases.clear()
+            self._statements.clear()
+            self._sql_hist = self._new_histogram()
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+# ============ ЗАМЕР SQL ============
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий время выполнения запросов и выборки строк"""
+
+    _sql_key = None
+
+    def _record(self, sql, seconds):
+        rows = self.rowcount if self.rowcount > 0 else 0
+        sql = normalize_sql(sql)
+        self._sql_key = self.connection.metrics.observe_sql(sql, seconds, rows)
+        profile = _current.get()
+        if profile is not None:
+            profile.add_query(sql, seconds, rows)
+
+    def _fetched(self, seconds, rows):
+        if self._sql_key is not None:
+            self.connection.metrics.add_rows(self._sql_key, seconds, rows)
+        profile = _current.get()
+        if profile is not None:
+            profile.add_rows(seconds, rows)
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(sql, time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(time.perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(time.perf_counter() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(time.perf_counter() - start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(time.perf_counter() - start, 0)
+            raise
+        self._fetched(time.perf_counter() - start, 1)
+        return row
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, все запросы которого идут через TimedCursor"""
+
+    metrics = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            seconds = time.perf_counter() - start
+            self.metrics.observe_sql('COMMIT', seconds, 0)
+            profile = _current.get()
+            if profile is not None:
+                profile.add_query('COMMIT', seconds, 0)
+
+
+def timed_connection_factory(metrics):
+    """Класс соединения для sqlite3.connect(factory=...), пишущий статистику в metrics"""
+    return type('TimedConnection', (TimedConnection,), {'metrics': metrics})
+
+
+# ============ СЕРИАЛИЗАЦИЯ ============
+
+class TimedJSONProvider(JSONProvider):
+    """JSON-провайдер Flask (serialize.py), записывающий время jsonify в фазу 'json'"""
+
+    def response(self, *args, **kwargs):
+        with phase('json'):
+            return super().response(*args, **kwargs)
@@ -0,0 +1,190 @@
+"""
+Фоновая очистка удалённых автомобилей MyCarExpenses
+Автомобиль удаляется мягко (cars.deleted_at): он и его расходы сразу пропадают из
+всех выборок, а строки удаляются здесь небольшими пачками - каждая пачка отдельным
+изменением писателя, поэтому удаление автомобиля с десятками тысяч расходов не
+задерживает остальные изменения. После очистки свободные страницы файла БД
+возвращаются через PRAGMA incremental_vacuum (если включён auto_vacuum=INCREMENTAL).
+
+Запуск вручную (например, из cron при PURGE_INTERVAL = 0):
+    python purge.py [путь к БД] [--vacuum]
+--vacuum после очистки выполняет полный VACUUM и переводит БД в режим
+auto_vacuum=INCREMENTAL (сервер при этом лучше остановить).
+"""
+
+import sqlite3
+import sys
+import threading
+import time
+
+from migrations import migrate
+
+
+def purge_batch(conn, batch_size):
+    """Удалить пачку расходов автомобиля, удалённого раньше остальных
+
+    Когда расходов не осталось, удаляется и сам автомобиль. Возвращает
+    (car_id, удалено расходов, удалён ли автомобиль) или None, если удалять нечего.
+    """
+    row = conn.execute("""
+        SELECT car_id FROM cars WHERE deleted_at IS NOT NULL
+        ORDER BY deleted_at LIMIT 1
+    """).fetchone()
+    if row is None:
+        return None
+
+    car_id = row[0]
+    deleted = conn.execute("""
+        DELETE FROM expenses WHERE expense_id IN (
+            SELECT expense_id FROM expenses WHERE car_id = ? LIMIT ?
+        )
+    """, (car_id, batch_size)).rowcount
+
+    car_deleted = deleted < batch_size
+    if car_deleted:
+        conn.execute("DELETE FROM cars WHERE car_id = ?", (car_id,))
+    return car_id, deleted, car_deleted
+
+
+def incremental_vacuum(conn, pages):
+    """Вернуть файлу до pages свободных страниц; 0, если auto_vacuum не INCREMENTAL"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # Каждый шаг PRAGMA освобождает одну страницу, а sqlite3 делает только первый
+    # шаг запроса без столбцов результата - поэтому по странице за вызов
+    for _ in range(min(pages, before)):
+        conn.execute("PRAGMA incremental_vacuum(1)")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+class Purger:
+    """Поток, очищающий удалённые автомобили
+
+    submit(func, *args) выполняет func(conn, *args) в транзакции писателя
+    (WriteQueue.submit). Раз в interval секунд или сразу после wake() поток
+    удаляет расходы пачками по batch_size, пока есть что удалять, с паузой pause
+    между пачками, затем освобождает до vacuum_pages страниц.
+    interval = 0 - поток не запускается (очистка только через purge.py).
+    """
+
+    def __init__(self, submit, interval=60, batch_size=500, pause=0.01, vacuum_pages=0):
+        self.submit = submit
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'cars': 0,
+            'expenses': 0,
+            'vacuumed_pages': 0,
+            'errors': 0,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and self.interval > 0:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='purge', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Начать очистку, не дожидаясь interval"""
+        self.start()
+        self._wakeup.set()
+
+    def run_once(self):
+        """Очистить все удалённые автомобили; возвращает число удалённых расходов"""
+        purged = 0
+        while not self._stopping:
+            result = self.submit(purge_batch, self.batch_size)
+            if result is None:
+                break
+            _, deleted, car_deleted = result
+            purged += deleted
+            with self._lock:
+                self._stats['expenses'] += deleted
+                self._stats['cars'] += car_deleted
+            # Между пачками писатель успевает выполнить изменения из запросов
+            time.sleep(self.pause)
+
+        if purged and self.vacuum_pages:
+            pages = self.submit(incremental_vacuum, self.vacuum_pages)
+            with self._lock:
+                self._stats['vacuumed_pages'] += pages
+
+        with self._lock:
+            self._stats['runs'] += 1
+        return purged
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                self.run_once()
+            except Exception:
+                # Например, очередь писателя переполнена - повторим в следующий раз
+                with self._lock:
+                    self._stats['errors'] += 1
+
+    def close(self):
+        """Остановить поток (текущая пачка дописывается)"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+        if thread is not None:
+            self._wakeup.set()
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+        result['running'] = self._thread is not None
+        return result
+
+
+def purge_database(conn, batch_size=500):
+    """Очистка без писателя (из командной строки); возвращает (автомобилей, расходов)"""
+    cars = expenses = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = purge_batch(conn, batch_size)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if result is None:
+            return cars, expenses
+        expenses += result[1]
+        cars += result[2]
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    database = args[0] if args else 'mycarexpenses.db'
+
+    conn = sqlite3.connect(database, isolation_level=None)
+    conn.execute("PRAGMA foreign_keys = ON")
+    migrate(conn)
+    cars, expenses = purge_database(conn)
+    print(f"БД: {database}")
+    print(f"Удалено автомобилей: {cars}, расходов: {expenses}")
+
+    if '--vacuum' in sys.argv:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        print("VACUUM выполнен, auto_vacuum = INCREMENTAL")
+    else:
+        pages = incremental_vacuum(conn, 1000000)
+        print(f"Освобождено страниц: {pages}")
+
+    conn.close()
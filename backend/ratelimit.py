@@ -0,0 +1,52 @@
+"""
+Ограничение частоты запросов (token bucket) для MyCarExpenses
+Используется для входа и регистрации: по IP-адресу и по email
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Набор «корзин с токенами», по одной на ключ
+
+    В корзине не больше capacity токенов, пополняется со скоростью rate токенов
+    в секунду; каждый запрос забирает один токен. Храним не больше max_keys
+    корзин, давно не использованные удаляются (полная корзина ничего не теряет).
+    """
+
+    def __init__(self, capacity, rate, max_keys=100000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'allowed': 0, 'limited': 0}
+
+    def acquire(self, key):
+        """Забрать токен; возвращает (разрешено, через сколько секунд повторить)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+
+            if tokens >= 1:
+                allowed, retry_after = True, 0
+                tokens -= 1
+                self._stats['allowed'] += 1
+            else:
+                allowed, retry_after = False, (1 - tokens) / self.rate
+                self._stats['limited'] += 1
+
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed, retry_after
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result['keys'] = len(self._buckets)
+        return result
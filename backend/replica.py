@@ -0,0 +1,206 @@
+"""
+Копия файла БД для тяжёлых чтений MyCarExpenses
+Отчёты и выгрузки можно читать из копии, которую поток раз в interval секунд
+обновляет через SQLite backup API. Такие чтения не держат снимок основного
+файла, поэтому не мешают контрольным точкам WAL писателя; копию можно
+положить на другой диск.
+
+Новая копия пишется в свой временный файл и атомарно подменяет прежнюю
+(os.replace), соединения пула переоткрываются. Копия хранится в режиме
+журнала DELETE: у неё нет -wal файла, который достался бы новому файлу.
+
+Копию снимает один процесс - тот, кто захватил блокировку <копия>.lock
+(у каждого рабочего процесса serve.py свой поток Replica). Остальные
+процессы только переоткрывают соединения, когда файл копии подменён; если
+процесс-владелец завершится, блокировку захватит следующий.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: блокировки нет, каждый процесс снимает копию сам (в свой временный файл)
+    fcntl = None
+
+from db import ConnectionPool
+
+# Как часто процесс, не снимающий копию, проверяет, не подменён ли файл, с
+FOLLOW_INTERVAL = 1.0
+
+
+def replica_path(database):
+    """mycarexpenses.db -> mycarexpenses.replica.db"""
+    root, ext = os.path.splitext(database)
+    return f'{root}.replica{ext or ".db"}'
+
+
+class Replica:
+    """Периодически обновляемая копия БД и пул соединений только для чтения
+
+    Копия используется, только пока она не старше max_staleness секунд
+    (например, если обновление падает с ошибкой, чтения вернутся к основной БД).
+    """
+
+    def __init__(self, database, path=None, interval=60, max_staleness=300, pool_size=8):
+        self.database = database
+        self.path = path or replica_path(database)
+        self.interval = interval
+        self.max_staleness = max_staleness
+        # Режим журнала и auto_vacuum копия получает при снятии; PRAGMA, пишущие в файл,
+        # не выполняются: файл может быть подменён между открытием и настройкой соединения
+        self.pool = ConnectionPool(
+            self.path, max_size=pool_size,
+            pragmas={'auto_vacuum': None, 'journal_mode': None, 'synchronous': None, 'query_only': 'ON'}
+        )
+        # Момент снимка текущей копии (time.time, он же mtime файла) или None, пока копии нет
+        self.snapshot_at = None
+        # (inode, mtime) файла, на который открыты соединения пула
+        self._file = None
+        # Открытый файл блокировки, пока этот процесс снимает копию
+        self._owner = None
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'refreshes': 0,
+            'reloads': 0,
+            'errors': 0,
+            'last_seconds': 0.0,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='replica', daemon=True)
+                self._thread.start()
+
+    def refresh(self):
+        """Снять новую копию и подменить ею прежнюю"""
+        started = time.time()
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)),
+            prefix=os.path.basename(self.path) + '.', suffix='.tmp'
+        )
+        os.close(fd)
+        try:
+            source = sqlite3.connect(self.database)
+            target = sqlite3.connect(tmp, isolation_level=None)
+            try:
+                # Все страницы за один шаг: один снимок, писатель при этом не ждёт
+                source.backup(target)
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+                source.close()
+            # Время изменения файла - момент снимка: по нему возраст копии видят другие процессы
+            os.utime(tmp, (started, started))
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        with self._lock:
+            self._reopen(os.stat(self.path))
+            self._stats['refreshes'] += 1
+            self._stats['last_seconds'] = round(time.time() - started, 3)
+
+    def _reopen(self, stat):
+        """Переоткрыть соединения пула на файл stat (под self._lock)"""
+        self._file = (stat.st_ino, stat.st_mtime_ns)
+        self.snapshot_at = stat.st_mtime
+        self.pool.reset()
+
+    def follow(self):
+        """Переоткрыть соединения, если файл копии подменён (другим процессом)"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if (stat.st_ino, stat.st_mtime_ns) != self._file:
+                self._reopen(stat)
+                self._stats['reloads'] += 1
+
+    def _acquire(self):
+        """Захватить обновление копии; True, если копию снимает этот процесс"""
+        if self._owner is not None or fcntl is None:
+            return True
+        lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._owner = lock_file
+        return True
+
+    def _release(self):
+        lock_file, self._owner = self._owner, None
+        if lock_file is not None:
+            lock_file.close()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            owner = False
+            try:
+                self.follow()
+                owner = self._acquire()
+                if owner:
+                    age = self.age()
+                    # Новый владелец не снимает копию заново, если прежний снял её недавно
+                    if age is None or age >= self.interval:
+                        self.refresh()
+            except Exception:
+                with self._lock:
+                    self._stats['errors'] += 1
+            self._stopping.wait(self.interval if owner else min(self.interval, FOLLOW_INTERVAL))
+        self._release()
+
+    def age(self):
+        """Возраст копии в секундах или None, если копии ещё нет"""
+        snapshot_at = self.snapshot_at
+        return None if snapshot_at is None else max(0.0, time.time() - snapshot_at)
+
+    def fresh(self):
+        age = self.age()
+        return age is not None and age <= self.max_staleness
+
+    def data_version(self, user_id):
+        """Версия данных пользователя в копии или None"""
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT data_version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def covers(self, user_id, version):
+        """Копия свежая и содержит все изменения пользователя до версии version
+
+        Пользователь, изменивший данные после снимка, читает основную БД
+        (read-your-writes), пока копия не обновится.
+        """
+        self.follow()
+        return self.fresh() and self.data_version(user_id) == version
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        self._stopping.set()
+        if thread is not None:
+            thread.join()
+        self.pool.close_all()
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+        age = self.age()
+        result['age'] = round(age, 3) if age is not None else -1
+        result['max_staleness'] = self.max_staleness
+        result['running'] = self._thread is not None
+        result['owner'] = self._owner is not None or (fcntl is None and self._thread is not None)
+        return result
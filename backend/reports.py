@@ -0,0 +1,223 @@
+"""
+Помесячные отчёты и аномалии расходов MyCarExpenses
+Фоновая задача (jobs.py) строит по помесячным агрегатам (expense_monthly)
+отчёт пользователя за каждый месяц с расходами и ищет аномалии - месяцы, в
+которые расходы категории выросли хотя бы на ANOMALY_THRESHOLD к среднему за
+ANOMALY_WINDOW предыдущих месяцев. Отчёт хранится готовым JSON ответа API
+(monthly_reports), поэтому запрос отчёта - чтение по первичному ключу.
+
+Отчёты пересчитываются, когда версия данных пользователя (users.data_version)
+отличается от версии, по которой они построены (report_state).
+"""
+
+import json
+import time
+
+from units import from_cents, month_label
+
+# Аномалия: сумма категории за месяц больше среднего за ANOMALY_WINDOW предыдущих месяцев
+# (месяцы без расходов считаются нулями) хотя бы на ANOMALY_THRESHOLD; среднее меньше
+# ANOMALY_MIN_CENTS не сравнивается, чтобы единичные мелкие расходы не давали сотни процентов
+ANOMALY_WINDOW = 3
+ANOMALY_THRESHOLD = 0.4
+ANOMALY_MIN_CENTS = 1000
+
+
+def schedule(conn, kind, now):
+    """Поставить задачу kind пользователям шарда, чьи отчёты устарели; возвращает их число
+
+    Пропускаются пользователи, размещённые на другом шарде или перенесённые с этого,
+    и пользователи, чей пересчёт уже выполняется.
+    """
+    return conn.execute("""
+        INSERT OR IGNORE INTO jobs (kind, user_id, run_at)
+        SELECT ?, u.user_id, ?
+        FROM users u
+        LEFT JOIN report_state r ON r.user_id = u.user_id
+        WHERE r.data_version IS NOT u.data_version
+          AND NOT EXISTS (SELECT 1 FROM user_shards s WHERE s.user_id = u.user_id AND s.shard != 0)
+          AND NOT EXISTS (SELECT 1 FROM moved_users m WHERE m.user_id = u.user_id)
+          AND NOT EXISTS (
+              SELECT 1 FROM jobs j WHERE j.kind = ? AND j.user_id = u.user_id AND j.status = 'running'
+          )
+    """, (kind, now, kind)).rowcount
+
+
+def load(conn, user_id):
+    """Версия данных и помесячные агрегаты пользователя одним снимком
+
+    Строки (месяц, car_id, категория, сумма в копейках, количество).
+    """
+    conn.execute("BEGIN")
+    try:
+        row = conn.execute("SELECT data_version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        rows = conn.execute("""
+            SELECT m.month, m.car_id, m.category, m.total_cents, m.expense_count
+            FROM expense_monthly m
+            JOIN cars c ON m.car_id = c.car_id
+            WHERE c.user_id = ? AND c.deleted_at IS NULL AND m.expense_count > 0
+        """, (user_id,)).fetchall()
+    finally:
+        conn.rollback()
+    return (row[0] if row else 0), rows
+
+
+def _average(total, count):
+    return round(total / count / 100, 2) if count else 0
+
+
+def _change_pct(amount, baseline):
+    return round((amount - baseline) * 100 / baseline, 1) if baseline else None
+
+
+def _anomaly(category, amount, baseline, change):
+    return {
+        'category': category,
+        'amount': from_cents(amount),
+        'baseline_amount': from_cents(baseline),
+        'change_pct': change,
+        'message': f'Расходы на «{category}» выросли на {change:g}% '
+                   f'к среднему за {ANOMALY_WINDOW} предыдущих месяца'
+    }
+
+
+def build(rows):
+    """Отчёты и аномалии по помесячным агрегатам
+
+    Возвращает ([(месяц, сумма, количество, JSON отчёта)],
+    [(месяц, категория, сумма, среднее за предыдущие месяцы, рост в процентах)]).
+    """
+    months = {}
+    for month, car_id, category, cents, count in rows:
+        stats = months.setdefault(month, {'total': 0, 'count': 0, 'by_category': {}, 'by_car': {}})
+        stats['total'] += cents
+        stats['count'] += count
+        stats['by_category'][category] = stats['by_category'].get(category, 0) + cents
+        car_total, car_count = stats['by_car'].get(car_id, (0, 0))
+        stats['by_car'][car_id] = (car_total + cents, car_count + count)
+
+    reports = []
+    anomalies = []
+    first = min(months, default=0)
+    for month in sorted(months):
+        stats = months[month]
+
+        month_anomalies = []
+        if month - ANOMALY_WINDOW >= first:
+            previous = [
+                months[m]['by_category'] if m in months else {}
+                for m in range(month - ANOMALY_WINDOW, month)
+            ]
+            for category, amount in sorted(stats['by_category'].items()):
+                baseline = round(sum(p.get(category, 0) for p in previous) / ANOMALY_WINDOW)
+                if baseline >= ANOMALY_MIN_CENTS and amount >= baseline * (1 + ANOMALY_THRESHOLD):
+                    change = _change_pct(amount, baseline)
+                    anomalies.append((month, category, amount, baseline, change))
+                    month_anomalies.append(_anomaly(category, amount, baseline, change))
+
+        previous_total = months.get(month - 1, {'total': 0})['total']
+        report = {
+            'month': month_label(month),
+            'total_amount': from_cents(stats['total']),
+            'total_count': stats['count'],
+            'average_amount': _average(stats['total'], stats['count']),
+            'by_category': {category: from_cents(cents) for category, cents in stats['by_category'].items()},
+            'by_car': [
+                {'car_id': car_id, 'total_amount': from_cents(cents), 'total_count': count}
+                for car_id, (cents, count) in sorted(stats['by_car'].items())
+            ],
+            'previous_month_amount': from_cents(previous_total),
+            'change_pct': _change_pct(stats['total'], previous_total),
+            'anomalies': month_anomalies
+        }
+        reports.append((month, stats['total'], stats['count'], json.dumps(report, ensure_ascii=False)))
+
+    return reports, anomalies
+
+
+def store(conn, user_id, version, reports, anomalies, now):
+    """Заменить отчёты и аномалии пользователя; False, если уже сохранены более новые"""
+    row = conn.execute("SELECT data_version FROM report_state WHERE user_id = ?", (user_id,)).fetchone()
+    if row is not None and row[0] > version:
+        return False
+
+    conn.execute("DELETE FROM monthly_reports WHERE user_id = ?", (user_id,))
+    conn.executemany("""
+        INSERT INTO monthly_reports (user_id, month, total_cents, expense_count, report)
+        VALUES (?, ?, ?, ?, ?)
+    """, ((user_id, *report) for report in reports))
+
+    conn.execute("DELETE FROM anomalies WHERE user_id = ?", (user_id,))
+    conn.executemany("""
+        INSERT INTO anomalies (user_id, month, category, amount_cents, baseline_cents, change_pct)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, ((user_id, *anomaly) for anomaly in anomalies))
+
+    conn.execute("""
+        INSERT OR REPLACE INTO report_state (user_id, data_version, computed_at) VALUES (?, ?, ?)
+    """, (user_id, version, now))
+    return True
+
+
+def run(read, submit, user_id):
+    """Задача 'reports': пересчитать отчёты пользователя
+
+    read(func, *args) читает func(conn, *args), submit(func, *args) - изменение.
+    """
+    version, rows = read(load, user_id)
+    reports, anomalies = build(rows)
+    submit(store, user_id, version, reports, anomalies, int(time.time()))
+
+
+def forget_user(conn, user_id):
+    """Удалить отчёты и задачи пользователя (после переноса на другой шард)"""
+    for table in ('monthly_reports', 'anomalies', 'report_state', 'jobs'):
+        conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+
+
+# ============ ЧТЕНИЕ ============
+
+def status(conn, user_id):
+    """((версия данных, время расчёта) или None, ждёт ли пересчёт)"""
+    row = conn.execute(
+        "SELECT data_version, computed_at FROM report_state WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    pending = conn.execute(
+        "SELECT 1 FROM jobs WHERE user_id = ? AND kind = 'reports' AND status != 'failed' LIMIT 1", (user_id,)
+    ).fetchone()
+    return row, pending is not None
+
+
+def fetch_reports(conn, user_id, start_month=None, end_month=None):
+    """JSON отчётов пользователя за месяцы периода (по возрастанию месяца)"""
+    where = "user_id = ?"
+    params = [user_id]
+    if start_month is not None:
+        where += " AND month >= ?"
+        params.append(start_month)
+    if end_month is not None:
+        where += " AND month <= ?"
+        params.append(end_month)
+    cursor = conn.execute(f"SELECT report FROM monthly_reports WHERE {where} ORDER BY month", params)
+    return [row[0] for row in cursor]
+
+
+def fetch_report(conn, user_id, month):
+    row = conn.execute(
+        "SELECT report FROM monthly_reports WHERE user_id = ? AND month = ?", (user_id, month)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def fetch_anomalies(conn, user_id, limit):
+    """Последние аномалии пользователя (сначала новые)"""
+    cursor = conn.execute("""
+        SELECT month, category, amount_cents, baseline_cents, change_pct
+        FROM anomalies WHERE user_id = ?
+        ORDER BY month DESC, category
+        LIMIT ?
+    """, (user_id, limit))
+    return [
+        {'month': month_label(month), **_anomaly(category, amount, baseline, change)}
+        for month, category, amount, baseline, change in cursor
+    ]
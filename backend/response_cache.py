@@ -0,0 +1,82 @@
+"""
+Кэш готовых ответов API для MyCarExpenses
+Тело ответа хранится уже сериализованным и отдаётся повторно, пока не
+изменилась версия данных пользователя (users.data_version)
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def make_etag(user_id, endpoint, args, version):
+    """Сильный ETag (без кавычек): версия данных пользователя + эндпоинт + параметры"""
+    key = f"{user_id}|{endpoint}|{args}".encode('utf-8')
+    digest = hashlib.sha1(key).hexdigest()[:16]
+    return f'v{version}-{digest}'
+
+
+class ResponseCache:
+    """LRU-кэш сериализованных ответов с ограничением по памяти
+
+    Ключ - (user_id, эндпоинт, параметры запроса). Вместе с телом хранится
+    ETag, по которому проверяется, что запись соответствует текущей версии данных.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'not_modified': 0,
+            'evictions': 0,
+        }
+
+    def get(self, key, etag):
+        """(тело, mimetype) если в кэше есть ответ с этим ETag, иначе None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == etag:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1], entry[2]
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key, etag, body, mimetype):
+        if len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+
+            self._entries[key] = (etag, body, mimetype)
+            self._size += len(body)
+
+            # Вытесняем самые давно использованные ответы, пока не уложимся в лимит
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted[1])
+                self._stats['evictions'] += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self._stats['not_modified'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result['entries'] = len(self._entries)
+            result['bytes'] = self._size
+        result['max_bytes'] = self.max_bytes
+        return result
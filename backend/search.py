@@ -0,0 +1,111 @@
+"""
+Полнотекстовый поиск расходов MyCarExpenses
+Индекс expense_search (FTS5, см. migrations.py) хранит слова описания и марки/модели
+автомобиля как есть. Морфология учитывается при поиске: слова запроса приводятся
+к основе (облегчённый стеммер для русского), основа ищется как префикс.
+Отбор, релевантность, сортировка и курсор страницы считаются в SQL (score_sql),
+поэтому страница не требует разбора всех найденных расходов в Python.
+"""
+
+import re
+from functools import lru_cache
+
+# Короче префиксного индекса FTS5 (prefix='3' в migrations.py) слова ищутся целиком
+PREFIX_LENGTH = 3
+MAX_QUERY_LENGTH = 200
+MAX_TERMS = 8
+
+# Слово - как у токенизатора unicode61: буквы и цифры, '_' - разделитель
+WORD_RE = re.compile(r'[^\W_]+')
+CYRILLIC_RE = re.compile('[а-я]')
+VOWELS = set('аеиоуыэюя')
+
+# Окончания существительных, прилагательных и глаголов; отбрасывается самое длинное
+ENDINGS = sorted({
+    # прилагательные
+    'ыми', 'ими', 'ого', 'его', 'ому', 'ему', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+    'ый', 'ий', 'ой', 'ую', 'юю', 'ым', 'им', 'их', 'ых',
+    # существительные
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ях', 'ах', 'ям', 'ам', 'ов', 'ев',
+    'ей', 'ом', 'ем', 'ию', 'ия', 'ие', 'ии', 'ью', 'ья', 'ьи',
+    'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь', 'й',
+    # глаголы
+    'ить', 'ать', 'ять', 'еть', 'ешь', 'ете', 'ет', 'ут', 'ют', 'ит', 'ат', 'ят',
+    'ла', 'ли', 'ло', 'ть',
+}, key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+# Веса совпадений для сортировки результатов
+DESCRIPTION_WEIGHT = 2
+CAR_WEIGHT = 1
+
+
+def normalize(text):
+    """Нижний регистр, ё -> е (так же текст попадает в индекс)"""
+    return text.lower().replace('ё', 'е')
+
+
+@lru_cache(maxsize=16384)
+def words(text):
+    # Описания часто повторяются ("Полный бак 95"), разбор кэшируется
+    return tuple(WORD_RE.findall(normalize(text))) if text else ()
+
+
+def stem(word):
+    """Основа русского слова; слова без кириллицы не меняются"""
+    if not CYRILLIC_RE.search(word):
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            word = word[:-len(ending)]
+            break
+    # Суффикс -к- с беглой гласной: колодка/колодок, заправка/заправок
+    if word.endswith('к') and len(word) > MIN_STEM_LENGTH and word[-2] not in VOWELS:
+        word = word[:-1]
+    return word
+
+
+def query_terms(query):
+    """Основы слов запроса, ValueError если искать нечего"""
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValueError(f'Запрос длиннее {MAX_QUERY_LENGTH} символов')
+    terms = []
+    for word in words(query):
+        term = stem(word)
+        if len(term) >= 2 and term not in terms:
+            terms.append(term)
+    if not terms:
+        raise ValueError('Пустой поисковый запрос (нужно хотя бы одно слово из 2 букв)')
+    return terms[:MAX_TERMS]
+
+
+def _phrase(term):
+    # Короткие слова ("95", "то") ищутся целиком, остальные - как префикс основы
+    if len(term) < PREFIX_LENGTH:
+        return f'"{term}"'
+    return f'"{term}"*'
+
+
+def match_expression(user_id, terms):
+    """Выражение MATCH: расходы пользователя, где есть все слова запроса"""
+    phrases = ' AND '.join(_phrase(term) for term in terms)
+    return f'owner : "u{int(user_id)}" AND {{description car}} : ({phrases})'
+
+
+def score_sql(user_id, terms):
+    """Выражение SQL для релевантности расхода e и его параметры
+
+    За каждое слово запроса: DESCRIPTION_WEIGHT, если оно есть в описании,
+    и CAR_WEIGHT - если в марке и модели автомобиля. Каждое условие - один
+    подзапрос к индексу, SQLite вычисляет его один раз на запрос.
+    """
+    parts = []
+    params = []
+    for term in terms:
+        for column, weight in (('description', DESCRIPTION_WEIGHT), ('car', CAR_WEIGHT)):
+            parts.append(
+                "CASE WHEN e.expense_id IN "
+                f"(SELECT rowid FROM expense_search WHERE expense_search MATCH ?) THEN {weight} ELSE 0 END"
+            )
+            params.append(f'owner : "u{int(user_id)}" AND {column} : {_phrase(term)}')
+    return ' + '.join(parts), params
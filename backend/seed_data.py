@@ -1,22 +1,67 @@
 """
 Скрипт для заполнения БД демо-данными с несколькими пользователями
+
+Режим генерации нагрузочных данных (миллионы расходов):
+    python seed_data.py --generate --users 20000 --cars-per-user 2 --expenses-per-car 500
 """
 
+import argparse
 import sqlite3
+import time
 from werkzeug.security import generate_password_hash
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import random
 
-def seed_database():
+from migrations import migrate, rebuild_derived
+from units import to_cents, to_day
+
+# Описания расходов по категориям
+DESCRIPTIONS = {
+    "Топливо": [
+        "Заправка на АЗС Белоруснефть",
+        "Полный бак 95",
+        "Заправка 20 литров",
+        "Дозаправка"
+    ],
+    "Ремонт": [
+        "Замена тормозных колодок",
+        "Ремонт подвески",
+        "Замена аккумулятора",
+        "Замена свечей"
+    ],
+    "Обслуживание": [
+        "ТО-1",
+        "Замена масла и фильтров",
+        "Техосмотр",
+        "Диагностика"
+    ],
+    "Страховка": ["Годовая страховка ОСАГО"],
+    "Налоги": ["Транспортный налог", "Госпошлина"],
+    "Мойка": ["Мойка кузова", "Мойка + химчистка салона", "Комплексная мойка"],
+    "Другое": ["Парковка", "Автомойка", "Ароматизатор", "Щетки стеклоочистителя"]
+}
+
+# Таблицы, которые ссылаются на пользователей: очередь задач, готовые отчёты,
+# размещение по шардам и журнал переноса (агрегаты и поисковый индекс чистят триггеры)
+USER_TABLES = (
+    'expenses', 'cars', 'jobs', 'report_state', 'monthly_reports', 'anomalies',
+    'user_shards', 'moved_users', 'move_tracking', 'move_changes', 'users',
+)
+
+def clear_data(conn):
+    """Удалить всех пользователей и всё, что к ним относится"""
+    for table in USER_TABLES:
+        conn.execute(f"DELETE FROM {table}")
+
+def seed_database(database='mycarexpenses.db'):
     """Заполнение базы данных тестовыми данными"""
 
-    conn = sqlite3.connect('mycarexpenses.db')
+    conn = sqlite3.connect(database)
+    migrate(conn)
     cursor = conn.cursor()
 
     # Очистка существующих данных
-    cursor.execute("DELETE FROM expenses")
-    cursor.execute("DELETE FROM cars")
-    cursor.execute("DELETE FROM users")
+    clear_data(conn)
 
     print("=" * 70)
     print("СОЗДАНИЕ ТЕСТОВЫХ ПОЛЬЗОВАТЕЛЕЙ")
@@ -72,36 +117,12 @@ def seed_database():
             if amount > 0:
                 date_str = current_date.strftime("%Y-%m-%d")
 
-                descriptions = {
-                    "Топливо": [
-                        "Заправка на АЗС Белоруснефть",
-                        "Полный бак 95",
-                        "Заправка 20 литров",
-                        "Дозаправка"
-                    ],
-                    "Ремонт": [
-                        "Замена тормозных колодок",
-                        "Ремонт подвески",
-                        "Замена аккумулятора",
-                        "Замена свечей"
-                    ],
-                    "Обслуживание": [
-                        "ТО-1",
-                        "Замена масла и фильтров",
-                        "Техосмотр",
-                        "Диагностика"
-                    ],
-                    "Страховка": ["Годовая страховка ОСАГО"],
-                    "Мойка": ["Мойка кузова", "Мойка + химчистка салона", "Комплексная мойка"],
-                    "Другое": ["Парковка", "Автомойка", "Ароматизатор", "Щетки стеклоочистителя"]
-                }
-
-                description = random.choice(descriptions[category])
+                description = random.choice(DESCRIPTIONS[category])
 
                 cursor.execute("""
-                    INSERT INTO expenses (car_id, date, amount, category, description)
+                    INSERT INTO expenses (car_id, day, amount_cents, category, description)
                     VALUES (?, ?, ?, ?, ?)
-                """, (car1_id, date_str, amount, category, description))
+                """, (car1_id, to_day(date_str), to_cents(amount), category, description))
 
                 expenses_count += 1
 
@@ -164,9 +185,9 @@ def seed_database():
         description = f"{category} - запись {i+1}"
 
         cursor.execute("""
-            INSERT INTO expenses (car_id, date, amount, category, description)
+            INSERT INTO expenses (car_id, day, amount_cents, category, description)
             VALUES (?, ?, ?, ?, ?)
-        """, (car_id, expense_date, amount, category, description))
+        """, (car_id, to_day(expense_date), to_cents(amount), category, description))
 
         expenses_2_count += 1
 
@@ -218,9 +239,9 @@ def seed_database():
         description = f"{category} #{i+1}"
 
         cursor.execute("""
-            INSERT INTO expenses (car_id, date, amount, category, description)
+            INSERT INTO expenses (car_id, day, amount_cents, category, description)
             VALUES (?, ?, ?, ?, ?)
-        """, (car4_id, expense_date, amount, category, description))
+        """, (car4_id, to_day(expense_date), to_cents(amount), category, description))
 
         expenses_3_count += 1
 
@@ -274,9 +295,9 @@ def seed_database():
         description = f"Расход: {category.lower()}"
 
         cursor.execute("""
-            INSERT INTO expenses (car_id, date, amount, category, description)
+            INSERT INTO expenses (car_id, day, amount_cents, category, description)
             VALUES (?, ?, ?, ?, ?)
-        """, (car5_id, expense_date, amount, category, description))
+        """, (car5_id, to_day(expense_date), to_cents(amount), category, description))
 
         expenses_4_count += 1
 
@@ -304,5 +325,220 @@ def seed_database():
     print("4. Email: dmitry.kozlov@gmail.com     | Пароль: test123")
     print("-" * 70)
 
+# ========================================
+# ГЕНЕРАЦИЯ НАГРУЗОЧНЫХ ДАННЫХ
+# ========================================
+
+# Доля категории среди расходов и диапазон суммы
+DEFAULT_CATEGORY_WEIGHTS = {
+    "Топливо": 0.55,
+    "Ремонт": 0.08,
+    "Обслуживание": 0.07,
+    "Страховка": 0.02,
+    "Налоги": 0.02,
+    "Мойка": 0.16,
+    "Другое": 0.10
+}
+
+AMOUNT_RANGES = {
+    "Топливо": (40, 80),
+    "Ремонт": (50, 300),
+    "Обслуживание": (60, 180),
+    "Страховка": (100, 200),
+    "Налоги": (50, 150),
+    "Мойка": (10, 30),
+    "Другое": (5, 50)
+}
+
+CAR_MODELS = [
+    ("VAZ", "07"), ("Toyota", "Camry"), ("Volkswagen", "Polo"), ("Mazda", "3"),
+    ("Audi", "A4"), ("Renault", "Logan"), ("Skoda", "Octavia"), ("Geely", "Coolray")
+]
+
+# Настройки SQLite на время загрузки: без журнала и fsync, большой кэш
+LOAD_PRAGMAS = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF',
+    'cache_size': -262144,
+    'temp_store': 'MEMORY',
+    'locking_mode': 'EXCLUSIVE',
+}
+
+def parse_weights(value):
+    """Разбор строки вида "Топливо=0.6,Мойка=0.4" """
+    weights = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+def generate_expenses(car_ids, expenses_per_car, start, end, weights, rng):
+    """Генератор строк расходов (car_id, day, amount_cents, category, description)"""
+    span = (end - start).days + 1
+    first_day = to_day(start.isoformat())
+    categories = list(weights)
+    cum_weights = []
+    total = 0
+    for category in categories:
+        total += weights[category]
+        cum_weights.append(total)
+
+    for car_id in car_ids:
+        picked = rng.choices(categories, cum_weights=cum_weights, k=expenses_per_car)
+        for category in picked:
+            low, high = AMOUNT_RANGES.get(category, (5, 100))
+            yield (
+                car_id,
+                first_day + rng.randrange(span),
+                round(rng.uniform(low, high) * 100),
+                category,
+                rng.choice(DESCRIPTIONS.get(category, ["Расход"]))
+            )
+
+def generate_load_data(database, users, cars_per_user, expenses_per_car,
+                       start, end, weights, seed, batch_size, reset):
+    """Массовая загрузка сгенерированных пользователей, автомобилей и расходов
+
+    Триггеры и индексы таблицы expenses на время загрузки удаляются и создаются
+    заново после неё, агрегаты пересчитываются одним запросом. Если загрузка
+    прервалась (ошибка, Ctrl-C), индексы, триггеры и агрегаты всё равно
+    восстанавливаются по уже загруженным строкам.
+    """
+    rng = random.Random(seed)
+    started = time.time()
+
+    conn = sqlite3.connect(database)
+    migrate(conn)
+
+    if reset:
+        clear_data(conn)
+        conn.commit()
+
+    for name, value in LOAD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+    # Сохраняем и удаляем триггеры и индексы expenses
+    saved = conn.execute("""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name = 'expenses' AND type IN ('trigger', 'index') AND sql IS NOT NULL
+    """).fetchall()
+    for obj_type, name, _ in saved:
+        conn.execute(f"DROP {obj_type.upper()} {name}")
+    conn.commit()
+
+    try:
+        print("=" * 70)
+        print("ГЕНЕРАЦИЯ НАГРУЗОЧНЫХ ДАННЫХ")
+        print("=" * 70)
+        print(f"  Пользователей: {users}, автомобилей на пользователя: {cars_per_user}")
+        print(f"  Расходов на автомобиль: {expenses_per_car}, период: {start} - {end}")
+        print(f"  Всего расходов: {users * cars_per_user * expenses_per_car}")
+        print()
+
+        # Один хеш на всех: хеширование пароля для каждого пользователя заняло бы часы
+        hashed_password = generate_password_hash("load123")
+
+        first_user = (conn.execute("SELECT MAX(user_id) FROM users").fetchone()[0] or 0) + 1
+        first_car = (conn.execute("SELECT MAX(car_id) FROM cars").fetchone()[0] or 0) + 1
+
+        user_ids = range(first_user, first_user + users)
+        conn.executemany("""
+            INSERT INTO users (user_id, username, email, hashed_password)
+            VALUES (?, ?, ?, ?)
+        """, ((uid, f"Load User {uid}", f"user{uid}@load.test", hashed_password) for uid in user_ids))
+
+        car_rows = []
+        for index in range(users * cars_per_user):
+            make, model = CAR_MODELS[rng.randrange(len(CAR_MODELS))]
+            car_rows.append((
+                first_car + index,
+                first_user + index // cars_per_user,
+                make,
+                model,
+                rng.randint(1990, 2024),
+                f"{rng.randint(0, 9999):04d}AB-{rng.randint(1, 7)}",
+                rng.choice(["Бензин", "Дизель", "Газ", "Электро"])
+            ))
+        conn.executemany("""
+            INSERT INTO cars (car_id, user_id, make, model, year, license_plate, fuel_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, car_rows)
+        conn.commit()
+
+        car_ids = [row[0] for row in car_rows]
+        rows = generate_expenses(car_ids, expenses_per_car, start, end, weights, rng)
+        total_rows = users * cars_per_user * expenses_per_car
+        inserted = 0
+
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            conn.executemany("""
+                INSERT INTO expenses (car_id, day, amount_cents, category, description)
+                VALUES (?, ?, ?, ?, ?)
+            """, batch)
+            conn.commit()
+            inserted += len(batch)
+            elapsed = time.time() - started
+            print(f"  Расходов: {inserted}/{total_rows} ({inserted / elapsed:.0f} строк/с)")
+    finally:
+        # Незафиксированная пачка отбрасывается, загруженное остаётся
+        conn.rollback()
+        print()
+        print("Восстановление индексов и триггеров...")
+        for obj_type, _, sql in saved:
+            if obj_type == 'index':
+                conn.execute(sql)
+        for obj_type, _, sql in saved:
+            if obj_type == 'trigger':
+                conn.execute(sql)
+        conn.commit()
+
+        print("Пересчет помесячных агрегатов...")
+        rebuild_derived(conn)
+        conn.execute("ANALYZE")
+        conn.commit()
+
+        # Возвращаем обычный режим работы сервера
+        conn.execute("PRAGMA locking_mode = NORMAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.close()
+
+    print()
+    print("=" * 70)
+    print(f"ГОТОВО за {time.time() - started:.1f} с")
+    print("=" * 70)
+    print(f"  Email: user{first_user}@load.test ... user{first_user + users - 1}@load.test")
+    print("  Пароль: load123")
+
+def main():
+    parser = argparse.ArgumentParser(description="Заполнение БД MyCarExpenses")
+    parser.add_argument("--db", default="mycarexpenses.db", help="путь к файлу БД")
+    parser.add_argument("--generate", action="store_true",
+                        help="сгенерировать нагрузочные данные вместо демо-данных")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--cars-per-user", type=int, default=2)
+    parser.add_argument("--expenses-per-car", type=int, default=500)
+    parser.add_argument("--start-date", type=date.fromisoformat, default=date(2015, 1, 1))
+    parser.add_argument("--end-date", type=date.fromisoformat, default=date(2024, 12, 31))
+    parser.add_argument("--categories", type=parse_weights, default=DEFAULT_CATEGORY_WEIGHTS,
+                        help='доли категорий, например "Топливо=0.6,Мойка=0.4"')
+    parser.add_argument("--seed", type=int, default=42, help="зерно генератора случайных чисел")
+    parser.add_argument("--batch-size", type=int, default=100000,
+                        help="строк в одной транзакции")
+    parser.add_argument("--reset", action="store_true", help="удалить существующие данные")
+    args = parser.parse_args()
+
+    if not args.generate:
+        seed_database(args.db)
+        return
+
+    generate_load_data(
+        args.db, args.users, args.cars_per_user, args.expenses_per_car,
+        args.start_date, args.end_date, args.categories, args.seed,
+        args.batch_size, args.reset
+    )
+
 if __name__ == "__main__":
-    seed_database()
+    main()
@@ -0,0 +1,167 @@
+"""
+Быстрая сериализация JSON для MyCarExpenses
+Списки расходов и автомобилей кодируются прямо из строк БД (кортежей) без
+промежуточного словаря на строку: значения кодируются по столбцам и
+подставляются в заготовленный шаблон объекта. Ключи идут по алфавиту, как
+в jsonify, кириллица не экранируется.
+
+Если установлен orjson, через него кодируются числовые столбцы и работает
+jsonify (JSONProvider); без orjson используется стандартный json.
+"""
+
+import json
+from itertools import chain
+from json.encoder import encode_basestring
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # Как DefaultJSONProvider: ключи по алфавиту, даты через default (http_date)
+    ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+MIMETYPE = 'application/json'
+
+
+def backend():
+    return 'orjson' if orjson is not None else 'json'
+
+
+def dumps(obj):
+    """JSON в байтах: orjson, если установлен, иначе json без экранирования кириллицы"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=ORJSON_OPTIONS)
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+class JSONProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask: jsonify через orjson, если он установлен"""
+
+    def dumps(self, obj, **kwargs):
+        # Параметры json.dumps (indent в режиме отладки) orjson не поддерживает
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode('utf-8')
+
+
+# ============ СТРОКИ БД ============
+
+def _value(value):
+    """JSON значения любого типа (редкий случай: строка в числовом столбце и т.п.)"""
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _encode(value):
+    cls = value.__class__
+    if cls is str:
+        return encode_basestring(value)
+    if cls is int or cls is float:
+        return value.__repr__()
+    if value is None:
+        return 'null'
+    return _value(value)
+
+
+_NUMBERS = {int, float, type(None)}
+
+# Кодирование столбца из значений одного типа без вызова Python-функции на значение
+_SAME_TYPE = {
+    str: encode_basestring,
+    int: int.__repr__,
+    float: float.__repr__,
+}
+
+
+def _convert(values, convert):
+    """Преобразование значений столбца (None не преобразуется)"""
+    distinct = set(values)
+    if len(distinct) * 2 <= len(values):
+        # Значения повторяются (даты) - преобразуем каждое один раз
+        converted = {value: None if value is None else convert(value) for value in distinct}
+        return list(map(converted.__getitem__, values))
+    if None in distinct:
+        return [None if value is None else convert(value) for value in values]
+    return list(map(convert, values))
+
+
+def _column(values, convert=None):
+    """JSON значений столбца (списком строк)"""
+    if convert is not None:
+        values = _convert(values, convert)
+    types = set(map(type, values))
+    if orjson is not None and types <= _NUMBERS:
+        # Весь столбец чисел одним вызовом orjson (в числах нет запятых)
+        return orjson.dumps(values).decode('ascii')[1:-1].split(',')
+    if len(types) == 1:
+        encode = _SAME_TYPE.get(types.pop())
+        if encode is not None:
+            return list(map(encode, values))
+    return list(map(_encode, values))
+
+
+class Records:
+    """Кодировщик строк БД в JSON-объекты с полями fields
+
+    converters - преобразование значения каждого поля (или None), как в
+    EXPENSE_COLUMNS; None не преобразуется. Строки - кортежи или sqlite3.Row,
+    поля начинаются с колонки offset.
+
+    Строки раскладываются по столбцам срезами, каждый столбец кодируется целиком,
+    а объекты собираются одним join из закодированных значений и ключей.
+    """
+
+    def __init__(self, fields, converters=None):
+        self.fields = tuple(fields)
+        converters = converters or (None,) * len(self.fields)
+        self._order = sorted(range(len(self.fields)), key=self.fields.__getitem__)
+        self._converters = [converters[index] for index in self._order]
+        self._keys = [encode_basestring(self.fields[index]) + ':' for index in self._order]
+
+    def _join(self, rows, offset, separator=','):
+        """Объекты rows через separator (без скобок массива)"""
+        if not rows:
+            return ''
+        # Перед первым полем объекта - конец предыдущего
+        prefixes = ['}' + separator + '{' + self._keys[0]] + [',' + key for key in self._keys[1:]]
+        width = len(rows[0])
+        flat = tuple(chain.from_iterable(rows))
+        count = len(rows)
+        step = 2 * len(self._order)
+
+        parts = [None] * (step * count)
+        for position, (index, convert) in enumerate(zip(self._order, self._converters)):
+            parts[2 * position::step] = [prefixes[position]] * count
+            parts[2 * position + 1::step] = _column(flat[offset + index::width], convert)
+        parts[0] = '{' + self._keys[0]
+        parts.append('}')
+        return ''.join(parts)
+
+    def array(self, rows, offset=0):
+        """JSON-массив объектов в байтах"""
+        return ('[%s]' % self._join(rows, offset)).encode('utf-8')
+
+    def lines(self, rows, offset=0):
+        """Объекты по одному в строке (NDJSON) в байтах"""
+        if not rows:
+            return b''
+        return (self._join(rows, offset, '\n') + '\n').encode('utf-8')
+
+    def stream(self, first, cursor, offset=0, batch_size=1000):
+        """JSON-массив частями: пачка first, затем остальные строки курсора пачками по batch_size"""
+        yield b'['
+        rows = first
+        separator = ''
+        while rows:
+            yield (separator + self._join(rows, offset)).encode('utf-8')
+            separator = ','
+            rows = cursor.fetchmany(batch_size)
+        yield b']'
+
+
+def page(records, rows, offset, next_cursor):
+    """Страница {"items": [...], "next_cursor": ...} в байтах"""
+    return b'{"items":%s,"next_cursor":%s}' % (records.array(rows, offset), dumps(next_cursor))
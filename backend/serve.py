@@ -0,0 +1,89 @@
+"""
+Запуск MyCarExpenses под нагрузкой (gunicorn, несколько процессов и потоков)
+
+База данных инициализируется один раз в главном процессе до запуска рабочих;
+по SIGTERM/SIGINT рабочие процессы дообслуживают текущие запросы
+(не дольше graceful-timeout) и закрывают соединения с БД.
+
+Настройки берутся из аргументов или окружения:
+    MYCAREXPENSES_BIND              адрес (0.0.0.0:5000)
+    MYCAREXPENSES_WORKERS           число процессов (по числу ядер)
+    MYCAREXPENSES_THREADS           потоков в процессе (4)
+    MYCAREXPENSES_GRACEFUL_TIMEOUT  секунд на завершение запросов при остановке (30)
+    MYCAREXPENSES_SECRET_KEY        ключ подписи JWT (обязателен)
+    MYCAREXPENSES_TRUSTED_PROXIES   число прокси перед сервером (0); за nginx и т.п. - 1,
+                                    иначе ограничение входа по IP общее для всех клиентов
+
+Пример:
+    MYCAREXPENSES_SECRET_KEY=... python serve.py --workers 4 --threads 8
+"""
+
+import argparse
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+from app import app, init_db, release_resources, DEV_SECRET_KEY
+
+
+def env(name, default):
+    return os.environ.get('MYCAREXPENSES_' + name, default)
+
+
+class Server(BaseApplication):
+    """Приложение gunicorn с настройками из кода, без конфигурационного файла"""
+
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def on_starting(server):
+    # Миграции выполняются один раз, а не в каждом рабочем процессе;
+    # соединения главного процесса закрываем, чтобы они не попали в дочерние
+    init_db()
+    release_resources()
+
+
+def worker_exit(server, worker):
+    release_resources()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск API MyCarExpenses")
+    parser.add_argument("--bind", default=env('BIND', '0.0.0.0:5000'))
+    parser.add_argument("--workers", type=int, default=int(env('WORKERS', os.cpu_count() or 1)))
+    parser.add_argument("--threads", type=int, default=int(env('THREADS', 4)))
+    parser.add_argument("--graceful-timeout", type=int, default=int(env('GRACEFUL_TIMEOUT', 30)))
+    parser.add_argument("--access-log", default=env('ACCESS_LOG', None),
+                        help="файл журнала запросов ('-' - stdout)")
+    args = parser.parse_args()
+
+    if app.config['SECRET_KEY'] == DEV_SECRET_KEY:
+        sys.exit("Задайте MYCAREXPENSES_SECRET_KEY: ключ по умолчанию допустим только для разработки")
+
+    Server(app, {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'graceful_timeout': args.graceful_timeout,
+        'timeout': args.graceful_timeout + 30,
+        'preload_app': True,
+        'accesslog': args.access_log,
+        'on_starting': on_starting,
+        'worker_exit': worker_exit,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,559 @@
+"""
+Шардирование MyCarExpenses по пользователям
+Данные пользователя (автомобили, расходы, агрегаты, поисковый индекс) целиком лежат
+в одном файле SQLite - шарде. Шард 0 - основная БД (DATABASE): в ней же каталог
+пользователей (users для входа) и размещение user_shards (нет строки - шард 0).
+Дополнительные шарды 1..N - файлы из SHARDS; у каждого свой писатель, поэтому
+изменения разных шардов не ждут одну блокировку SQLite.
+
+Новый пользователь размещается по кольцу (consistent hashing): при добавлении шарда
+на него переезжает лишь около 1/N пользователей. Переезд выполняет rebalance без
+остановки сервера.
+
+car_id и expense_id уникальны между шардами: каждый шард выдаёт их из своего
+диапазона (id_ranges), поэтому при переезде идентификаторы не меняются.
+
+Запуск (без путей к БД - DATABASE и SHARDS из настроек app.py):
+    python shards.py migrate   [основная БД] [шард1.db ...]
+    python shards.py status    [основная БД] [шард1.db ...]
+    python shards.py rebalance [основная БД] [шард1.db ...] [--limit N] [--grace 10] [--dry-run]
+"""
+
+import argparse
+import bisect
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from db import DEFAULT_PRAGMAS
+from migrations import migrate
+from purge import purge_database
+import reports
+
+# Размер диапазона идентификаторов шарда: шард n выдаёт id из [n * ID_RANGE + 1, (n + 1) * ID_RANGE)
+ID_RANGE = 2 ** 40
+# Точек кольца на шард: чем больше, тем ровнее распределение
+RING_REPLICAS = 64
+
+
+class UserMoved(Exception):
+    """Пользователь перенесён на шард shard, изменение нужно повторить там"""
+
+    def __init__(self, user_id, shard):
+        super().__init__(user_id, shard)
+        self.user_id = user_id
+        self.shard = shard
+
+
+# ============ РАЗМЕЩЕНИЕ ============
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Кольцо consistent hashing: номер шарда по user_id
+
+    Каждый шард представлен replicas точками; пользователь достаётся шарду
+    первой точки по часовой стрелке от хеша user_id.
+    """
+
+    def __init__(self, shards, replicas=RING_REPLICAS):
+        points = sorted(
+            (_hash(f'shard-{shard}-{replica}'), shard)
+            for shard in shards
+            for replica in range(replicas)
+        )
+        self._keys = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, user_id):
+        index = bisect.bisect(self._keys, _hash(str(user_id))) % len(self._keys)
+        return self._shards[index]
+
+
+class ShardRouter:
+    """Номер шарда пользователя с кэшем
+
+    load(user_id) читает каталог (user_shards в основной БД). Запись живёт ttl
+    секунд: о переезде пользователя другие процессы узнают не позже чем через ttl,
+    а до этого их изменения на старом шарде отклоняются (UserMoved) и повторяются
+    на шарде из moved_users (redirect) - каталог переключается после этой отметки.
+    """
+
+    def __init__(self, load, ttl=5, max_size=100000):
+        self.load = load
+        self.ttl = ttl
+        self.max_size = max_size
+        self._shards = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'redirects': 0,
+        }
+
+    def shard_of(self, user_id):
+        with self._lock:
+            entry = self._shards.get(user_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._shards.move_to_end(user_id)
+                self._stats['hits'] += 1
+                return entry[0]
+            self._stats['misses'] += 1
+
+        shard = self.load(user_id)
+        with self._lock:
+            self._shards[user_id] = (shard, time.monotonic() + self.ttl)
+            self._shards.move_to_end(user_id)
+            while len(self._shards) > self.max_size:
+                self._shards.popitem(last=False)
+        return shard
+
+    def redirect(self, user_id, shard):
+        """Запомнить новый шард пользователя из UserMoved, не дожидаясь каталога"""
+        with self._lock:
+            self._shards[user_id] = (shard, time.monotonic() + self.ttl)
+            self._shards.move_to_end(user_id)
+            self._stats['redirects'] += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._shards.pop(user_id, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result['users'] = len(self._shards)
+        result['ttl'] = self.ttl
+        return result
+
+
+def user_shard(conn, user_id):
+    """Шард пользователя по каталогу основной БД"""
+    row = conn.execute("SELECT shard FROM user_shards WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def set_user_shard(conn, user_id, shard):
+    """Записать шард пользователя в каталог (шард 0 - строка не нужна)"""
+    if shard == 0:
+        conn.execute("DELETE FROM user_shards WHERE user_id = ?", (user_id,))
+    else:
+        conn.execute(
+            "INSERT OR REPLACE INTO user_shards (user_id, shard) VALUES (?, ?)",
+            (user_id, shard)
+        )
+
+
+def add_user_stub(conn, user_id, username, email):
+    """Строка пользователя на шарде (для внешних ключей и data_version)
+
+    Пароль хранится только в основной БД; на шарде 0 строка уже есть.
+    """
+    conn.execute("""
+        INSERT INTO users (user_id, username, email, hashed_password) VALUES (?, ?, ?, '')
+        ON CONFLICT (user_id) DO NOTHING
+    """, (user_id, username, email))
+
+
+# ============ ИЗМЕНЕНИЯ НА ШАРДЕ ============
+
+def allocate_ids(conn, table, count=1):
+    """Первый из count подряд идущих идентификаторов для table из диапазона шарда
+
+    None, если диапазон не задан (БД без шардов) - тогда идентификатор выдаёт SQLite.
+    Выполняется в транзакции писателя.
+    """
+    row = conn.execute("""
+        UPDATE id_ranges SET next_id = next_id + ? WHERE table_name = ?
+        RETURNING next_id - ?, last_id
+    """, (count, table, count)).fetchone()
+    if row is None:
+        return None
+    first_id, last_id = row
+    if first_id + count - 1 > last_id:
+        raise RuntimeError(f'Диапазон идентификаторов {table} на шарде исчерпан')
+    return first_id
+
+
+def run_for_user(conn, user_id, func, *args):
+    """func(conn, *args), если пользователь не перенесён с этого шарда, иначе UserMoved
+
+    Перенос отмечается в moved_users той же блокировкой записи, поэтому изменение
+    не может попасть на старый шард после копирования данных. Каталог переключается
+    уже после отметки, поэтому новый шард берётся из moved_users.
+    """
+    row = conn.execute("SELECT shard FROM moved_users WHERE user_id = ?", (user_id,)).fetchone()
+    if row is not None:
+        raise UserMoved(user_id, row[0])
+    return func(conn, *args)
+
+
+def init_shard(conn, number):
+    """Миграции шарда и его диапазон идентификаторов; возвращает применённые миграции"""
+    applied = migrate(conn)
+    first_id = number * ID_RANGE + 1
+    last_id = (number + 1) * ID_RANGE - 1
+    for table, column in (('cars', 'car_id'), ('expenses', 'expense_id')):
+        # Диапазон продолжается после уже выданных идентификаторов шарда
+        conn.execute(f"""
+            INSERT OR IGNORE INTO id_ranges (table_name, next_id, last_id)
+            SELECT ?, COALESCE(MAX({column}) + 1, ?), ?
+            FROM {table} WHERE {column} BETWEEN ? AND ?
+        """, (table, first_id, last_id, first_id, last_id))
+    conn.commit()
+    return applied
+
+
+# ============ ПЕРЕНОС ПОЛЬЗОВАТЕЛЕЙ ============
+
+def data_version(conn, user_id):
+    row = conn.execute("SELECT data_version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    if row is None:
+        raise ValueError(f'Пользователя {user_id} нет на шарде')
+    return row[0]
+
+
+def copy_user(src, dst, user_id):
+    """Скопировать пользователя, его автомобили и расходы с src на dst
+
+    src читается внутри транзакции вызывающего (один снимок данных), dst
+    записывается одной транзакцией; прежняя копия на dst заменяется. Агрегаты
+    и поисковый индекс dst заполняют триггеры. Удалённые автомобили не копируются.
+    Возвращает (data_version, автомобилей, расходов).
+    """
+    version = data_version(src, user_id)
+    username, email = src.execute(
+        "SELECT username, email FROM users WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    cars = src.execute("""
+        SELECT car_id, user_id, make, model, year, license_plate, fuel_type
+        FROM cars WHERE user_id = ? AND deleted_at IS NULL
+    """, (user_id,)).fetchall()
+    expenses = src.execute("""
+        SELECT e.expense_id, e.car_id, e.day, e.amount_cents, e.currency, e.category, e.description
+        FROM expenses e
+        JOIN cars c ON e.car_id = c.car_id
+        WHERE c.user_id = ? AND c.deleted_at IS NULL
+    """, (user_id,))
+
+    dst.execute("BEGIN IMMEDIATE")
+    try:
+        # Расходы прежней копии удаляет trg_cars_delete_expenses
+        dst.execute("DELETE FROM cars WHERE user_id = ?", (user_id,))
+        dst.execute("DELETE FROM moved_users WHERE user_id = ?", (user_id,))
+        add_user_stub(dst, user_id, username, email)
+        dst.executemany("""
+            INSERT INTO cars (car_id, user_id, make, model, year, license_plate, fuel_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, cars)
+        # Строки идут из курсора src без загрузки всех расходов в память
+        copied = dst.executemany("""
+            INSERT INTO expenses (expense_id, car_id, day, amount_cents, currency, category, description)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, expenses).rowcount
+        # Та же версия данных - ETag ответов не меняется при переезде
+        dst.execute("UPDATE users SET data_version = ? WHERE user_id = ?", (version, user_id))
+        dst.commit()
+    except Exception:
+        dst.rollback()
+        raise
+    return version, len(cars), max(copied, 0)
+
+
+# Не больше 500 параметров на запрос
+CHUNK_SIZE = 500
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        yield chunk, ', '.join('?' * len(chunk))
+
+
+def active_cars(conn, user_id):
+    return conn.execute("""
+        SELECT car_id, user_id, make, model, year, license_plate, fuel_type
+        FROM cars WHERE user_id = ? AND deleted_at IS NULL ORDER BY car_id
+    """, (user_id,)).fetchall()
+
+
+def track_user(conn, user_id, tracking=True):
+    """Начать (или закончить) журнал изменённых расходов пользователя move_changes
+
+    Журнал ведут триггеры, пока пользователь есть в move_tracking.
+    """
+    if tracking:
+        conn.execute("INSERT OR IGNORE INTO move_tracking (user_id) VALUES (?)", (user_id,))
+    else:
+        conn.execute("DELETE FROM move_tracking WHERE user_id = ?", (user_id,))
+    conn.execute("DELETE FROM move_changes WHERE user_id = ?", (user_id,))
+
+
+def copy_changes(src, dst, user_id):
+    """Докопировать с src на dst расходы из журнала move_changes
+
+    Как copy_user, но переписываются только расходы, изменённые после начала
+    журнала; если изменились сами автомобили - копируется всё. Возвращает data_version.
+    """
+    cars = active_cars(src, user_id)
+    if cars != active_cars(dst, user_id):
+        return copy_user(src, dst, user_id)[0]
+
+    version = data_version(src, user_id)
+    changed = [row[0] for row in src.execute(
+        "SELECT expense_id FROM move_changes WHERE user_id = ?", (user_id,)
+    )]
+    rows = []
+    for chunk, placeholders in _chunks(changed):
+        # Удалённые с тех пор расходы не найдутся - на dst они просто удаляются
+        rows.extend(src.execute(f"""
+            SELECT e.expense_id, e.car_id, e.day, e.amount_cents, e.currency, e.category, e.description
+            FROM expenses e
+            JOIN cars c ON e.car_id = c.car_id
+            WHERE c.user_id = ? AND c.deleted_at IS NULL AND e.expense_id IN ({placeholders})
+        """, (user_id, *chunk)))
+
+    dst.execute("BEGIN IMMEDIATE")
+    try:
+        for chunk, placeholders in _chunks(changed):
+            dst.execute(f"DELETE FROM expenses WHERE expense_id IN ({placeholders})", chunk)
+        dst.executemany("""
+            INSERT INTO expenses (expense_id, car_id, day, amount_cents, currency, category, description)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        dst.execute("UPDATE users SET data_version = ? WHERE user_id = ?", (version, user_id))
+        dst.commit()
+    except Exception:
+        dst.rollback()
+        raise
+    return version
+
+
+def move_user(conns, user_id, source, target, attempts=3):
+    """Перенести пользователя с шарда source на target, не останавливая сервер
+
+    conns - {номер шарда: соединение}, conns[0] - основная БД (каталог).
+    Сначала данные копируются по снимку source, пока сервер продолжает в него
+    писать; изменения расходов за это время записывает журнал move_changes и
+    докопируются только они (до attempts раз, пока версия данных меняется).
+    Затем под блокировкой записи source докопируются последние изменения и
+    переезд отмечается в moved_users, и только после этого переключается каталог:
+    изменения, пришедшие на source до переключения, отклоняются с шардом из
+    moved_users (UserMoved). Если перенос прервался между этими шагами, повторный
+    вызов только переключит каталог. Строки на source остаются до release_user.
+    Возвращает (автомобилей, расходов).
+    """
+    src, dst = conns[source], conns[target]
+    moved = src.execute("SELECT shard FROM moved_users WHERE user_id = ?", (user_id,)).fetchone()
+    if moved is not None:
+        # Данные уже на шарде moved[0], не переключён только каталог
+        set_user_shard(conns[0], user_id, moved[0])
+        if moved[0] != target:
+            return move_user(conns, user_id, moved[0], target, attempts)
+        return len(active_cars(dst, user_id)), _count_expenses(dst, user_id)
+
+    src.execute("BEGIN IMMEDIATE")
+    track_user(src, user_id)
+    src.commit()
+    try:
+        src.execute("BEGIN")
+        try:
+            version = copy_user(src, dst, user_id)[0]
+        finally:
+            src.rollback()
+        for _ in range(attempts):
+            if data_version(src, user_id) == version:
+                break
+            src.execute("BEGIN")
+            try:
+                version = copy_changes(src, dst, user_id)
+            finally:
+                src.rollback()
+
+        src.execute("BEGIN IMMEDIATE")
+        try:
+            # Изменения, успевшие прийти после копии (сервер ждёт на блокировке)
+            if data_version(src, user_id) != version:
+                copy_changes(src, dst, user_id)
+            src.execute(
+                "INSERT OR REPLACE INTO moved_users (user_id, shard, moved_at) VALUES (?, ?, ?)",
+                (user_id, target, int(time.time()))
+            )
+            track_user(src, user_id, tracking=False)
+            if source == 0:
+                # Основная БД - тот же файл, что и шард 0: каталог пишется в той же транзакции
+                set_user_shard(src, user_id, target)
+            src.commit()
+        except Exception:
+            src.rollback()
+            raise
+    except Exception:
+        if not src.execute("SELECT 1 FROM moved_users WHERE user_id = ?", (user_id,)).fetchone():
+            track_user(src, user_id, tracking=False)
+        raise
+
+    if source != 0:
+        set_user_shard(conns[0], user_id, target)
+    return len(active_cars(dst, user_id)), _count_expenses(dst, user_id)
+
+
+def _count_expenses(conn, user_id):
+    return conn.execute("""
+        SELECT COUNT(*) FROM expenses e JOIN cars c ON e.car_id = c.car_id
+        WHERE c.user_id = ? AND c.deleted_at IS NULL
+    """, (user_id,)).fetchone()[0]
+
+
+def release_user(conn, user_id):
+    """Пометить удалёнными автомобили перенесённого пользователя на старом шарде
+
+    Строки удаляет purge; данные не трогаются, если пользователь уже вернулся на этот шард.
+    """
+    conn.execute("""
+        UPDATE cars SET deleted_at = ?
+        WHERE user_id = ? AND deleted_at IS NULL
+          AND EXISTS (SELECT 1 FROM moved_users WHERE user_id = ?)
+    """, (int(time.time()), user_id, user_id))
+
+
+def drop_user_stub(conn, user_id):
+    """Удалить строку, отчёты и задачи перенесённого пользователя со старого шарда после очистки
+
+    Не для шарда 0: там строка пользователя - его учётная запись.
+    """
+    dropped = conn.execute("""
+        DELETE FROM users
+        WHERE user_id = ? AND NOT EXISTS (SELECT 1 FROM cars WHERE user_id = ?)
+          AND EXISTS (SELECT 1 FROM moved_users WHERE user_id = ?)
+    """, (user_id, user_id, user_id)).rowcount
+    if dropped:
+        reports.forget_user(conn, user_id)
+
+
+def plan_moves(directory, ring, limit=None):
+    """Пользователи, чей шард не совпадает с кольцом: [(user_id, шард сейчас, шард по кольцу)]"""
+    moves = []
+    cursor = directory.execute("""
+        SELECT u.user_id, COALESCE(s.shard, 0)
+        FROM users u
+        LEFT JOIN user_shards s ON s.user_id = u.user_id
+        ORDER BY u.user_id
+    """)
+    for user_id, source in cursor:
+        target = ring.shard_for(user_id)
+        if target != source:
+            moves.append((user_id, source, target))
+            if limit is not None and len(moves) >= limit:
+                break
+    return moves
+
+
+def rebalance(conns, moves, grace=10, log=print):
+    """Перенести пользователей по плану plan_moves и очистить старые шарды
+
+    grace - пауза перед очисткой: не меньше SHARD_CACHE_TTL сервера, чтобы
+    процессы со старым размещением успели его обновить, не читая пустых данных.
+    """
+    for user_id, source, target in moves:
+        started = time.perf_counter()
+        cars, expenses = move_user(conns, user_id, source, target)
+        log(f"Пользователь {user_id}: шард {source} -> {target}, автомобилей {cars}, "
+            f"расходов {expenses} ({time.perf_counter() - started:.2f} с)")
+
+    if not moves:
+        return
+    time.sleep(grace)
+    sources = sorted({source for _, source, _ in moves})
+    for source in sources:
+        conn = conns[source]
+        moved = [user_id for user_id, from_shard, _ in moves if from_shard == source]
+        for user_id in moved:
+            release_user(conn, user_id)
+        cars, expenses = purge_database(conn)
+        if source != 0:
+            for user_id in moved:
+                drop_user_stub(conn, user_id)
+        log(f"Шард {source}: удалено автомобилей {cars}, расходов {expenses}")
+
+
+def connect(path):
+    """Соединение для командной строки: PRAGMA как у пула, транзакции вручную"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    for name, value in DEFAULT_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def shard_status(conns, ring):
+    """Пользователи, автомобили, расходы и размер файла по шардам"""
+    placed = dict(conns[0].execute("""
+        SELECT COALESCE(s.shard, 0), COUNT(*)
+        FROM users u
+        LEFT JOIN user_shards s ON s.user_id = u.user_id
+        GROUP BY 1
+    """).fetchall())
+    pending = len(plan_moves(conns[0], ring))
+    status = {}
+    for number, conn in conns.items():
+        path = conn.execute("PRAGMA database_list").fetchone()[2]
+        status[number] = {
+            'path': path,
+            'users': placed.get(number, 0),
+            'cars': conn.execute("SELECT COUNT(*) FROM cars WHERE deleted_at IS NULL").fetchone()[0],
+            'expenses': conn.execute("SELECT COUNT(*) FROM expenses").fetchone()[0],
+            'size_mb': round(os.path.getsize(path) / 1024 / 1024, 1),
+        }
+    return status, pending
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Шарды MyCarExpenses")
+    parser.add_argument("command", choices=("migrate", "status", "rebalance"))
+    parser.add_argument("databases", nargs='*',
+                        help="основная БД и дополнительные шарды (по умолчанию из настроек app.py)")
+    parser.add_argument("--limit", type=int, help="перенести не больше N пользователей")
+    parser.add_argument("--grace", type=float, default=10,
+                        help="пауза перед удалением старых копий, с (не меньше SHARD_CACHE_TTL)")
+    parser.add_argument("--dry-run", action="store_true", help="только показать план переноса")
+    args = parser.parse_args()
+
+    paths = args.databases
+    if not paths:
+        from app import app
+        paths = [app.config['DATABASE']] + list(app.config['SHARDS'])
+
+    conns = {number: connect(path) for number, path in enumerate(paths)}
+    for number, conn in conns.items():
+        applied = init_shard(conn, number)
+        if applied:
+            print(f"Шард {number} ({paths[number]}): применены миграции {', '.join(map(str, applied))}")
+    ring = HashRing(range(len(paths)))
+
+    if args.command == 'status':
+        status, pending = shard_status(conns, ring)
+        for number, info in status.items():
+            print(f"Шард {number}: {info['path']}, пользователей {info['users']}, "
+                  f"автомобилей {info['cars']}, расходов {info['expenses']}, {info['size_mb']} МБ")
+        print(f"Ждут переноса по кольцу: {pending}")
+    elif args.command == 'rebalance':
+        moves = plan_moves(conns[0], ring, args.limit)
+        print(f"Пользователей к переносу: {len(moves)}")
+        if args.dry_run:
+            for user_id, source, target in moves:
+                print(f"  {user_id}: {source} -> {target}")
+        else:
+            rebalance(conns, moves, args.grace)
+
+    for conn in conns.values():
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Преобразование сумм и дат между API и БД MyCarExpenses
+В БД суммы хранятся целым числом копеек (amount_cents), даты - номером дня
+от 1970-01-01 (day), месяцы агрегатов - номером месяца year * 12 + month - 1.
+В API по-прежнему число с двумя знаками и строка 'YYYY-MM-DD'.
+"""
+
+import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+DEFAULT_CURRENCY = 'BYN'
+
+# Номер месяца по номеру дня в SQL (для триггеров и пересчёта агрегатов)
+MONTH_OF_DAY_SQL = (
+    "(CAST(strftime('%Y', {day} * 86400, 'unixepoch') AS INTEGER) * 12"
+    " + CAST(strftime('%m', {day} * 86400, 'unixepoch') AS INTEGER) - 1)"
+)
+
+
+def to_cents(amount):
+    """Сумма из API (число или строка) в копейки, ValueError если это не число"""
+    if isinstance(amount, bool):
+        raise ValueError('Сумма должна быть числом')
+    try:
+        value = Decimal(str(amount))
+    except InvalidOperation:
+        raise ValueError('Сумма должна быть числом')
+    if not value.is_finite():
+        raise ValueError('Сумма должна быть числом')
+    return int((value * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    return cents / 100
+
+
+def to_day(value):
+    """Дата 'YYYY-MM-DD' в номер дня, ValueError при другом формате"""
+    if not isinstance(value, str) or len(value) != 10:
+        raise ValueError('Дата должна быть в формате YYYY-MM-DD')
+    try:
+        return datetime.date.fromisoformat(value).toordinal() - EPOCH_ORDINAL
+    except ValueError:
+        raise ValueError('Дата должна быть в формате YYYY-MM-DD')
+
+
+def parse_day(value):
+    """Необязательный параметр даты: None для пустого значения"""
+    return to_day(value) if value else None
+
+
+@lru_cache(maxsize=65536)
+def from_day(day):
+    return datetime.date.fromordinal(day + EPOCH_ORDINAL).isoformat()
+
+
+def month_of_day(day):
+    date = datetime.date.fromordinal(day + EPOCH_ORDINAL)
+    return date.year * 12 + date.month - 1
+
+
+def month_label(month):
+    """Номер месяца в строку 'YYYY-MM'"""
+    return f'{month // 12:04d}-{month % 12 + 1:02d}'
+
+
+def parse_month(value):
+    """Необязательный параметр месяца 'YYYY-MM' в номер месяца; None для пустого значения"""
+    if not value:
+        return None
+    try:
+        year, month = value.split('-')
+        if len(year) != 4 or len(month) != 2 or not 1 <= int(month) <= 12:
+            raise ValueError
+        return int(year) * 12 + int(month) - 1
+    except ValueError:
+        raise ValueError('Месяц должен быть в формате YYYY-MM')
+
+
+def month_first_day(month):
+    return datetime.date(month // 12, month % 12 + 1, 1).toordinal() - EPOCH_ORDINAL
+
+
+def month_last_day(month):
+    return month_first_day(month + 1) - 1
+
+
+def to_currency(value):
+    """Код валюты ISO 4217 (три латинские буквы); по умолчанию DEFAULT_CURRENCY
+
+    Аналитика, отчёты и помесячные агрегаты складывают суммы без разделения
+    по валютам, поэтому пока принимается только DEFAULT_CURRENCY.
+    """
+    if value is None or value == '':
+        return DEFAULT_CURRENCY
+    if not isinstance(value, str) or len(value) != 3 or not value.isalpha() or not value.isascii():
+        raise ValueError('Валюта должна быть трехбуквенным кодом (например, BYN)')
+    currency = value.upper()
+    if currency != DEFAULT_CURRENCY:
+        raise ValueError(f'Поддерживается только валюта {DEFAULT_CURRENCY}')
+    return currency
@@ -0,0 +1,153 @@
+"""
+Единственный писатель для MyCarExpenses
+SQLite допускает одного писателя, поэтому изменения из всех потоков процесса
+ставятся в очередь, а отдельный поток применяет их пачками: несколько изменений
+фиксируются одной транзакцией (group commit), каждый запрос ждёт свой результат.
+Очередь своя у каждого процесса: под serve.py с несколькими процессами их
+писатели по-прежнему соревнуются за блокировку записи SQLite (busy_timeout)
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+
+class WriterBusy(Exception):
+    """Очередь записи переполнена или изменение не выполнено за timeout"""
+
+
+class WriteQueue:
+    """Очередь изменений и поток, применяющий их групповыми транзакциями
+
+    submit(func, *args) выполняет func(conn, *args) в потоке писателя и
+    возвращает её результат после фиксации транзакции. Пачка собирается,
+    пока в ней меньше max_batch изменений и с прихода первого прошло не больше
+    max_delay секунд. Каждое изменение выполняется в своей точке сохранения:
+    ошибка откатывает только его и передаётся вызвавшему запросу, остальные
+    изменения пачки фиксируются. Если результат не получен за timeout секунд,
+    submit бросает WriterBusy; изменение остаётся в очереди и может быть
+    зафиксировано позже.
+
+    connect - функция без аргументов, возвращающая соединение писателя,
+    release - функция, которой соединение возвращается при остановке.
+    """
+
+    def __init__(self, connect, release=None, max_batch=256, max_delay=0.002,
+                 max_pending=10000, timeout=30):
+        self.connect = connect
+        self.release = release
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self._queue = queue.Queue(max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'writes': 0,
+            'errors': 0,
+            'batches': 0,
+            'max_batch_seen': 0,
+        }
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, func, *args):
+        """Выполнить изменение и дождаться результата (или исключения)"""
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((func, args, future))
+        except queue.Full:
+            raise WriterBusy()
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise WriterBusy()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                # Всё, что уже в очереди, берём без ожидания
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if job is None:
+                # Остановка: дописываем собранное и выходим
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        conn = self.connect()
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    break
+                self._apply(conn, self._collect(job))
+        finally:
+            if self.release is not None:
+                self.release(conn)
+
+    def _apply(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, args, future in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((future, True, func(conn, *args)))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((future, False, e))
+            conn.commit()
+        except Exception as e:
+            # Транзакция не зафиксирована - ошибка у всей пачки
+            if conn.in_transaction:
+                conn.rollback()
+            results = [(future, False, e) for _, _, future in batch]
+
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['max_batch_seen'] = max(self._stats['max_batch_seen'], len(batch))
+            for _, ok, _ in results:
+                self._stats['writes' if ok else 'errors'] += 1
+
+        for future, ok, value in results:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def close(self):
+        """Дописать очередь и остановить поток писателя"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+        result['pending'] = self._queue.qsize()
+        result['avg_batch'] = 0
+        if result['batches']:
+            result['avg_batch'] = round((result['writes'] + result['errors']) / result['batches'], 2)
+        return result
@@ -19,6 +19,10 @@ const appState = {
     token: null,
     cars: [],
     expenses: [],
+    summary: null,
+    recentExpensesCount: 5,
+    expensesCursor: null,
+    expensesPageSize: 50,
     editingExpenseId: null,
     confirmCallback: null,
     charts: {},
@@ -110,6 +114,17 @@ class ApiClient {
         return response;
     }
 
+    static async getDashboard(filters = {}) {
+        console.log('🏠 Fetching dashboard with filters:', filters);
+        const params = new URLSearchParams();
+        if (filters.start_date) params.append('start_date', filters.start_date);
+        if (filters.end_date) params.append('end_date', filters.end_date);
+        if (filters.limit) params.append('limit', filters.limit);
+
+        const query = params.toString() ? `?${params.toString()}` : '';
+        return this.request(`/dashboard${query}`);
+    }
+
     static async getCars() {
         console.log('🚗 Fetching cars...');
         return this.request('/cars');
@@ -130,18 +145,42 @@ class ApiClient {
         });
     }
 
-    static async getExpenses(filters = {}) {
-        console.log('💰 Fetching expenses with filters:', filters);
+    static async getExpenses(filters = {}, page = {}) {
+        console.log('💰 Fetching expenses with filters:', filters, page);
         const params = new URLSearchParams();
         if (filters.car_id) params.append('car_id', filters.car_id);
         if (filters.start_date) params.append('start_date', filters.start_date);
         if (filters.end_date) params.append('end_date', filters.end_date);
         if (filters.category) params.append('category', filters.category);
+        // Постраничная загрузка: ответ {items, next_cursor}
+        if (page.limit) params.append('limit', page.limit);
+        if (page.cursor) params.append('cursor', page.cursor);
+        if (page.fields) params.append('fields', page.fields.join(','));
 
         const query = params.toString() ? `?${params.toString()}` : '';
         return this.request(`/expenses${query}`);
     }
 
+    static async exportExpenses(format = 'csv', filters = {}) {
+        console.log('📥 Exporting expenses:', format, filters);
+        const params = new URLSearchParams({ format });
+        if (filters.car_id) params.append('car_id', filters.car_id);
+        if (filters.start_date) params.append('start_date', filters.start_date);
+        if (filters.end_date) params.append('end_date', filters.end_date);
+        if (filters.category) params.append('category', filters.category);
+
+        const response = await fetch(`${API_BASE_URL}/expenses/export?${params.toString()}`, {
+            headers: { 'Authorization': `Bearer ${appState.token}` }
+        });
+
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.message || `HTTP ${response.status}`);
+        }
+
+        return response.blob();
+    }
+
     static async addExpense(expenseData) {
         console.log('➕ Adding expense:', expenseData);
         return this.request('/expenses', {
@@ -175,6 +214,29 @@ class ApiClient {
         const query = params.toString() ? `?${params.toString()}` : '';
         return this.request(`/analytics/summary${query}`);
     }
+
+    static async getTimeseries(filters = {}) {
+        console.log('📈 Fetching monthly timeseries with filters:', filters);
+        const params = new URLSearchParams();
+        if (filters.car_id) params.append('car_id', filters.car_id);
+        if (filters.start_date) params.append('start_date', filters.start_date);
+        if (filters.end_date) params.append('end_date', filters.end_date);
+        if (filters.category) params.append('category', filters.category);
+
+        const query = params.toString() ? `?${params.toString()}` : '';
+        return this.request(`/analytics/timeseries${query}`);
+    }
+
+    static async getByCar(filters = {}) {
+        console.log('🚗 Fetching expenses by car with filters:', filters);
+        const params = new URLSearchParams();
+        if (filters.start_date) params.append('start_date', filters.start_date);
+        if (filters.end_date) params.append('end_date', filters.end_date);
+        if (filters.category) params.append('category', filters.category);
+
+        const query = params.toString() ? `?${params.toString()}` : '';
+        return this.request(`/analytics/by-car${query}`);
+    }
 }
 
 // ========================================
@@ -202,8 +264,8 @@ class App {
             this.state.currentUser = JSON.parse(savedUser);
             console.log('✅ Session restored:', this.state.currentUser);
             this.setupEventListeners();
+            // Данные для главной страницы загрузит renderDashboard
             this.navigateTo('dashboard');
-            this.loadData();
         } else {
             console.log('ℹ️ No saved session, showing login page');
             this.setupEventListeners();
@@ -239,22 +301,55 @@ class App {
     async loadData() {
         console.log('📦 Loading user data...');
         try {
-            const [cars, expenses] = await Promise.all([
-                ApiClient.getCars(),
-                ApiClient.getExpenses()
-            ]);
+            // Автомобили, последние расходы и сводка за текущий месяц - одним запросом.
+            // Период задаёт только сводку: последние расходы берутся без диапазона дат
+            const dashboard = await ApiClient.getDashboard({
+                ...this.getCurrentMonthRange(),
+                limit: this.state.recentExpensesCount
+            });
 
-            this.state.cars = cars;
-            this.state.expenses = expenses;
+            this.state.cars = dashboard.cars;
+            this.state.expenses = dashboard.expenses.items;
+            this.state.expensesCursor = dashboard.expenses.next_cursor;
+            this.state.summary = dashboard.summary;
             console.log('✅ Data loaded:', {
-                cars: cars.length,
-                expenses: expenses.length
+                cars: dashboard.cars.length,
+                expenses: dashboard.expenses.items.length,
+                hasMore: !!dashboard.expenses.next_cursor
             });
         } catch (error) {
             console.error('❌ Failed to load data:', error);
         }
     }
 
+    getCurrentMonthRange() {
+        const now = new Date();
+        return {
+            start_date: new Date(now.getFullYear(), now.getMonth(), 1).toISOString().split('T')[0],
+            end_date: new Date(now.getFullYear(), now.getMonth() + 1, 0).toISOString().split('T')[0]
+        };
+    }
+
+    async loadMoreExpenses() {
+        if (!this.state.expensesCursor) return;
+
+        console.log('📦 Loading next page of expenses...');
+        try {
+            // Курсор дашборда продолжает список без фильтров, поэтому и запрос без фильтров
+            const page = await ApiClient.getExpenses({}, {
+                limit: this.state.expensesPageSize,
+                cursor: this.state.expensesCursor
+            });
+
+            this.state.expenses = this.state.expenses.concat(page.items);
+            this.state.expensesCursor = page.next_cursor;
+            const list = document.getElementById('expenses-list');
+            if (list) list.innerHTML = this.renderExpensesList();
+        } catch (error) {
+            console.error('❌ Failed to load more expenses:', error);
+        }
+    }
+
     navigateTo(page) {
         console.log('🧭 Navigating to:', page);
         this.state.currentPage = page;
@@ -390,14 +485,12 @@ class App {
 
     async renderDashboard() {
         const currentMonth = new Date().toLocaleDateString('ru-RU', { month: 'long' });
-        const currentMonthStart = new Date(new Date().getFullYear(), new Date().getMonth(), 1).toISOString().split('T')[0];
-        const currentMonthEnd = new Date(new Date().getFullYear(), new Date().getMonth() + 1, 0).toISOString().split('T')[0];
 
         try {
-            const summary = await ApiClient.getSummary({
-                start_date: currentMonthStart,
-                end_date: currentMonthEnd
-            });
+            if (!this.state.summary) {
+                await this.loadData();
+            }
+            const summary = this.state.summary;
 
             const app = document.getElementById('app');
             app.innerHTML = `
@@ -435,8 +528,8 @@ class App {
                         <div class="card-header">
                             <h3 class="card-title">Последние расходы</h3>
                         </div>
-                        <div class="expenses-list">
-                            ${this.renderRecentExpenses(this.state.expenses.slice(-5).reverse())}
+                        <div class="expenses-list" id="expenses-list">
+                            ${this.renderExpensesList()}
                         </div>
                     </div>
                 </div>
@@ -468,6 +561,31 @@ class App {
         return `<div class="category-list">${items}</div>`;
     }
 
+    renderCarBreakdown(cars) {
+        if (!cars || cars.length === 0) {
+            return '<div class="empty-state"><p>Нет автомобилей</p></div>';
+        }
+
+        const items = cars.map(car => `
+            <div class="category-item">
+                <div class="category-info">
+                    <div class="category-icon">🚗</div>
+                    <div class="category-name">${car.make} ${car.model} (${car.total_count})</div>
+                </div>
+                <div class="category-amount">${this.formatCurrency(car.total_amount)}</div>
+            </div>
+        `).join('');
+
+        return `<div class="category-list">${items}</div>`;
+    }
+
+    renderExpensesList() {
+        const more = this.state.expensesCursor ? `
+            <button class="btn btn-primary btn-full" onclick="app.loadMoreExpenses()">Показать еще</button>
+        ` : '';
+        return this.renderRecentExpenses(this.state.expenses) + more;
+    }
+
     renderRecentExpenses(expenses) {
         if (expenses.length === 0) {
             return '<div class="empty-state"><p>Нет расходов</p></div>';
@@ -491,7 +609,12 @@ class App {
 
     async renderAnalytics() {
         try {
-            const summary = await ApiClient.getSummary();
+            // Все разрезы считает сервер, сырые расходы в браузер не загружаются
+            const [summary, timeseries, byCar] = await Promise.all([
+                ApiClient.getSummary(),
+                ApiClient.getTimeseries(),
+                ApiClient.getByCar()
+            ]);
 
             const app = document.getElementById('app');
             app.innerHTML = `
@@ -521,16 +644,35 @@ class App {
                         </div>
                     </div>
 
+                    <div class="card">
+                        <div class="card-header">
+                            <h3 class="card-title">Расходы по месяцам</h3>
+                        </div>
+                        <div class="chart-container" style="height: 300px;">
+                            <canvas id="monthly-bar-chart"></canvas>
+                        </div>
+                    </div>
+
                     <div class="card">
                         <div class="card-header">
                             <h3 class="card-title">Детали по категориям</h3>
                         </div>
                         ${this.renderCategoryBreakdown(summary.by_category)}
                     </div>
+
+                    <div class="card">
+                        <div class="card-header">
+                            <h3 class="card-title">По автомобилям</h3>
+                        </div>
+                        ${this.renderCarBreakdown(byCar)}
+                    </div>
                 </div>
             `;
 
-            setTimeout(() => this.renderPieChart('category-pie-chart', summary.by_category), 100);
+            setTimeout(() => {
+                this.renderPieChart('category-pie-chart', summary.by_category);
+                this.renderBarChart('monthly-bar-chart', timeseries.months);
+            }, 100);
         } catch (error) {
             console.error('Ошибка загрузки аналитики:', error);
         }
@@ -630,28 +772,31 @@ class App {
         console.log('👋 Logging out...');
         this.state.currentUser = null;
         this.state.token = null;
+        this.state.cars = [];
+        this.state.expenses = [];
+        this.state.summary = null;
         localStorage.removeItem('token');
         localStorage.removeItem('user');
         this.navigateTo('login');
     }
 
-    exportData() {
+    async exportData() {
         console.log('📥 Exporting data...');
-        let csv = 'Дата,Категория,Сумма,Описание\n';
-
-        this.state.expenses.forEach(expense => {
-            csv += `${this.formatDate(expense.date)},${expense.category},${expense.amount},"${expense.description || ''}"\n`;
-        });
-
-        const blob = new Blob([csv], { type: 'text/csv;charset=utf-8;' });
-        const link = document.createElement('a');
-        const url = URL.createObjectURL(blob);
-        link.setAttribute('href', url);
-        link.setAttribute('download', 'my_car_expenses.csv');
-        link.style.visibility = 'hidden';
-        document.body.appendChild(link);
-        link.click();
-        document.body.removeChild(link);
+        try {
+            // Файл формирует сервер потоком, без загрузки всех расходов в браузер
+            const blob = await ApiClient.exportExpenses('csv');
+            const link = document.createElement('a');
+            const url = URL.createObjectURL(blob);
+            link.setAttribute('href', url);
+            link.setAttribute('download', 'my_car_expenses.csv');
+            link.style.visibility = 'hidden';
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+            URL.revokeObjectURL(url);
+        } catch (error) {
+            alert('Ошибка экспорта: ' + error.message);
+        }
     }
 
     openExpenseModal(expenseId = null) {
@@ -818,6 +963,35 @@ class App {
         });
     }
 
+    renderBarChart(canvasId, months) {
+        const canvas = document.getElementById(canvasId);
+        if (!canvas) return;
+
+        if (this.state.charts[canvasId]) {
+            this.state.charts[canvasId].destroy();
+        }
+
+        this.state.charts[canvasId] = new Chart(canvas, {
+            type: 'bar',
+            data: {
+                labels: months.map(m => m.month),
+                datasets: [{
+                    label: 'Расходы',
+                    data: months.map(m => m.total_amount),
+                    backgroundColor: '#1FB8CD',
+                    borderWidth: 0
+                }]
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                plugins: {
+                    legend: { display: false }
+                }
+            }
+        });
+    }
+
     formatCurrency(amount) {
         return `${amount.toFixed(2)} BYN`;
     }
@@ -0,0 +1,50 @@
+"""
+Тесты аналитики: среднее за месяц одинаково в сводке и помесячном ряду
+Запуск: python -m pytest tests
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+import analytics
+from migrations import migrate
+from units import to_day
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    conn.execute("INSERT INTO users (user_id, username, email, hashed_password) VALUES (1, 'u', 'u@x', '')")
+    conn.execute("INSERT INTO cars (car_id, user_id, make, model) VALUES (1, 1, 'VAZ', '07')")
+    # Январь и март, в феврале расходов нет
+    conn.executemany(
+        "INSERT INTO expenses (car_id, day, amount_cents, category) VALUES (1, ?, ?, 'Топливо')",
+        [(to_day('2024-01-10'), 10000), (to_day('2024-03-10'), 20000)]
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_average_per_month_counts_gap_months(conn):
+    summary = analytics.summary(conn, 1)
+    series = analytics.timeseries(conn, 1)
+
+    assert [item['month'] for item in series['months']] == ['2024-01', '2024-02', '2024-03']
+    assert series['months'][1]['total_amount'] == 0
+    assert summary['average_per_month'] == series['average_per_month'] == 100.0
+
+
+def test_average_per_month_uses_calendar_months_of_period(conn):
+    start, end = to_day('2024-01-01'), to_day('2024-06-30')
+    summary = analytics.summary(conn, 1, start_day=start, end_day=end)
+    series = analytics.timeseries(conn, 1, start_day=start, end_day=end)
+
+    assert len(series['months']) == 6
+    assert summary['average_per_month'] == series['average_per_month'] == 50.0